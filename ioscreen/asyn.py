@@ -6,6 +6,9 @@ from .coremedia.CMSampleBuffer import CMSampleBuffer
 from .coremedia.CMTime import CMTime
 from .coremedia.common import NSNumber
 from .coremedia.serialize import SerializeStringKeyDict, parse_key_value_dict, parse_header
+from .template import PacketTemplate
+
+asynHeaderStruct = struct.Struct('<IIQI')  # length, magic, clockRef, messageType
 
 
 def parse_asyn_header(buffer, message_magic):
@@ -28,16 +31,24 @@ class AyncConst(enum.IntEnum):
     HPA0 = 0x68706130
 
 
-def create_hpd1_device():
+def create_hpd1_device(width=1920, height=1200, valeria=True, hevcDecoderSupports444=True, extra=None):
+    """ HPD1 设备信息
+    :param width: 请求的 DisplaySize，设备按该尺寸编码视频
+    :param height:
+    :param extra: 追加或覆盖的其它键
+    :return:
+    """
     resultDict = {
-        'Valeria': True,
-        'HEVCDecoderSupports444': True
+        'Valeria': valeria,
+        'HEVCDecoderSupports444': hevcDecoderSupports444
     }
     displaySizeDict = {
-        'Width': NSNumber(6, 1920),
-        'Height': NSNumber(6, 1200),
+        'Width': NSNumber(6, float(width)),
+        'Height': NSNumber(6, float(height)),
     }
     resultDict['DisplaySize'] = displaySizeDict
+    if extra:
+        resultDict.update(extra)
     return resultDict
 
 
@@ -57,47 +68,45 @@ def create_hpa1_device():
 
 
 def new_asyn_dict_packet(stringKeyDict, subtypeMarker, asynTypeHeader):
-    serialize = SerializeStringKeyDict(stringKeyDict).to_bytes()
-    _length = len(serialize) + 20
-    packet_bytes = b''
-    packet_bytes += struct.pack('<I', _length)
-    packet_bytes += struct.pack('<I', AyncConst.AsyncPacketMagic)
-    packet_bytes += struct.pack('<Q', asynTypeHeader)
-    packet_bytes += struct.pack('<I', subtypeMarker)
-    packet_bytes += serialize
-    return packet_bytes
+    serialize = SerializeStringKeyDict(stringKeyDict)
+    _length = serialize.size() + 20
+    packet_bytes = bytearray(_length)
+    asynHeaderStruct.pack_into(packet_bytes, 0, _length, AyncConst.AsyncPacketMagic, asynTypeHeader, subtypeMarker)
+    serialize.pack_into(packet_bytes, 20)
+    return bytes(packet_bytes)
+
+
+def new_asyn_dict_template(stringKeyDict, subtypeMarker):
+    """ 字典只序列化一次, 发送时只改写 clockRef
+    """
+    return PacketTemplate(new_asyn_dict_packet(stringKeyDict, subtypeMarker, 0), clockRef=(8, '<Q'))
+
+
+def new_asyn_template(subtypeMarker):
+    return PacketTemplate(asynHeaderStruct.pack(20, AyncConst.AsyncPacketMagic, 0, subtypeMarker), clockRef=(8, '<Q'))
 
 
 def asyn_need_packet_bytes(clockRef):
-    packet_bytes = b''
-    packet_bytes += struct.pack('<I', 20)
-    packet_bytes += struct.pack('<I', AyncConst.AsyncPacketMagic)
-    packet_bytes += struct.pack('<Q', clockRef)
-    packet_bytes += struct.pack('<I', AyncConst.NEED)
-    return packet_bytes
+    return needTemplate.render(clockRef=clockRef)
 
 
 def asyn_hpa0(clockRef):
-    packet_bytes = b''
-    packet_bytes += struct.pack('<I', 20)
-    packet_bytes += struct.pack('<I', AyncConst.AsyncPacketMagic)
-    packet_bytes += struct.pack('<Q', clockRef)
-    packet_bytes += struct.pack('<I', AyncConst.HPA0)
-    return packet_bytes
+    return hpa0Template.render(clockRef=clockRef)
 
 
 def asyn_hpd0():
-    packet_bytes = b''
-    packet_bytes += struct.pack('<I', 20)
-    packet_bytes += struct.pack('<I', AyncConst.AsyncPacketMagic)
-    packet_bytes += struct.pack('<Q', 1)
-    packet_bytes += struct.pack('<I', AyncConst.HPD0)
-    return packet_bytes
+    return hpd0Template.render()
+
+
+needTemplate = new_asyn_template(AyncConst.NEED)
+hpa0Template = new_asyn_template(AyncConst.HPA0)
+hpd0Template = new_asyn_template(AyncConst.HPD0).bind(clockRef=1)
 
 
 # ------------------- AyncPacket ——————————————————————
 
 class AyncPacket:
+    __slots__ = ('ClockRef',)
     messageMagic = None
 
     def __init__(self, ClockRef):
@@ -113,20 +122,26 @@ class AyncPacket:
 
 
 class AsynCmSampleBufPacket(AyncPacket):
+    __slots__ = ('CMSampleBuf',)
 
     def __init__(self, ClockRef, CMSampleBuf):
         super().__init__(ClockRef)
         self.CMSampleBuf: CMSampleBuffer = CMSampleBuf
 
     @classmethod
-    def from_bytes(self, buffer):
-        magic = struct.unpack('<I', buffer[12:16])[0]
+    def from_bytes(self, buffer, formatCache=None, fields=None):
+        """
+        :param formatCache: 会话内共享的 FormatDescriptorCache
+        :param fields: consumer 需要的 CMSampleBuffer 字段
+        """
+        buffer = memoryview(buffer)
+        magic = struct.unpack_from('<I', buffer, 12)[0]
         _, clockRef = parse_asyn_header(buffer, magic)
 
         if magic == AyncConst.FEED:
-            CMSampleBuf = CMSampleBuffer.from_bytesVideo(buffer[16:])
+            CMSampleBuf = CMSampleBuffer.from_bytesVideo(buffer[16:], formatCache, fields)
         else:
-            CMSampleBuf = CMSampleBuffer.from_bytesAudio(buffer[16:])
+            CMSampleBuf = CMSampleBuffer.from_bytesAudio(buffer[16:], formatCache, fields)
         return self(clockRef, CMSampleBuf)
 
     def __str__(self):
@@ -134,6 +149,7 @@ class AsynCmSampleBufPacket(AyncPacket):
 
 
 class AsynRelsPacket(AyncPacket):
+    __slots__ = ()
     messageMagic = AyncConst.RELS
 
     def __init__(self, ClockRef):
@@ -145,6 +161,7 @@ class AsynRelsPacket(AyncPacket):
 
 
 class AsynSprpPacket(AyncPacket):
+    __slots__ = ('Property',)
     messageMagic = AyncConst.SPRP
 
     def __init__(self, ClockRef, Property):
@@ -163,6 +180,7 @@ class AsynSprpPacket(AyncPacket):
 
 
 class AsynSratPacket(AyncPacket):
+    __slots__ = ('Rate1', 'Rate2', 'Time')
     messageMagic = AyncConst.SRAT
 
     def __init__(self, ClockRef, Rate1, Rate2, Time):
@@ -185,6 +203,7 @@ class AsynSratPacket(AyncPacket):
 
 
 class AsynTbasPacket(AyncPacket):
+    __slots__ = ('SomeOtherRef',)
     messageMagic = AyncConst.TBAS
 
     def __init__(self, ClockRef, SomeOtherRef):
@@ -203,6 +222,7 @@ class AsynTbasPacket(AyncPacket):
 
 
 class AsynTjmpPacket(AyncPacket):
+    __slots__ = ('Unknown',)
     messageMagic = AyncConst.TJMP
 
     def __init__(self, ClockRef, Unknown):
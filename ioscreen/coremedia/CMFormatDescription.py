@@ -1,10 +1,14 @@
 # iOS Frameworks
 # https://github.com/phracker/MacOSX-SDKs/blob/master/MacOSX10.9.sdk/System/Library/Frameworks/CoreMedia.framework/Versions/A/Headers/CMFormatDescription.h
 import enum
+import logging
 import struct
+from collections import OrderedDict
 
 from .AudioStream import AudioStreamBasicDescription
-from .serialize import parse_length_magic, new_dictionary_from_bytes
+from .serialize import parse_length_magic, new_dictionary_from_bytes, register_value_parser
+
+logger = logging.getLogger("ioscreen")
 
 
 class DescriptorConst(enum.IntEnum):
@@ -20,6 +24,8 @@ class DescriptorConst(enum.IntEnum):
 
 
 class FormatDescriptor:
+    __slots__ = ('MediaType', 'VideoDimensionWidth', 'VideoDimensionHeight', 'Codec', 'Extensions', 'PPS', 'SPS',
+                 'AudioStreamBasicDescription')
 
     def __init__(self, MediaType=None, VideoDimensionWidth=None, VideoDimensionHeight=None, Codec=None, Extensions=None,
                  PPS=None, SPS=None, AudioStream=None):
@@ -48,6 +54,14 @@ class FormatDescriptor:
             return cls(MediaType=DescriptorConst.MediaTypeVideo, Extensions=Extensions, PPS=pps, SPS=sps, Codec=codec,
                        VideoDimensionHeight=videoDimensionHeight, VideoDimensionWidth=videoDimensionWidth)
 
+    def signature(self):
+        """ 比较两个格式是否相同时使用的字段
+        """
+        if self.MediaType == DescriptorConst.MediaTypeVideo:
+            return self.MediaType, self.VideoDimensionWidth, self.VideoDimensionHeight, self.Codec, \
+                   bytes(self.PPS), bytes(self.SPS)
+        return self.MediaType, bytes(self.AudioStreamBasicDescription)
+
     def __str__(self):
         if self.MediaType == DescriptorConst.MediaTypeVideo:
             return f'FormatDescriptor >>MediaType:{self.MediaType}, VideoDimension:({self.VideoDimensionWidth}x{self.VideoDimensionHeight}),' \
@@ -55,6 +69,51 @@ class FormatDescriptor:
         return f'FormatDescriptor >> MediaType:{self.MediaType}, AudioStreamBasicDescription: {self.AudioStreamBasicDescription} '
 
 
+class FormatDescriptorCache:
+    """ 设备在每个关键帧都会重复发送相同的 fdsc 原子, 按原始字节缓存解析结果 (LRU)
+    每个会话使用一个实例, 记录每种媒体类型上一次的 SPS/PPS/分辨率, 用来判断格式是否真的变化
+
+    :param maxSize: 最多缓存的 FormatDescriptor 个数
+    """
+
+    def __init__(self, maxSize=8):
+        self.maxSize = maxSize
+        self._cache = OrderedDict()
+        self._current = {}  # mediaType -> 当前格式
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, buf):
+        """
+        :param buf: 完整的 fdsc 原子
+        :return: (FormatDescriptor, 格式是否变化)
+        """
+        key = bytes(buf)
+        descriptor = self._cache.get(key)
+        if descriptor is None:
+            self.misses += 1
+            descriptor = FormatDescriptor.from_bytes(key)
+            self._cache[key] = descriptor
+            if len(self._cache) > self.maxSize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        signature = descriptor.signature()
+        changed = self._current.get(descriptor.MediaType) != signature
+        if changed:
+            self._current[descriptor.MediaType] = signature
+            logger.debug(f'format changed: {descriptor}')
+        return descriptor, changed
+
+
+def parse_format_descriptor_value(buf, offset, end):
+    return FormatDescriptor.from_bytes(buf[offset:end])
+
+
+register_value_parser(DescriptorConst.FormatDescriptorMagic, parse_format_descriptor_value)
+
+
 def parse_media_type(buf):
     length, _, = parse_length_magic(buf, DescriptorConst.MediaTypeMagic)
     mediaType = struct.unpack('<I', buf[8:12])[0]
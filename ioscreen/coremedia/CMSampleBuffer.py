@@ -2,10 +2,16 @@
 # https://github.com/phracker/MacOSX-SDKs/blob/master/MacOSX10.9.sdk/System/Library/Frameworks/CoreMedia.framework/Versions/A/Headers/CMSampleBuffer.h
 import enum
 import struct
+import sys
+from array import array
 
-from .CMFormatDescription import DescriptorConst, FormatDescriptor
-from .CMTime import CMTimeConst, CMTime
-from .serialize import parse_length_magic, new_dictionary_from_bytes, DictConst
+from .CMFormatDescription import DescriptorConst, FormatDescriptor, FormatDescriptorCache
+from .CMTime import CMTimeConst, CMTime, ClockRate90kHz, rescale_values
+from .nalu import get_nalu_details
+from .serialize import new_dictionary_from_bytes, DictConst
+
+lengthMagicStruct = struct.Struct('<II')
+uint32Struct = struct.Struct('<I')
 
 
 class CMSampleConst(enum.IntEnum):
@@ -20,7 +26,18 @@ class CMSampleConst(enum.IntEnum):
     cmSampleTimingInfoLength = 3 * CMTimeConst.CMTimeLengthInBytes
 
 
+# 原子遍历时直接与 int 比较，避免每个原子都走一次枚举成员查找
+_sbuf, _opts, _stia, _sdat, _satt, _sary, _ssiz, _nsmp = (
+    int(CMSampleConst.sbuf), int(CMSampleConst.opts), int(CMSampleConst.stia), int(CMSampleConst.sdat),
+    int(CMSampleConst.satt), int(CMSampleConst.sary), int(CMSampleConst.ssiz), int(CMSampleConst.nsmp))
+_fdsc = int(DescriptorConst.FormatDescriptorMagic)
+_timingInfoLength = int(CMSampleConst.cmSampleTimingInfoLength)
+_cmTimeLength = int(CMTimeConst.CMTimeLengthInBytes)
+
+
 class SampleTimingInfo:
+    __slots__ = ('Duration', 'PresentationTimeStamp', 'DecodeTimeStamp')
+
     def __init__(self, Duration, PresentationTimeStamp, DecodeTimeStamp):
         self.Duration = Duration  # 创建时间
         self.PresentationTimeStamp = PresentationTimeStamp  # 提交时间
@@ -31,126 +48,287 @@ class SampleTimingInfo:
                f'DecodeTimeStamp:{self.DecodeTimeStamp}'
 
 
+class SampleTimingTable:
+    """ stia 原子, 每个 sample 三个 CMTime, 按 Duration/PresentationTimeStamp/DecodeTimeStamp 顺序平铺存放在:
+    Values array('q'), Scales array('i'), Flags array('I'), Epochs array('q')
+    下标访问时才创建 SampleTimingInfo, 批量换算使用 rescale/seconds
+    """
+    __slots__ = ('Values', 'Scales', 'Flags', 'Epochs')
+    Duration = 0
+    PresentationTimeStamp = 1
+    DecodeTimeStamp = 2
+
+    def __init__(self, Values=None, Scales=None, Flags=None, Epochs=None):
+        self.Values = Values if Values is not None else array('q')
+        self.Scales = Scales if Scales is not None else array('i')
+        self.Flags = Flags if Flags is not None else array('I')
+        self.Epochs = Epochs if Epochs is not None else array('q')
+
+    @classmethod
+    def from_bytes(cls, data, index, numEntries):
+        """ 一次 unpack_from 读出全部 CMTime
+        :param data:
+        :param index: 第一个 CMTime 的偏移
+        :param numEntries: sample 个数
+        :return:
+        """
+        fields = struct.unpack_from('<' + 'qiIq' * (3 * numEntries), data, index)
+        return cls(array('q', fields[0::4]), array('i', fields[1::4]), array('I', fields[2::4]),
+                   array('q', fields[3::4]))
+
+    def __len__(self):
+        return len(self.Values) // 3
+
+    def __getitem__(self, item):
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('SampleTimingTable index out of range')
+        return SampleTimingInfo(*(self.get_time(item * 3 + i) for i in range(3)))
+
+    def get_time(self, index):
+        """
+        :param index: Values 中的下标
+        :return: CMTime
+        """
+        return CMTime(CMTimeValue=self.Values[index] & 0xFFFFFFFFFFFFFFFF, CMTimeScale=self.Scales[index],
+                      CMTimeFlags=self.Flags[index], CMTimeEpoch=self.Epochs[index] & 0xFFFFFFFFFFFFFFFF)
+
+    def rescale(self, newScale, field=PresentationTimeStamp):
+        """ 整数换算到新的时间刻度, timescale 为 0 的项记为 0
+        :param newScale:
+        :param field: Duration/PresentationTimeStamp/DecodeTimeStamp
+        :return: array('q')
+        """
+        return rescale_values(self.Values[field::3], self.Scales[field::3], newScale)
+
+    def to_90khz(self, field=PresentationTimeStamp):
+        return self.rescale(ClockRate90kHz, field)
+
+    def seconds(self, field=PresentationTimeStamp):
+        """
+        :return: array('d')
+        """
+        return array('d', [value / scale if scale else 0.0
+                           for value, scale in zip(self.Values[field::3], self.Scales[field::3])])
+
+    def __str__(self):
+        return f'SampleTimingTable >>> entries:{len(self)}'
+
+
 class CMSampleBuffer:
+    """ OutputPresentationTimestamp/SampleData/MediaType 等在解析时直接读取
+    FormatDescription/Attachments/CreateIfNecessary 只记录原始数据，第一次访问时才解析
+    有 formatCache 时 fdsc 在第一次访问 FormatDescription/FormatChanged 时才查缓存, 被丢弃的 sample 不会改变缓存中的当前格式
+    """
+    __slots__ = ('OutputPresentationTimestamp', 'HasFormatDescription', 'NumSamples', 'SampleTimingInfoArray',
+                 'SampleData', 'SampleSizes', 'MediaType', '_formatDescription', '_attachments', '_createIfNecessary',
+                 '_fdscBytes', '_sattBytes', '_saryBytes', '_formatChanged', '_formatCache')
+
     def __init__(self, OutputPresentationTimestamp=None, FormatDescription=None, HasFormatDescription=None,
                  NumSamples=None, SampleTimingInfoArray=None, SampleData=None, SampleSizes=None, Attachments=None,
                  CreateIfNecessary=None, MediaType=None):
         self.OutputPresentationTimestamp: CMTime = OutputPresentationTimestamp
-        self.FormatDescription: FormatDescriptor = FormatDescription
         self.HasFormatDescription = HasFormatDescription
         self.NumSamples = NumSamples
         self.SampleTimingInfoArray = SampleTimingInfoArray
         self.SampleData = SampleData
         self.SampleSizes = SampleSizes
-        self.Attachments = Attachments
-        self.CreateIfNecessary = CreateIfNecessary
         self.MediaType = MediaType
+        self._formatChanged = False  # 与上一个 FormatDescription 相比 SPS/PPS/分辨率有变化
+        self._formatCache = None
+        self._formatDescription = FormatDescription
+        self._attachments = Attachments
+        self._createIfNecessary = CreateIfNecessary
+        self._fdscBytes = None  # fdsc 原子
+        self._sattBytes = None  # satt 原子
+        self._saryBytes = None  # sary 中的 dict
+
+    def _resolve_format(self):
+        if self._fdscBytes is None:
+            return
+        if self._formatCache is None:
+            self._formatDescription = FormatDescriptor.from_bytes(self._fdscBytes)
+            self._formatChanged = True
+        else:
+            self._formatDescription, self._formatChanged = self._formatCache.get(self._fdscBytes)
+        self._fdscBytes = None
+        self._formatCache = None
+
+    @property
+    def FormatDescription(self) -> FormatDescriptor:
+        self._resolve_format()
+        return self._formatDescription
+
+    @FormatDescription.setter
+    def FormatDescription(self, value):
+        self._formatDescription = value
+        self._fdscBytes = None
+        self._formatCache = None
+
+    @property
+    def FormatChanged(self):
+        self._resolve_format()
+        return self._formatChanged
+
+    @FormatChanged.setter
+    def FormatChanged(self, value):
+        self._resolve_format()
+        self._formatChanged = value
+
+    @property
+    def Attachments(self):
+        if self._sattBytes is not None:
+            self._attachments = new_dictionary_from_bytes(self._sattBytes, CMSampleConst.satt)
+            self._sattBytes = None
+        return self._attachments
+
+    @Attachments.setter
+    def Attachments(self, value):
+        self._attachments = value
+        self._sattBytes = None
+
+    @property
+    def CreateIfNecessary(self):
+        if self._saryBytes is not None:
+            self._createIfNecessary = new_dictionary_from_bytes(self._saryBytes, DictConst.DictionaryMagic)
+            self._saryBytes = None
+        return self._createIfNecessary
+
+    @CreateIfNecessary.setter
+    def CreateIfNecessary(self, value):
+        self._createIfNecessary = value
+        self._saryBytes = None
 
     @classmethod
-    def from_bytesAudio(self, buffer):
-        return self.from_bytes(buffer, DescriptorConst.MediaTypeSound)
+    def from_bytesAudio(self, buffer, formatCache=None, fields=None):
+        return self.from_bytes(buffer, DescriptorConst.MediaTypeSound, formatCache, fields)
 
     @classmethod
-    def from_bytesVideo(self, buffer):
-        return self.from_bytes(buffer, DescriptorConst.MediaTypeVideo)
+    def from_bytesVideo(self, buffer, formatCache=None, fields=None):
+        return self.from_bytes(buffer, DescriptorConst.MediaTypeVideo, formatCache, fields)
 
     @classmethod
-    def from_bytes(self, buffer, mediaType):
+    def from_bytes(self, buffer, mediaType, formatCache: FormatDescriptorCache = None, fields=None):
+        """ SampleData 等字段是 buffer 的 memoryview 切片，不做拷贝
+        需要在 consume 之后继续持有数据时调用 materialize()
+
+        :param formatCache: 传入时 fdsc 在第一次访问时从缓存中取并得到 FormatChanged, 否则每个 fdsc 都视为格式变化
+        :param fields: 需要的字段, 不在其中的 SampleTimingInfoArray/SampleSizes 不解析, 保持为 None
+        """
+        parseTiming = fields is None or 'SampleTimingInfoArray' in fields
+        parseSizes = fields is None or 'SampleSizes' in fields
+        buffer = memoryview(buffer)
         sampleBuffer = CMSampleBuffer()
         sampleBuffer.MediaType = mediaType
         sampleBuffer.HasFormatDescription = False
-        length, remainingBytes = parse_length_magic(buffer, CMSampleConst.sbuf)
+        length, magic = lengthMagicStruct.unpack_from(buffer)
+        if magic != _sbuf:
+            raise Exception(f"CMSampleBuffer >> from_bytes unexpected magic {magic:x}")
         if length > len(buffer):
             raise Exception("CMSampleBuffer >> from_bytes length error")
 
-        while len(remainingBytes) > 0:
-            code = struct.unpack('<I', remainingBytes[4:8])[0]
-            if code == CMSampleConst.opts:
-                sampleBuffer.OutputPresentationTimestamp = CMTime.from_buffer_copy(remainingBytes[8:])
-                remainingBytes = remainingBytes[32:]
+        index = 8
+        while index < length:
+            atomLength, code = lengthMagicStruct.unpack_from(buffer, index)
+            if atomLength < 8 or index + atomLength > length:
+                raise Exception(f"CMSampleBuffer >> atom {code:x} length error")
+            if code == _opts:
+                sampleBuffer.OutputPresentationTimestamp = CMTime.from_buffer_copy(buffer, index + 8)
 
-            elif code == CMSampleConst.stia:
-                sampleBuffer.SampleTimingInfoArray, remainingBytes = parse_stia(remainingBytes)
+            elif code == _stia:
+                if parseTiming:
+                    sampleBuffer.SampleTimingInfoArray = parse_stia(buffer, index)
 
-            elif code == CMSampleConst.sdat:
-                length, remainingBytes = parse_length_magic(remainingBytes, CMSampleConst.sdat)
-                sampleBuffer.SampleData = remainingBytes[:length - 8]
-                remainingBytes = remainingBytes[length - 8:]
+            elif code == _sdat:
+                sampleBuffer.SampleData = buffer[index + 8:index + atomLength]
 
-            elif code == CMSampleConst.nsmp:
-                length, remainingBytes = parse_length_magic(remainingBytes, CMSampleConst.nsmp)
-                sampleBuffer.NumSamples = struct.unpack('<I', remainingBytes[:4])[0]
-                remainingBytes = remainingBytes[4:]
+            elif code == _nsmp:
+                sampleBuffer.NumSamples = uint32Struct.unpack_from(buffer, index + 8)[0]
 
-            elif code == CMSampleConst.ssiz:
-                sampleBuffer.SampleSizes, remainingBytes = parse_samples_list(remainingBytes)
+            elif code == _ssiz:
+                if parseSizes:
+                    sampleBuffer.SampleSizes = parse_samples_list(buffer, index)
 
-            elif code == DescriptorConst.FormatDescriptorMagic:
+            elif code == _fdsc:
                 sampleBuffer.HasFormatDescription = True
-                fdscLength = struct.unpack('<I', remainingBytes[:4])[0]
-                sampleBuffer.FormatDescription = FormatDescriptor.from_bytes(remainingBytes[:fdscLength])
-                remainingBytes = remainingBytes[fdscLength:]
-
-            elif code == CMSampleConst.satt:
-                attachmentsLength = struct.unpack('<I', remainingBytes[:4])[0]
-                sampleBuffer.Attachments = new_dictionary_from_bytes(remainingBytes[:attachmentsLength],
-                                                                     CMSampleConst.satt)
-                remainingBytes = remainingBytes[attachmentsLength:]
-
-            elif code == CMSampleConst.sary:
-                saryLength = struct.unpack('<I', remainingBytes[:4])[0]
-                sampleBuffer.CreateIfNecessary = new_dictionary_from_bytes(remainingBytes[8:saryLength],
-                                                                           DictConst.DictionaryMagic)
-                remainingBytes = remainingBytes[saryLength:]
+                sampleBuffer._fdscBytes = buffer[index:index + atomLength]
+                sampleBuffer._formatCache = formatCache
+
+            elif code == _satt:
+                sampleBuffer._sattBytes = buffer[index:index + atomLength]
+
+            elif code == _sary:
+                sampleBuffer._saryBytes = buffer[index + 8:index + atomLength]
             else:
-                unknownMagic = str(remainingBytes[4:8])
-                raise Exception(f"unknown magic type {unknownMagic}, cannot parse value {remainingBytes[4:8]}")
+                unknownMagic = bytes(buffer[index + 4:index + 8])
+                raise Exception(f"unknown magic type {unknownMagic}, cannot parse value {code:x}")
+            index += atomLength
         return sampleBuffer
 
+    def materialize(self):
+        """ 将 SampleData 及尚未解析的原子拷贝为 bytes, 释放对 USB 读取缓冲区的引用
+        :return:
+        """
+        if isinstance(self.SampleData, memoryview):
+            self.SampleData = self.SampleData.tobytes()
+        for name in ('_fdscBytes', '_sattBytes', '_saryBytes'):
+            value = getattr(self, name)
+            if isinstance(value, memoryview):
+                setattr(self, name, value.tobytes())
+        return self
+
     def __str__(self):
 
         if self.MediaType == DescriptorConst.MediaTypeVideo:
             return f"OutputPresentationTS:{self.OutputPresentationTimestamp}, NumSamples:{self.NumSamples}, " \
                    f"SampleData-len:{get_nalu_details(self.SampleData)}, FormatDescription:{self.FormatDescription}, attach:{self.Attachments}, sary:{self.CreateIfNecessary}, " \
-                   f"SampleTimingInfoArray:{self.SampleTimingInfoArray[0]}"
+                   f"SampleTimingInfoArray:{self.SampleTimingInfoArray[0] if self.SampleTimingInfoArray else None}"
 
         return f"OutputPresentationTS:{self.OutputPresentationTimestamp}, NumSamples:{self.NumSamples}" \
-               f", SampleSize:{self.SampleSizes[0]},'FormatDescription:{self.FormatDescription}'"
-
-
-def parse_stia(data):
-    stiaLength, _, = parse_length_magic(data, CMSampleConst.stia)
-    stiaLength -= 8
-    numEntries, modulus = stiaLength / CMSampleConst.cmSampleTimingInfoLength, stiaLength % CMSampleConst.cmSampleTimingInfoLength
-    result = []
-    data = data[8:]
-    for i in range(int(numEntries)):
-        index = i * CMSampleConst.cmSampleTimingInfoLength
-        duration = CMTime.from_buffer_copy(data[index:])
-        presentationTimeStamp = CMTime.from_buffer_copy(data[CMTimeConst.CMTimeLengthInBytes + index:])
-        decodeTimeStamp = CMTime.from_buffer_copy(data[2 * CMTimeConst.CMTimeLengthInBytes + index:])
-        result.append(SampleTimingInfo(duration, presentationTimeStamp, decodeTimeStamp))
-    return result, data[stiaLength:]
-
-
-def parse_samples_list(data):
-    ssizLength, _, = parse_length_magic(data, CMSampleConst.ssiz)
-    ssizLength -= 8
-    numEntries, modulus = ssizLength / 4, ssizLength % 4
-    result = []
-    data = data[8:]
-    for i in range(int(numEntries)):
-        index = 4 * i
-        result.append(int(struct.unpack('<I', data[index + i * 4:index + i * 4 + 4])[0]))
-    return result, data[ssizLength:]
-
-
-def get_nalu_details(data):
-    if data:
-        _str = ''
-        while len(data):
-            _length = struct.unpack('<I', data[:4])[0]
-            _str += f'[len:{_length},type：{0x1f & int(data[4])}]'
-            data = data[_length + 4:]
-        return
-    return ''
+               f", SampleSize:{self.SampleSizes[0] if self.SampleSizes else None},'FormatDescription:{self.FormatDescription}'"
+
+
+def parse_output_presentation_timestamp(buffer, index=0):
+    """ 只读取 sbuf 中的 opts, 跳过其它原子, 用于不需要完整解析时计算时钟偏差
+    :param buffer:
+    :param index: sbuf 在 buffer 中的偏移
+    :return: CMTime, 没有 opts 时返回 None
+    """
+    length, magic = lengthMagicStruct.unpack_from(buffer, index)
+    if magic != _sbuf:
+        raise Exception(f"CMSampleBuffer >> unexpected magic {magic:x}")
+    end = index + length
+    index += 8
+    while index < end:
+        atomLength, code = lengthMagicStruct.unpack_from(buffer, index)
+        if code == _opts:
+            return CMTime.from_buffer_copy(buffer, index + 8)
+        if atomLength < 8:
+            raise Exception(f"CMSampleBuffer >> atom {code:x} length error")
+        index += atomLength
+    return None
+
+
+def parse_stia(data, index=0):
+    """
+    :param data:
+    :param index: stia 原子在 data 中的偏移
+    :return: SampleTimingTable
+    """
+    stiaLength, _ = lengthMagicStruct.unpack_from(data, index)
+    return SampleTimingTable.from_bytes(data, index + 8, (stiaLength - 8) // _timingInfoLength)
+
+
+def parse_samples_list(data, index=0):
+    """
+    :param data:
+    :param index: ssiz 原子在 data 中的偏移
+    :return: 每个 sample 的大小, array('I')
+    """
+    ssizLength, _ = lengthMagicStruct.unpack_from(data, index)
+    sizes = array('I')
+    sizes.frombytes(data[index + 8:index + 8 + (ssizLength - 8) // 4 * 4])
+    if sys.byteorder == 'big':
+        sizes.byteswap()
+    return sizes
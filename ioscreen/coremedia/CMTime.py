@@ -2,10 +2,15 @@
 # https://github.com/phracker/MacOSX-SDKs/blob/master/MacOSX10.8.sdk/System/Library/Frameworks/CoreMedia.framework/Versions/A/Headers/CMTime.h
 
 import enum
-from _ctypes import Structure
-from ctypes import c_uint32, c_uint64
+import functools
+import math
+import struct
+from array import array
 
 NanoSecondScale = 1000000000
+ClockRate90kHz = 90000
+
+cmTimeStruct = struct.Struct('<QIIQ')
 
 
 class CMTimeConst(enum.IntEnum):
@@ -18,22 +23,174 @@ class CMTimeConst(enum.IntEnum):
     CMTimeLengthInBytes = 24
 
 
-class CMTime(Structure):
-    _fields_ = [
-        ('CMTimeValue', c_uint64),
-        ('CMTimeScale', c_uint32),
-        ('CMTimeFlags', c_uint32),
-        ('CMTimeEpoch', c_uint64),
-    ]
+class CMTimeRoundingMethod(enum.IntEnum):
+    RoundHalfAwayFromZero = 1
+    RoundTowardZero = 2
+    RoundAwayFromZero = 3
+    RoundTowardPositiveInfinity = 5
+    RoundTowardNegativeInfinity = 6
+    Default = RoundHalfAwayFromZero
+
+
+def div_round(numerator, denominator, rounding=CMTimeRoundingMethod.Default):
+    """ 整数除法, 按 rounding 取整, 不经过 float
+    :return: (商, 是否有舍入)
+    """
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    quotient, remainder = divmod(numerator, denominator)  # 向负无穷取整, 0 <= remainder < denominator
+    if not remainder:
+        return quotient, False
+    if rounding == CMTimeRoundingMethod.RoundHalfAwayFromZero:
+        twice = 2 * remainder
+        if twice > denominator or (twice == denominator and numerator > 0):
+            quotient += 1
+    elif rounding == CMTimeRoundingMethod.RoundTowardZero:
+        if numerator < 0:
+            quotient += 1
+    elif rounding == CMTimeRoundingMethod.RoundAwayFromZero:
+        if numerator > 0:
+            quotient += 1
+    elif rounding == CMTimeRoundingMethod.RoundTowardPositiveInfinity:
+        quotient += 1
+    elif rounding != CMTimeRoundingMethod.RoundTowardNegativeInfinity:
+        raise Exception(f'unsupported rounding method {rounding}')
+    return quotient, True
+
+
+@functools.total_ordering
+class CMTime:
+    """ CMTime 值类型, 二进制格式与 CoreMedia 一致: value(8) scale(4) flags(4) epoch(8), 共 24 字节
+    所有换算都用整数完成; timescale 为 0 的无效时间 (如全 0 的 kCMTimeInvalid) 换算结果为 0, 不会抛出 ZeroDivisionError
+    """
+    __slots__ = ('CMTimeValue', 'CMTimeScale', 'CMTimeFlags', 'CMTimeEpoch')
+
+    def __init__(self, CMTimeValue=0, CMTimeScale=0, CMTimeFlags=0, CMTimeEpoch=0):
+        self.CMTimeValue = CMTimeValue
+        self.CMTimeScale = CMTimeScale
+        self.CMTimeFlags = CMTimeFlags
+        self.CMTimeEpoch = CMTimeEpoch
+
+    @classmethod
+    def from_buffer_copy(cls, buf, offset=0):
+        return cls(*cmTimeStruct.unpack_from(buf, offset))
+
+    def to_bytes(self):
+        return cmTimeStruct.pack(self.CMTimeValue & 0xFFFFFFFFFFFFFFFF, self.CMTimeScale & 0xFFFFFFFF,
+                                 self.CMTimeFlags & 0xFFFFFFFF, self.CMTimeEpoch & 0xFFFFFFFFFFFFFFFF)
+
+    __bytes__ = to_bytes
+
+    def is_valid(self):
+        return self.CMTimeScale != 0
+
+    def rescale(self, newScale, rounding=CMTimeRoundingMethod.Default):
+        """
+        :param newScale: 新的 timescale
+        :param rounding: CMTimeRoundingMethod
+        :return: 新的 CMTime, 有舍入时带 KCMTimeFlagsHasBeenRounded; 无效时间返回 value/scale 为 0 的无效时间
+        """
+        if not self.CMTimeScale:
+            return CMTime(0, 0, self.CMTimeFlags, self.CMTimeEpoch)
+        if newScale == self.CMTimeScale:
+            return CMTime(self.CMTimeValue, self.CMTimeScale, self.CMTimeFlags, self.CMTimeEpoch)
+        value, rounded = div_round(self.CMTimeValue * newScale, self.CMTimeScale, rounding)
+        flags = self.CMTimeFlags | CMTimeConst.KCMTimeFlagsHasBeenRounded if rounded else self.CMTimeFlags
+        return CMTime(value, newScale, int(flags), self.CMTimeEpoch)
 
     def get_time_scale(self, newScaleToUse):
-        scalingFactor = float(newScaleToUse.CMTimeScale) / float(self.CMTimeScale)
-        return float(self.CMTimeValue) * scalingFactor
+        """ 换算到 newScaleToUse 的 timescale 下的值, 只在最后一步转为 float
+        :param newScaleToUse: CMTime
+        :return: float
+        """
+        if not self.CMTimeScale:
+            return 0.0
+        return self.CMTimeValue * newScaleToUse.CMTimeScale / self.CMTimeScale
 
     def seconds(self):
-        if self.CMTimeValue == 0:
+        if self.CMTimeValue == 0 or not self.CMTimeScale:
+            return 0
+        return div_round(self.CMTimeValue, self.CMTimeScale, CMTimeRoundingMethod.RoundTowardZero)[0]
+
+    def to_nanoseconds(self, rounding=CMTimeRoundingMethod.Default):
+        """ GstClockTime 使用纳秒 """
+        if not self.CMTimeScale:
             return 0
-        return int(self.CMTimeValue / self.CMTimeScale)
+        return div_round(self.CMTimeValue * NanoSecondScale, self.CMTimeScale, rounding)[0]
+
+    def to_90khz(self, rounding=CMTimeRoundingMethod.Default):
+        if not self.CMTimeScale:
+            return 0
+        return div_round(self.CMTimeValue * ClockRate90kHz, self.CMTimeScale, rounding)[0]
+
+    def _common_scale(self, other):
+        if self.CMTimeScale == other.CMTimeScale:
+            return self.CMTimeScale
+        scale = self.CMTimeScale * other.CMTimeScale // math.gcd(self.CMTimeScale, other.CMTimeScale)
+        return scale if scale <= 0x7FFFFFFF else max(self.CMTimeScale, other.CMTimeScale)
+
+    def __add__(self, other):
+        if not self.CMTimeScale or not other.CMTimeScale:
+            return CMTime(CMTimeEpoch=self.CMTimeEpoch)  # 与无效时间相加的结果无效
+        scale = self._common_scale(other)
+        a, b = self.rescale(scale), other.rescale(scale)
+        return CMTime(a.CMTimeValue + b.CMTimeValue, scale,
+                      (a.CMTimeFlags | b.CMTimeFlags) & CMTimeConst.KCMTimeFlagsHasBeenRounded, self.CMTimeEpoch)
+
+    def __sub__(self, other):
+        if not self.CMTimeScale or not other.CMTimeScale:
+            return CMTime(CMTimeEpoch=self.CMTimeEpoch)
+        scale = self._common_scale(other)
+        a, b = self.rescale(scale), other.rescale(scale)
+        return CMTime(a.CMTimeValue - b.CMTimeValue, scale,
+                      (a.CMTimeFlags | b.CMTimeFlags) & CMTimeConst.KCMTimeFlagsHasBeenRounded, self.CMTimeEpoch)
+
+    def _compare_values(self, other):
+        """ 与 CMTimeCompare 一致: 无效时间之间相等, 且大于任何有效时间
+        """
+        if not self.CMTimeScale or not other.CMTimeScale:
+            return int(not self.CMTimeScale), int(not other.CMTimeScale)
+        if self.CMTimeScale == other.CMTimeScale:
+            return self.CMTimeValue, other.CMTimeValue
+        return self.CMTimeValue * other.CMTimeScale, other.CMTimeValue * self.CMTimeScale
+
+    def __eq__(self, other):
+        if not isinstance(other, CMTime):
+            return NotImplemented
+        a, b = self._compare_values(other)
+        return a == b
+
+    def __lt__(self, other):
+        if not isinstance(other, CMTime):
+            return NotImplemented
+        a, b = self._compare_values(other)
+        return a < b
+
+    def __hash__(self):
+        if not self.CMTimeScale:
+            return hash((0, 0))  # 所有无效时间相等
+        divisor = math.gcd(self.CMTimeValue, self.CMTimeScale)
+        return hash((self.CMTimeValue // divisor, self.CMTimeScale // divisor))
 
     def __str__(self):
         return f"CMTime:{self.CMTimeValue}/{self.CMTimeScale}, flags:{self.CMTimeFlags}, epoch:{self.CMTimeEpoch}"
+
+    __repr__ = __str__
+
+
+def rescale_values(values, scales, newScale, rounding=CMTimeRoundingMethod.Default):
+    """ 批量换算时间戳, timescale 为 0 的项记为 0
+    :param values: CMTimeValue 序列
+    :param scales: 对应的 CMTimeScale 序列, 或所有值共用的一个 int
+    :param newScale:
+    :param rounding:
+    :return: array('q')
+    """
+    if isinstance(scales, int):
+        if not scales:
+            return array('q', bytes(8 * len(values)))
+        if rounding == CMTimeRoundingMethod.RoundTowardNegativeInfinity:
+            return array('q', [value * newScale // scales for value in values])
+        scales = [scales] * len(values)
+    return array('q', [div_round(value * newScale, scale, rounding)[0] if scale else 0
+                       for value, scale in zip(values, scales)])
@@ -15,7 +15,7 @@ class CMClock:
     def calcValue(self, val):
         if NanoSecondScale == self.timeScale:
             return int(val)
-        return int(self.factor * val)
+        return val * self.timeScale // NanoSecondScale
 
     def getTime(self):
         return CMTime(
@@ -35,8 +35,10 @@ class CMClock:
 
 
 def calculate_skew(startTimeClock1, endTimeClock1, startTimeClock2, endTimeClock2):
+    """ clock2 相对 clock1 的时钟频率, 以 clock2 的 timescale 表示
+    全程整数运算, 只在最后一步做一次除法转为 float
+    """
     timeDiffClock1 = endTimeClock1.CMTimeValue - startTimeClock1.CMTimeValue
     timeDiffClock2 = endTimeClock2.CMTimeValue - startTimeClock2.CMTimeValue
-    diffTime = CMTime(CMTimeValue=timeDiffClock1, CMTimeScale=startTimeClock1.CMTimeScale)
-    scaledDiff = diffTime.get_time_scale(startTimeClock2)
-    return float(startTimeClock2.CMTimeScale) * scaledDiff / float(timeDiffClock2)
+    scale2 = startTimeClock2.CMTimeScale
+    return (scale2 * scale2 * timeDiffClock1) / (startTimeClock1.CMTimeScale * timeDiffClock2)
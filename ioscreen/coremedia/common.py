@@ -1,7 +1,15 @@
 import struct
 
+numberStructs = {
+    3: struct.Struct('<BI'),
+    4: struct.Struct('<BQ'),
+    6: struct.Struct('<Bd'),
+}
+
 
 class NSNumber:
+    __slots__ = ('typeSpecifier', 'value')
+
     def __init__(self, typeSpecifier, value):
         """
         :param typeSpecifier: 3 uint32, 4: uint64, 6:float64
@@ -25,18 +33,18 @@ class NSNumber:
             raise Exception('not find value')
         return cls(typeSpecifier, value)
 
+    def size(self):
+        numberStruct = numberStructs.get(self.typeSpecifier)
+        return numberStruct.size if numberStruct else 0
+
+    def pack_into(self, buf, offset):
+        numberStruct = numberStructs.get(self.typeSpecifier)
+        if numberStruct:
+            numberStruct.pack_into(buf, offset, self.typeSpecifier, self.value)
+
     def to_bytes(self):
-        buf = b''
-        if self.typeSpecifier == 3:
-            buf += b'\x03'
-            buf += struct.pack('<I', self.value)
-        elif self.typeSpecifier == 4:
-            buf += b'\x04'
-            buf += struct.pack('<Q', self.value)
-        elif self.typeSpecifier == 6:
-            buf += b'\x06'
-            buf += struct.pack('<d', self.value)
-        return buf
+        numberStruct = numberStructs.get(self.typeSpecifier)
+        return numberStruct.pack(self.typeSpecifier, self.value) if numberStruct else b''
 
     def __str__(self):
         return f'NSNumber >>> typeSpecifier:{self.typeSpecifier},value:{self.value}'
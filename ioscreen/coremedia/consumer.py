@@ -2,41 +2,189 @@
 最终流输出，需要继承 Consumer 类
 """
 
+import collections
+import enum
 import io
 import logging
 import os
 import socket
-import struct
+import threading
 
 from .CMFormatDescription import DescriptorConst
 from .CMSampleBuffer import CMSampleBuffer
+from .filewriter import AsyncFileWriter, FsyncPolicy
+from .nalu import startCode, contains_idr, iter_nalus, to_annexb, parameter_sets_annexb, classify_parameter_sets
+from .rtp import RtpPacketizer, RtpSender, write_sdp
 from .wav import set_wav_header
 
-startCode = b'\x00\x00\x00\x01'
-
 logger = logging.getLogger("ioscreen")
 
 
 class Consumer:
+    """
+    mediaTypes: 需要的媒体类型, 其它类型的 CMSampleBuffer 不会被解析
+    fields: 需要的 CMSampleBuffer 字段, None 表示全部; 目前可以省去 SampleTimingInfoArray/SampleSizes 的解析
+    """
+    mediaTypes = frozenset((DescriptorConst.MediaTypeVideo, DescriptorConst.MediaTypeSound))
+    fields = None
+
+    def wants(self, mediaType):
+        return mediaType in self.mediaTypes
+
     def consume(self, data: CMSampleBuffer):
         pass
 
+    def backlog(self):
+        """ 已接收但尚未处理完的 CMSampleBuffer 个数, 用于 NEED 流控
+        """
+        return 0
+
     def stop(self):
         pass
 
 
+class DropPolicy(enum.Enum):
+    Block = 'block'  # 队列满时阻塞解析线程
+    DropOldest = 'drop-oldest'  # 丢弃队列中最早的数据
+    DropNonIdr = 'drop-non-idr'  # 丢弃视频直到下一个关键帧，音频总是保留
+
+
+class BufferedConsumer(Consumer):
+    """ 解析线程与实际 consumer 之间的有界队列，consume 在独立线程中执行
+    磁盘或 GStreamer 变慢时按 policy 处理积压，不再直接阻塞 USB 解析
+    """
+
+    def __init__(self, consumer: Consumer, maxSize=30, policy=DropPolicy.Block):
+        self.consumer = consumer
+        self.mediaTypes = consumer.mediaTypes
+        self.fields = consumer.fields
+        self.maxSize = max(1, int(maxSize))
+        self.policy = DropPolicy(policy)
+        self.droppedVideo = 0
+        self.droppedAudio = 0
+        self.maxQueueDepth = 0
+        self._queue = collections.deque()
+        self._waitKeyframe = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name='ioscreen-consumer', daemon=True)
+        self._thread.start()
+
+    def qsize(self):
+        return len(self._queue)
+
+    def backlog(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            'queueDepth': len(self._queue),
+            'maxQueueDepth': self.maxQueueDepth,
+            'droppedVideo': self.droppedVideo,
+            'droppedAudio': self.droppedAudio,
+        }
+
+    def consume(self, data: CMSampleBuffer):
+        with self._cond:
+            if self._closed:
+                return
+            if self.policy == DropPolicy.Block:
+                self._cond.wait_for(lambda: len(self._queue) < self.maxSize or self._closed)
+                if self._closed:
+                    return
+            elif self.policy == DropPolicy.DropOldest:
+                while len(self._queue) >= self.maxSize:
+                    self._count_drop(self._queue.popleft())
+            elif not self._offer_keyframe_aware(data):
+                return
+            self._queue.append(data)
+            self.maxQueueDepth = max(self.maxQueueDepth, len(self._queue))
+            self._cond.notify_all()
+
+    def _offer_keyframe_aware(self, data: CMSampleBuffer):
+        if data.MediaType == DescriptorConst.MediaTypeSound:
+            self._make_room()
+            return True
+        if contains_idr(data.SampleData):
+            self._make_room()
+            self._waitKeyframe = False
+            return True
+        if self._waitKeyframe or len(self._queue) >= self.maxSize:
+            # 丢掉一帧 P 帧后，到下一个 IDR 之前的视频都无法解码
+            self._waitKeyframe = True
+            self.droppedVideo += 1
+            return False
+        return True
+
+    def _make_room(self):
+        """ 队列满时先丢最新的视频帧, 没有视频时丢最早的音频, 保证队列不超过 maxSize
+        """
+        while len(self._queue) >= self.maxSize:
+            if not self._drop_newest_video():
+                self._queue.popleft()
+                self.droppedAudio += 1
+
+    def _drop_newest_video(self):
+        for i in range(len(self._queue) - 1, -1, -1):
+            if self._queue[i].MediaType == DescriptorConst.MediaTypeVideo:
+                del self._queue[i]
+                self.droppedVideo += 1
+                self._waitKeyframe = True
+                return True
+        return False
+
+    def _count_drop(self, data: CMSampleBuffer):
+        if data.MediaType == DescriptorConst.MediaTypeSound:
+            self.droppedAudio += 1
+        else:
+            self.droppedVideo += 1
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                data = self._queue.popleft()
+                self._cond.notify_all()
+            try:
+                self.consumer.consume(data)
+            except Exception as E:
+                logger.exception(E)
+
+    def stop(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        if self.droppedVideo or self.droppedAudio:
+            logger.warning(f'consumer queue dropped {self.droppedVideo} video and {self.droppedAudio} audio buffers')
+        self.consumer.stop()
+
+
 class AVFileWriter(Consumer):
     """ 保存 h264/wav 文件
+    asyncWrite 为 True 时磁盘写入在独立线程中进行, 见 AsyncFileWriter
     """
     num = 0
+    fields = frozenset(('SampleData', 'FormatDescription'))
 
-    def __init__(self, h264FilePath=None, wavFilePath=None, outFilePath=None, audioOnly=False):
+    def __init__(self, h264FilePath=None, wavFilePath=None, outFilePath=None, audioOnly=False, asyncWrite=False,
+                 writeBufferSize=8 * 1024 * 1024, fsync=FsyncPolicy.Never, fsyncInterval=5.0):
         self.h264FilePath = h264FilePath
         self.wavFilePath = wavFilePath
-        self.h264FileWriter: io.open = io.open(h264FilePath, 'wb+')
-        self.wavFileWriter: io.open = io.open(wavFilePath, 'wb+')
+        if asyncWrite:
+            self.h264FileWriter = AsyncFileWriter(h264FilePath, writeBufferSize, fsync, fsyncInterval)
+            self.wavFileWriter = AsyncFileWriter(wavFilePath, writeBufferSize, fsync, fsyncInterval)
+        else:
+            self.h264FileWriter: io.open = io.open(h264FilePath, 'wb+')
+            self.wavFileWriter: io.open = io.open(wavFilePath, 'wb+')
         self.outFilePath = outFilePath
         self.audioOnly = audioOnly
+        self._parameterSets = None  # Annex-B 格式的当前 SPS/PPS
+        self._parameterSetsWritten = False
+        if audioOnly:
+            self.mediaTypes = frozenset((DescriptorConst.MediaTypeSound,))
 
     def consume(self, data: CMSampleBuffer):
         if data.MediaType == DescriptorConst.MediaTypeSound:
@@ -46,33 +194,49 @@ class AVFileWriter(Consumer):
         return self.consume_video(data)
 
     def consume_video(self, data: CMSampleBuffer):
-        if data.HasFormatDescription:
-            self.write_h264(data.FormatDescription.PPS)
-            self.write_h264(data.FormatDescription.SPS)
+        # SPS/PPS 只在格式变化时更新, 写在之后的第一个关键帧前; 带 FormatChanged 的帧被丢弃时仍能从下一个带 fdsc 的帧得到
+        if data.HasFormatDescription and (data.FormatChanged or self._parameterSets is None):
+            parameterSets = parameter_sets_annexb(data.FormatDescription)
+            if parameterSets != self._parameterSets:
+                self._parameterSets = parameterSets
+                self._parameterSetsWritten = False
         if not data.SampleData:
             return True
-        return self.write_h264s(data.SampleData)
+        prefix = b''
+        if not self._parameterSetsWritten:
+            if self._parameterSets is None or not contains_idr(data.SampleData):
+                return True  # 文件从 SPS/PPS 和关键帧开始, 之前的帧无法解码
+            prefix = self._parameterSets
+            self._parameterSetsWritten = True
+        return self.write_h264s(data.SampleData, prefix)
 
     def consume_audio(self, data: CMSampleBuffer):
         if not data.SampleData:
             return True
         return self.wavFileWriter.write(data.SampleData)
 
-    def write_h264s(self, buf):
-        while len(buf) > 0:
-            _length = struct.unpack('>I', buf[:4])[0]
-            self.write_h264(buf[4:_length + 4])
-            buf = buf[_length + 4:]
+    def write_h264s(self, buf, prefix=b''):
+        """ 整帧转为 Annex-B 后一次写入
+        :param buf: AVCC 格式的 SampleData
+        :param prefix: Annex-B 格式的 SPS/PPS
+        """
+        self.h264FileWriter.write(to_annexb(buf, prefix))
         return True
 
-    def write_h264(self, naluBuf):
-        self.h264FileWriter.write(startCode)
-        self.h264FileWriter.write(naluBuf)
-        return True
+    def stats(self):
+        """ asyncWrite 时的写入吞吐和队列深度
+        """
+        return {name: writer.stats() for name, writer in (('h264', self.h264FileWriter), ('wav', self.wavFileWriter))
+                if isinstance(writer, AsyncFileWriter)}
 
     def stop(self):
-        self.h264FileWriter.close()
-        self.wavFileWriter.close()
+        stats = self.stats()
+        if stats:
+            logger.info(f'file writer stats: {stats}')
+        try:
+            self.h264FileWriter.close()
+        finally:
+            self.wavFileWriter.close()
         size = os.stat(self.wavFilePath).st_size
         with open(self.wavFilePath, 'rb+') as file:
             set_wav_header(size, file)
@@ -81,25 +245,62 @@ class AVFileWriter(Consumer):
 class SocketUDP(Consumer):
     """
     发送 udp h264 裸流, 在 mac 有限制长度，需要 udp 长度切割，但是数据会积压延迟会变大，仅测试用
+    rtp 为 True 时按 RFC 6184 封包发送, 每帧一批, sdpPath 不为空时写入可直接播放的 SDP 文件
     :param naluBuf:
     :return:
     """
+    mediaTypes = frozenset((DescriptorConst.MediaTypeVideo,))
+    fields = frozenset(('SampleData', 'FormatDescription'))
 
-    def __init__(self, broadcast=None, audioOnly=False):
+    def __init__(self, broadcast=None, audioOnly=False, rtp=False, mtu=1400, sdpPath=None):
 
         self.socket_udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket_udp.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self.broadcast = broadcast or ('127.0.0.1', 8880)
         self.audioOnly = audioOnly
-        logger.info(f'listen UDP: udp/h264://{self.broadcast[0]}:{self.broadcast[1]}')
+        self.rtp = rtp
+        self.sdpPath = sdpPath
+        self._sdpParameterSets = None
+        self._rtpTimestamp = 0
+        if rtp:
+            self.socket_udp.connect(self.broadcast)
+            self.packetizer = RtpPacketizer(mtu)
+            self.rtpSender = RtpSender(self.socket_udp)
+            logger.info(f'send RTP: rtp://{self.broadcast[0]}:{self.broadcast[1]}'
+                        f'{" (sendmmsg)" if self.rtpSender.batched else ""}')
+        else:
+            logger.info(f'listen UDP: udp/h264://{self.broadcast[0]}:{self.broadcast[1]}')
 
     def consume(self, data: CMSampleBuffer):
         if data.MediaType == DescriptorConst.MediaTypeSound:
             return
+        if self.rtp:
+            return self.write_rtp(data)
         return self.consume_video(data)
 
-    def consume_video(self, data: CMSampleBuffer):
+    def write_rtp(self, data: CMSampleBuffer):
+        """ 带 FormatDescription 的帧前面加上 SPS/PPS, 接收端可以中途加入
+        """
+        nalus = []
         if data.HasFormatDescription:
+            parameterSets = classify_parameter_sets(data.FormatDescription)
+            nalus.extend(parameterSets)
+            if self.sdpPath and parameterSets != self._sdpParameterSets:
+                self._sdpParameterSets = parameterSets
+                write_sdp(self.sdpPath, self.broadcast[0], self.broadcast[1], *parameterSets,
+                          payloadType=self.packetizer.payloadType)
+                logger.info(f'SDP written to {self.sdpPath}')
+        if data.SampleData:
+            nalus.extend(nalu.data for nalu in iter_nalus(data.SampleData))
+        timestamp = data.OutputPresentationTimestamp
+        if timestamp is not None and timestamp.is_valid():
+            self._rtpTimestamp = timestamp.to_90khz()  # 无效时间戳沿用上一帧的时间
+        if nalus:
+            self.rtpSender.send(self.packetizer.packetize(nalus, self._rtpTimestamp))
+        return True
+
+    def consume_video(self, data: CMSampleBuffer):
+        if data.HasFormatDescription:  # 接收端可能中途加入, 每个关键帧都带上 SPS/PPS
             self.write_udp(data.FormatDescription.PPS)
             self.write_udp(data.FormatDescription.SPS)
         if not data.SampleData:
@@ -107,10 +308,8 @@ class SocketUDP(Consumer):
         return self.write_buf(data.SampleData)
 
     def write_buf(self, buf):
-        while len(buf) > 0:
-            _length = struct.unpack('>I', buf[:4])[0]
-            self.write_udp(buf[4:_length + 4])
-            buf = buf[_length + 4:]
+        for nalu in iter_nalus(buf):
+            self.write_udp(nalu.data)
         return True
 
     def write_udp(self, naluBuf):
@@ -0,0 +1,178 @@
+"""
+异步文件写入: 调用方只入队, 磁盘 IO 在独立线程中用 os.writev 批量写入
+"""
+import enum
+import logging
+import os
+import threading
+from time import monotonic, perf_counter
+
+logger = logging.getLogger("ioscreen")
+
+IOV_MAX = os.sysconf('SC_IOV_MAX') if hasattr(os, 'sysconf') and 'SC_IOV_MAX' in os.sysconf_names else 1024
+
+
+class FsyncPolicy(enum.Enum):
+    Never = 'never'
+    Interval = 'interval'  # 有新数据时每 fsyncInterval 秒一次
+    OnStop = 'on-stop'
+
+
+class AsyncFileWriter:
+    """ 与文件对象相同的 write/close 接口, 写入线程合并队列中的数据后一次 os.writev
+    队列中未写入的数据超过 bufferSize 字节时 write 阻塞, 写入线程出错后 write/close 抛出异常
+
+    :param path: 文件路径, 已存在时清空
+    :param bufferSize: 队列中最多缓存的字节数
+    :param fsync: FsyncPolicy
+    :param fsyncInterval: FsyncPolicy.Interval 的间隔秒数
+    """
+
+    def __init__(self, path, bufferSize=8 * 1024 * 1024, fsync=FsyncPolicy.Never, fsyncInterval=5.0):
+        self.path = path
+        self.bufferSize = max(1, int(bufferSize))
+        self.fsync = FsyncPolicy(fsync)
+        self.fsyncInterval = fsyncInterval
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.error = None
+        self.bytesWritten = 0
+        self.writeCalls = 0
+        self.writeTime = 0.0
+        self.fsyncCount = 0
+        self.blockedTime = 0.0  # write 因队列满而等待的时间
+        self.maxQueueBytes = 0
+        self._queue = []
+        self._queueBytes = 0
+        self._closed = False
+        self._dirty = False
+        self._startTime = monotonic()
+        self._lastSync = self._startTime
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._loop, name='ioscreen-file-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, data):
+        """ 入队, 写入线程写完之前 data 不能被修改
+        :param data: bytes/bytearray/memoryview
+        :return: 字节数
+        """
+        size = len(data)
+        if not size:
+            return 0
+        with self._cond:
+            self._check()
+            if self._queueBytes and self._queueBytes + size > self.bufferSize:
+                start = perf_counter()
+                self._cond.wait_for(lambda: not self._queueBytes or self._queueBytes + size <= self.bufferSize
+                                    or self.error is not None or self._closed)
+                self.blockedTime += perf_counter() - start
+                self._check()
+            self._queue.append(data)
+            self._queueBytes += size
+            self.maxQueueBytes = max(self.maxQueueBytes, self._queueBytes)
+            self._cond.notify_all()
+        return size
+
+    def _check(self):
+        if self.error is not None:
+            raise Exception(f'write {self.path} failed: {self.error}')
+        if self._closed:
+            raise Exception(f'write {self.path} after close')
+
+    def flush(self, timeout=None):
+        """ 等待已入队的数据全部写入
+        :return: 是否在超时前写完
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queueBytes or self.error is not None, timeout)
+
+    def close(self):
+        """ 写完队列中的数据后关闭文件, FsyncPolicy 不是 Never 时关闭前 fsync
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        try:
+            if self.error is None and self.fsync != FsyncPolicy.Never:
+                self._sync()
+        finally:
+            os.close(self.fd)
+        if self.error is not None:
+            raise Exception(f'write {self.path} failed: {self.error}')
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def stats(self):
+        elapsed = (monotonic() - self._startTime) or 1
+        return {
+            'queueBytes': self._queueBytes,
+            'queueDepth': len(self._queue),
+            'maxQueueBytes': self.maxQueueBytes,
+            'bytesWritten': self.bytesWritten,
+            'writeCalls': self.writeCalls,
+            'throughput': self.bytesWritten / elapsed,  # 字节/秒
+            'diskThroughput': self.bytesWritten / self.writeTime if self.writeTime else 0.0,
+            'fsyncCount': self.fsyncCount,
+            'blockedTime': self.blockedTime,
+        }
+
+    def _sync(self):
+        os.fsync(self.fd)
+        self.fsyncCount += 1
+        self._lastSync = monotonic()
+        self._dirty = False
+
+    def _sync_due(self):
+        return self.fsync == FsyncPolicy.Interval and self._dirty and \
+            monotonic() - self._lastSync >= self.fsyncInterval
+
+    def _loop(self):
+        interval = self.fsyncInterval if self.fsync == FsyncPolicy.Interval else None
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed and not self._sync_due():
+                    self._cond.wait(interval)
+                if not self._queue and self._closed:
+                    return
+                chunks = self._queue[:IOV_MAX]
+                del self._queue[:IOV_MAX]
+            try:
+                if chunks:
+                    self._write_chunks(chunks)
+                if self._sync_due():
+                    self._sync()
+            except Exception as E:
+                logger.warning(f'file write error {self.path}: {E}')
+                with self._cond:
+                    self.error = E
+                    self._queue.clear()
+                    self._queueBytes = 0
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._queueBytes -= sum(len(chunk) for chunk in chunks)
+                self._cond.notify_all()
+
+    def _write_chunks(self, chunks):
+        start = perf_counter()
+        chunks = [memoryview(chunk).cast('B') for chunk in chunks]
+        while chunks:
+            if hasattr(os, 'writev'):
+                written = os.writev(self.fd, chunks)
+            else:
+                written = os.write(self.fd, chunks[0])
+            self.writeCalls += 1
+            self.bytesWritten += written
+            # 部分写入时跳过已写完的部分继续
+            while chunks and written >= len(chunks[0]):
+                written -= len(chunks[0])
+                chunks.pop(0)
+            if written:
+                chunks[0] = chunks[0][written:]
+        self._dirty = True
+        self.writeTime += perf_counter() - start
@@ -1,5 +1,4 @@
 import logging
-import struct
 import threading
 from time import sleep
 
@@ -15,7 +14,8 @@ gi.require_version('GstAudio', '1.0')
 gi.require_version('GstVideo', '1.0')
 gi.require_version('Gtk', '3.0')
 
-from .consumer import startCode, Consumer
+from .consumer import Consumer
+from .nalu import to_annexb, parameter_sets_annexb
 from gi.repository import Gst, Gtk
 
 logger = logging.getLogger("ioscreen")
@@ -152,6 +152,7 @@ class GstAdapter(Consumer):
     videoAppSrcTargetElementName = "video_target"
     MP3 = "mp3"
     OGG = "ogg"
+    fields = frozenset(('SampleData', 'OutputPresentationTimestamp', 'FormatDescription'))
 
     def __init__(self, videoAppSrc, audioAppSrc, firstAudioSample, loop=None, pipeline=None, stopSignal=None):
         self.videoAppSrc = videoAppSrc
@@ -160,6 +161,7 @@ class GstAdapter(Consumer):
         self.pipeline = pipeline
         self.loop = loop
         self.stopSignal = stopSignal
+        self.parameterSetsSent = False
 
     @classmethod
     def new(cls, stopSignal, title: str, width: int):
@@ -197,17 +199,19 @@ class GstAdapter(Consumer):
 
         if data.HasFormatDescription:
             data.OutputPresentationTimestamp.CMTimeValue = 0
-            self.write_app_src(startCode + data.FormatDescription.PPS, data)
-            self.write_app_src(startCode + data.FormatDescription.SPS, data)
-        self.write_buffers(data)
-
-    def write_buffers(self, data: CMSampleBuffer):
-        buf = data.SampleData
-        if buf:
-            while len(buf) > 0:
-                _length = struct.unpack('>I', buf[:4])[0]
-                self.write_app_src(startCode + buf[4:_length + 4], data)
-                buf = buf[_length + 4:]
+        # SPS/PPS 只在格式变化或还没有推送过时推送, 与同一帧合并为一个 buffer
+        prefix = b''
+        if data.HasFormatDescription and (data.FormatChanged or not self.parameterSetsSent):
+            prefix = parameter_sets_annexb(data.FormatDescription)
+            self.parameterSetsSent = True
+        self.write_buffers(data, prefix)
+
+    def write_buffers(self, data: CMSampleBuffer, prefix=b''):
+        """ 整帧 (access unit) 转为 Annex-B 后作为一个 Gst.Buffer 推送
+        """
+        if data.SampleData or prefix:
+            # PyGObject 只对 bytes 走整块拷贝, bytearray 会按序列逐个转换
+            self.write_app_src(bytes(to_annexb(data.SampleData or b'', prefix)), data)
         return True
 
     def write_app_src(self, buf, data: CMSampleBuffer):
@@ -229,7 +233,7 @@ class GstAdapter(Consumer):
         gstBuf = Gst.Buffer.new_allocate(None, len(data.SampleData), None)
         gstBuf.pts = data.OutputPresentationTimestamp.CMTimeValue
         gstBuf.dts = 0
-        gstBuf.fill(0, data.SampleData)
+        gstBuf.fill(0, bytes(data.SampleData))
         self.audioAppSrc.emit('push-buffer', gstBuf)
 
     def stop(self):
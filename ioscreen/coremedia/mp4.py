@@ -0,0 +1,353 @@
+"""
+fragmented MP4 输出: 文件头 ftyp/moov, 之后每个分片一个 moof/mdat, 写完的分片即可播放, 进程中断时只丢失最后一个分片
+视频 H.264 (avc1), 时间刻度 90kHz; 音频为 PCM (sowt/twos), 时间刻度为采样率
+"""
+import io
+import logging
+import struct
+from time import monotonic
+
+from .AudioStream import AudioStreamBasicDescription
+from .CMFormatDescription import DescriptorConst, FormatDescriptor
+from .CMSampleBuffer import CMSampleBuffer, SampleTimingTable
+from .CMTime import ClockRate90kHz
+from .consumer import Consumer
+from .filewriter import AsyncFileWriter, FsyncPolicy
+from .nalu import contains_idr, naluLengthStruct, classify_parameter_sets
+
+logger = logging.getLogger("ioscreen")
+
+VideoTrackID = 1
+AudioTrackID = 2
+
+# trun/tfhd 中的 sample_flags
+SyncSampleFlags = 0x02000000  # sample_depends_on = 2
+NonSyncSampleFlags = 0x01010000  # sample_depends_on = 1, sample_is_non_sync_sample
+
+AudioFormatFlagIsBigEndian = 0x2
+
+boxHeaderStruct = struct.Struct('>I4s')
+fullBoxFlagsStruct = struct.Struct('>I')
+videoSampleStruct = struct.Struct('>IIIi')  # duration, size, flags, composition offset
+
+unityMatrix = struct.pack('>9i', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+languageUnd = 0x55C4  # ISO-639-2 'und'
+highProfiles = (100, 110, 122, 144)
+
+
+def box(boxType, *payloads):
+    """
+    :param boxType: 4 字节 bytes
+    :param payloads: bytes/bytearray
+    :return: bytes
+    """
+    return boxHeaderStruct.pack(8 + sum(len(payload) for payload in payloads), boxType) + b''.join(payloads)
+
+
+def full_box(boxType, version, flags, *payloads):
+    return box(boxType, fullBoxFlagsStruct.pack(version << 24 | flags), *payloads)
+
+
+def avcc_box(sps, pps):
+    """ AVCDecoderConfigurationRecord, NALU 长度前缀固定 4 字节
+    High profile 的扩展字段按 4:2:0 8 bit 填写, 与设备自带的 avcC 一致
+    """
+    payload = struct.pack('>BBBBBBH', 1, sps[1], sps[2], sps[3], 0xFF, 0xE1, len(sps)) + sps + \
+        struct.pack('>BH', 1, len(pps)) + pps
+    if sps[1] in highProfiles:
+        payload += b'\xfd\xf8\xf8\x00'
+    return box(b'avcC', payload)
+
+
+def ftyp_box():
+    return box(b'ftyp', b'iso5', struct.pack('>I', 512), b'iso5iso6mp41')
+
+
+def mvhd_box(nextTrackID):
+    return full_box(b'mvhd', 0, 0, struct.pack('>IIIIIH10x', 0, 0, 1000, 0, 0x10000, 0x0100), unityMatrix,
+                    bytes(24), struct.pack('>I', nextTrackID))
+
+
+def tkhd_box(trackID, volume, width=0, height=0):
+    return full_box(b'tkhd', 0, 0x3, struct.pack('>IIIII8xhhH2x', 0, 0, trackID, 0, 0, 0, 0, volume), unityMatrix,
+                    struct.pack('>II', width << 16, height << 16))
+
+
+def mdia_box(timescale, handlerType, name, mediaHeader, sampleEntry):
+    mdhd = full_box(b'mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, timescale, 0, languageUnd, 0))
+    hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, handlerType), name + b'\x00')
+    dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1)))
+    stbl = box(b'stbl',
+               full_box(b'stsd', 0, 0, struct.pack('>I', 1), sampleEntry),
+               full_box(b'stts', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsc', 0, 0, struct.pack('>I', 0)),
+               full_box(b'stsz', 0, 0, struct.pack('>II', 0, 0)),
+               full_box(b'stco', 0, 0, struct.pack('>I', 0)))
+    return box(b'mdia', mdhd, hdlr, box(b'minf', mediaHeader, dinf, stbl))
+
+
+def video_trak_box(formatDescription: FormatDescriptor):
+    sps, pps = classify_parameter_sets(formatDescription)
+    width, height = formatDescription.VideoDimensionWidth, formatDescription.VideoDimensionHeight
+    sampleEntry = box(b'avc1', bytes(6), struct.pack('>H', 1), bytes(16),
+                      struct.pack('>HHIIIH', width, height, 0x00480000, 0x00480000, 0, 1), bytes(32),
+                      struct.pack('>Hh', 0x0018, -1), avcc_box(sps, pps))
+    vmhd = full_box(b'vmhd', 0, 1, bytes(8))
+    return box(b'trak', tkhd_box(VideoTrackID, 0, width, height),
+               mdia_box(ClockRate90kHz, b'vide', b'VideoHandler', vmhd, sampleEntry))
+
+
+def audio_trak_box(audioStream: AudioStreamBasicDescription):
+    sampleRate = int(audioStream.SampleRate)
+    codec = b'twos' if audioStream.FormatFlags & AudioFormatFlagIsBigEndian else b'sowt'
+    sampleEntry = box(codec, bytes(6), struct.pack('>H', 1), bytes(8),
+                      struct.pack('>HHHHI', audioStream.ChannelsPerFrame, audioStream.BitsPerChannel, 0, 0,
+                                  sampleRate << 16))
+    smhd = full_box(b'smhd', 0, 0, bytes(4))
+    return box(b'trak', tkhd_box(AudioTrackID, 0x0100),
+               mdia_box(sampleRate, b'soun', b'SoundHandler', smhd, sampleEntry))
+
+
+def trex_box(trackID):
+    return full_box(b'trex', 0, 0, struct.pack('>IIIII', trackID, 1, 0, 0, 0))
+
+
+def moov_box(videoFormat: FormatDescriptor = None, audioStream: AudioStreamBasicDescription = None):
+    traks, trexs = [], []
+    if videoFormat is not None:
+        traks.append(video_trak_box(videoFormat))
+        trexs.append(trex_box(VideoTrackID))
+    if audioStream is not None:
+        traks.append(audio_trak_box(audioStream))
+        trexs.append(trex_box(AudioTrackID))
+    return box(b'moov', mvhd_box(AudioTrackID + 1), *traks, box(b'mvex', *trexs))
+
+
+def video_traf_box(baseMediaDecodeTime, samples, dataOffset):
+    """
+    :param samples: [(duration, size, flags, compositionOffset)]
+    """
+    entries = b''.join(videoSampleStruct.pack(*sample) for sample in samples)
+    return box(b'traf',
+               full_box(b'tfhd', 0, 0x020000, struct.pack('>I', VideoTrackID)),
+               full_box(b'tfdt', 1, 0, struct.pack('>Q', baseMediaDecodeTime)),
+               full_box(b'trun', 1, 0x000F01, struct.pack('>Ii', len(samples), dataOffset), entries))
+
+
+def audio_traf_box(baseMediaDecodeTime, numFrames, bytesPerFrame, dataOffset):
+    """ PCM 每帧一个 sample, 时长和大小都用 tfhd 中的默认值
+    """
+    return box(b'traf',
+               full_box(b'tfhd', 0, 0x020038, struct.pack('>IIII', AudioTrackID, 1, bytesPerFrame, SyncSampleFlags)),
+               full_box(b'tfdt', 1, 0, struct.pack('>Q', baseMediaDecodeTime)),
+               full_box(b'trun', 0, 0x000001, struct.pack('>Ii', numFrames, dataOffset)))
+
+
+def moof_box(sequenceNumber, video=None, audio=None):
+    """ data_offset 相对 moof 起始位置 (default-base-is-moof), moof 长度与 data_offset 的值无关, 先用 0 计算长度
+    :param video: (baseMediaDecodeTime, samples, videoBytes)
+    :param audio: (baseMediaDecodeTime, numFrames, bytesPerFrame)
+    """
+
+    def build(dataOffset):
+        trafs = []
+        if video is not None:
+            trafs.append(video_traf_box(video[0], video[1], dataOffset))
+            dataOffset += video[2]
+        if audio is not None:
+            trafs.append(audio_traf_box(audio[0], audio[1], audio[2], dataOffset))
+        return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', sequenceNumber)), *trafs)
+
+    return build(len(build(0)) + 8)
+
+
+class Mp4Writer(Consumer):
+    """ 把 H.264 与 PCM 音频写入一个 fragmented MP4 文件
+    视频时间戳来自 SampleTimingInfoArray (没有时用 OutputPresentationTimestamp), 换算到 90kHz;
+    音频按采样帧连续计数. 两者的设备时钟不同, 音轨起点按首个音频到达时与首个视频的本地时间差对齐
+
+    :param path: 输出文件
+    :param video: 是否包含视频轨
+    :param audio: 是否包含音频轨
+    :param fragmentDuration: 分片时长(秒), 达到后在下一个关键帧处切分
+    :param maxFragmentDuration: 分片最长时长(秒), 没有关键帧时也切分
+    :param asyncWrite: 使用 AsyncFileWriter
+    """
+    fields = frozenset(('SampleData', 'FormatDescription', 'SampleTimingInfoArray', 'OutputPresentationTimestamp'))
+
+    def __init__(self, path, video=True, audio=True, fragmentDuration=1.0, maxFragmentDuration=5.0,
+                 asyncWrite=False, writeBufferSize=8 * 1024 * 1024, fsync=FsyncPolicy.Never, fsyncInterval=5.0):
+        if not video and not audio:
+            raise Exception('Mp4Writer needs at least one track')
+        self.path = path
+        self.video = video
+        self.audio = audio
+        self.mediaTypes = frozenset(mediaType for mediaType, enabled in ((DescriptorConst.MediaTypeVideo, video),
+                                                                         (DescriptorConst.MediaTypeSound, audio))
+                                    if enabled)
+        self.fragmentDuration = int(fragmentDuration * ClockRate90kHz)
+        self.maxFragmentDuration = int(maxFragmentDuration * ClockRate90kHz)
+        if asyncWrite:
+            self.fileWriter = AsyncFileWriter(path, writeBufferSize, fsync, fsyncInterval)
+        else:
+            self.fileWriter: io.open = io.open(path, 'wb')
+        self.audioStream: AudioStreamBasicDescription = None
+        self.started = False
+        self.startTime = None  # 写入 moov 时的本地时间
+        self.sequenceNumber = 0
+        self.droppedSamples = 0  # moov 写入之前收到的 sample
+        # 视频: 分片中的 (dts, compositionOffset, size, flags, chunks), 时间均为 90kHz
+        self._videoSamples = []
+        self._videoStartDts = None
+        self._lastDts = None  # 上一帧相对第一帧的 dts
+        self._parameterSets = None  # 当前使用的 (sps, pps)
+        self._videoDecodeTime = 0  # 下一个分片的 tfdt
+        self._defaultDuration = ClockRate90kHz // 60
+        # 音频
+        self._audioChunks = []
+        self._audioFrames = 0
+        self._audioDecodeTime = None
+
+    def consume(self, data: CMSampleBuffer):
+        if data.MediaType == DescriptorConst.MediaTypeSound:
+            if self.audio:
+                self.consume_audio(data)
+        elif self.video:
+            self.consume_video(data)
+
+    def _start(self, videoFormat=None):
+        audioStream = None
+        if self.audio:
+            if self.audioStream is None:
+                self.audioStream = AudioStreamBasicDescription.new()
+            audioStream = self.audioStream
+        self._write(ftyp_box(), moov_box(videoFormat, audioStream))
+        self.started = True
+        self.startTime = monotonic()
+
+    def consume_video(self, data: CMSampleBuffer):
+        prefix = b''
+        if not self.started:
+            if not data.HasFormatDescription:
+                self.droppedSamples += 1
+                return
+            self._start(data.FormatDescription)
+            self._parameterSets = classify_parameter_sets(data.FormatDescription)
+        elif data.FormatChanged and data.HasFormatDescription:
+            # moov 中只有第一组 SPS/PPS, 之后的变化 (如旋转) 放在帧内
+            parameterSets = classify_parameter_sets(data.FormatDescription)
+            if parameterSets != self._parameterSets:
+                self._parameterSets = parameterSets
+                sps, pps = parameterSets
+                prefix = naluLengthStruct.pack(len(sps)) + sps + naluLengthStruct.pack(len(pps)) + pps
+                logger.info(f'mp4 video format changed to {data.FormatDescription.VideoDimensionWidth}x'
+                            f'{data.FormatDescription.VideoDimensionHeight}')
+        if not data.SampleData:
+            return
+        data.materialize()
+        pts, dts, duration = self._video_timing(data)
+        if duration > 0:
+            self._defaultDuration = duration
+        isIdr = contains_idr(data.SampleData)
+        if self._videoSamples:
+            pending = dts - self._videoSamples[0][0]
+            if (isIdr and pending >= self.fragmentDuration) or pending >= self.maxFragmentDuration:
+                self.flush(dts)
+        chunks = (prefix, data.SampleData) if prefix else (data.SampleData,)
+        self._videoSamples.append((dts, pts - dts, len(prefix) + len(data.SampleData),
+                                   SyncSampleFlags if isIdr else NonSyncSampleFlags, chunks))
+
+    def _video_timing(self, data: CMSampleBuffer):
+        """
+        :return: 相对第一帧的 (pts, dts, duration), 90kHz
+        """
+        table: SampleTimingTable = data.SampleTimingInfoArray
+        if table is not None and len(table) and table.Scales[SampleTimingTable.PresentationTimeStamp]:
+            pts = table.to_90khz(SampleTimingTable.PresentationTimeStamp)[0]
+            dts = table.to_90khz(SampleTimingTable.DecodeTimeStamp)[0] \
+                if table.Scales[SampleTimingTable.DecodeTimeStamp] else pts
+            duration = table.to_90khz(SampleTimingTable.Duration)[0]
+        elif data.OutputPresentationTimestamp is not None and data.OutputPresentationTimestamp.is_valid():
+            pts = dts = data.OutputPresentationTimestamp.to_90khz()
+            duration = 0
+        else:
+            # 没有有效时间戳时按上一帧加默认时长估算
+            dts = self._lastDts + self._defaultDuration if self._lastDts is not None else 0
+            self._lastDts = dts
+            return dts, dts, 0
+        if self._videoStartDts is None:
+            self._videoStartDts = dts - (self._lastDts + self._defaultDuration if self._lastDts is not None else 0)
+        self._lastDts = dts - self._videoStartDts
+        return pts - self._videoStartDts, self._lastDts, duration
+
+    def consume_audio(self, data: CMSampleBuffer):
+        if data.HasFormatDescription and self.audioStream is None:
+            self.audioStream = data.FormatDescription.AudioStreamBasicDescription
+        if not self.started:
+            if self.video:
+                self.droppedSamples += 1
+                return
+            self._start()
+        if not data.SampleData:
+            return
+        bytesPerFrame = self.audioStream.BytesPerFrame
+        if self._audioDecodeTime is None:
+            self._audioDecodeTime = round((monotonic() - self.startTime) * self.audioStream.SampleRate)
+        numFrames = len(data.SampleData) // bytesPerFrame
+        if not numFrames:
+            return
+        data.materialize()
+        self._audioChunks.append(data.SampleData[:numFrames * bytesPerFrame])
+        self._audioFrames += numFrames
+        if self._audioFrames * ClockRate90kHz >= self.audioStream.SampleRate * \
+                (self.maxFragmentDuration if self.video else self.fragmentDuration):
+            self.flush()
+
+    def flush(self, nextDts=None):
+        """ 写出当前分片
+        :param nextDts: 下一帧视频的 dts, 用于计算分片中最后一帧的时长
+        """
+        videoSamples, self._videoSamples = self._videoSamples, []
+        audioChunks, self._audioChunks = self._audioChunks, []
+        audioFrames, self._audioFrames = self._audioFrames, 0
+        if not videoSamples and not audioFrames:
+            return
+        video = audio = None
+        chunks = []
+        if videoSamples:
+            # 设备没有画面变化时不发送视频帧, tfdt 跟随实际 dts 跳过空白
+            baseTime = max(self._videoDecodeTime, videoSamples[0][0])
+            samples = []
+            videoBytes = 0
+            for i, (dts, compositionOffset, size, flags, sampleChunks) in enumerate(videoSamples):
+                following = videoSamples[i + 1][0] if i + 1 < len(videoSamples) else nextDts
+                duration = following - dts if following is not None else self._defaultDuration
+                if not 0 < duration < self.maxFragmentDuration:
+                    duration = self._defaultDuration
+                samples.append((duration, size, flags, compositionOffset))
+                videoBytes += size
+                chunks.extend(sampleChunks)
+            self._videoDecodeTime = baseTime + sum(sample[0] for sample in samples)
+            video = (baseTime, samples, videoBytes)
+        if audioFrames:
+            bytesPerFrame = self.audioStream.BytesPerFrame
+            audio = (self._audioDecodeTime, audioFrames, bytesPerFrame)
+            self._audioDecodeTime += audioFrames
+            chunks.extend(audioChunks)
+        self.sequenceNumber += 1
+        mdatSize = 8 + sum(len(chunk) for chunk in chunks)
+        self._write(moof_box(self.sequenceNumber, video, audio), boxHeaderStruct.pack(mdatSize, b'mdat'), *chunks)
+
+    def _write(self, *chunks):
+        for chunk in chunks:
+            self.fileWriter.write(chunk)
+        if not isinstance(self.fileWriter, AsyncFileWriter):
+            self.fileWriter.flush()  # 分片完整写出后才可以被读取
+
+    def stop(self):
+        try:
+            self.flush()
+        finally:
+            self.fileWriter.close()
+        if self.droppedSamples:
+            logger.info(f'mp4 dropped {self.droppedSamples} samples received before the first keyframe')
@@ -0,0 +1,129 @@
+"""
+H.264 NALU 工具, SampleData 为 AVCC 格式: 每个 NALU 前是 4 字节大端长度
+"""
+import enum
+import struct
+
+startCode = b'\x00\x00\x00\x01'
+
+naluLengthStruct = struct.Struct('>I')
+
+
+class NaluType(enum.IntEnum):
+    NonIdr = 1
+    Idr = 5
+    SEI = 6
+    SPS = 7
+    PPS = 8
+    AUD = 9
+
+
+_idr = int(NaluType.Idr)
+
+
+class Nalu:
+    """
+    data: 不含长度前缀的 memoryview, 引用原 buffer 不拷贝
+    offset: 长度前缀在原 buffer 中的位置
+    """
+    __slots__ = ('data', 'type', 'offset')
+
+    def __init__(self, data, type, offset):
+        self.data = data
+        self.type = type
+        self.offset = offset
+
+    @property
+    def isIdr(self):
+        return self.type == _idr
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return f'[len:{len(self.data)},type：{self.type}]'
+
+    __repr__ = __str__
+
+
+def iter_nalus(data):
+    """ 遍历 AVCC 格式的 NALU, 末尾长度不足时截断到 buffer 结尾, 空 NALU 跳过
+    :param data: bytes/bytearray/memoryview
+    :return: Nalu 生成器
+    """
+    buf = memoryview(data)
+    size = len(buf)
+    index = 0
+    while index + 4 < size:
+        _length = naluLengthStruct.unpack_from(buf, index)[0]
+        start = index + 4
+        end = min(start + _length, size)
+        if end > start:
+            yield Nalu(buf[start:end], buf[start] & 0x1f, index)
+        index = start + _length
+
+
+def contains_idr(data):
+    """ SampleData 中是否包含 IDR NALU (type 5)
+    :param data: 4 字节大端长度前缀的 NALU 序列
+    :return:
+    """
+    return any(nalu.isIdr for nalu in iter_nalus(data))
+
+
+def avcc_to_annexb(buf):
+    """ 原地把 4 字节长度前缀改写为起始码, 长度相同所以不需要移动数据
+    :param buf: 可写的 bytearray/memoryview
+    :return: buf
+    """
+    index = 0
+    size = len(buf)
+    while index + 4 <= size:
+        _length = naluLengthStruct.unpack_from(buf, index)[0]
+        buf[index:index + 4] = startCode
+        index += _length + 4
+    return buf
+
+
+def to_annexb(data, prefix=b''):
+    """ 复制一次得到 Annex-B 格式的整帧, 可以一次写入文件或推送
+    :param data: AVCC 格式的 SampleData, 不会被修改
+    :param prefix: 已是 Annex-B 格式的前缀, 如 SPS/PPS
+    :return: bytearray
+    """
+    buf = bytearray(len(prefix) + len(data))
+    buf[:len(prefix)] = prefix
+    buf[len(prefix):] = data
+    avcc_to_annexb(memoryview(buf)[len(prefix):])
+    return buf
+
+
+def parameter_sets_annexb(formatDescription):
+    """ FormatDescriptor 中的 SPS/PPS, Annex-B 格式
+    注意 FormatDescriptor.PPS 存的是 SPS, .SPS 存的是 PPS
+    """
+    return startCode + formatDescription.PPS + startCode + formatDescription.SPS
+
+
+def classify_parameter_sets(formatDescription):
+    """ FormatDescriptor 的 PPS/SPS 命名与内容相反, 按 NAL 类型区分
+    :return: (sps, pps)
+    """
+    sps = pps = None
+    for nalu in (formatDescription.PPS, formatDescription.SPS):
+        if not nalu:
+            continue
+        nalType = nalu[0] & 0x1f
+        if nalType == NaluType.SPS:
+            sps = bytes(nalu)
+        elif nalType == NaluType.PPS:
+            pps = bytes(nalu)
+    if sps is None or pps is None:
+        raise Exception(f'missing SPS/PPS in {formatDescription}')
+    return sps, pps
+
+
+def get_nalu_details(data):
+    if not data:
+        return ''
+    return ''.join(str(nalu) for nalu in iter_nalus(data))
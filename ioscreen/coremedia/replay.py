@@ -0,0 +1,164 @@
+"""
+即时回放: 内存中保留最近一段时间的音视频, 需要时导出到文件, 不影响正在进行的采集
+"""
+import collections
+import copy
+import logging
+import os
+import signal
+import threading
+import time
+from time import monotonic
+
+from .CMFormatDescription import DescriptorConst
+from .CMSampleBuffer import CMSampleBuffer
+from .consumer import Consumer, AVFileWriter
+from .nalu import contains_idr
+
+logger = logging.getLogger("ioscreen")
+
+
+class Gop:
+    """ 从一个 IDR 开始到下一个 IDR 之前的视频帧, 以及期间收到的音频
+    """
+    __slots__ = ('samples', 'startTime', 'size', 'videoFormat')
+
+    def __init__(self, startTime, videoFormat):
+        self.samples = []
+        self.startTime = startTime  # 本地时间, 音视频的设备时钟不同
+        self.size = 0
+        self.videoFormat = videoFormat  # GOP 开始时的视频 FormatDescriptor
+
+
+class ReplayBuffer(Consumer):
+    """ 按 GOP 淘汰的环形缓冲, 缓冲总是从 IDR 开始
+    总时长超过 maxSeconds 或总字节数超过 maxBytes 时删除最早的 GOP, 当前 GOP 总是保留
+
+    :param maxSeconds: 最多保留的秒数
+    :param maxBytes: 最多保留的 SampleData 字节数
+    """
+    fields = frozenset(('SampleData', 'FormatDescription', 'SampleTimingInfoArray', 'OutputPresentationTimestamp'))
+
+    def __init__(self, maxSeconds=30.0, maxBytes=256 * 1024 * 1024):
+        self.maxSeconds = maxSeconds
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.evictedGops = 0
+        self._gops = collections.deque()
+        self._videoFormat = None
+        self._audioFormat = None
+        self._lock = threading.Lock()
+
+    def consume(self, data: CMSampleBuffer):
+        now = monotonic()
+        isVideo = data.MediaType == DescriptorConst.MediaTypeVideo
+        if data.HasFormatDescription:
+            if isVideo:
+                self._videoFormat = data.FormatDescription
+            else:
+                self._audioFormat = data.FormatDescription
+        if not data.SampleData:
+            return
+        newGop = isVideo and self._videoFormat is not None and contains_idr(data.SampleData)
+        if not newGop and not self._gops:
+            return  # 第一个 IDR 之前的数据无法单独播放
+        data.materialize()  # 不再引用 USB 读取缓冲区
+        size = len(data.SampleData)
+        with self._lock:
+            if newGop:
+                self._gops.append(Gop(now, self._videoFormat))
+            gop = self._gops[-1]
+            gop.samples.append(data)
+            gop.size += size
+            self.size += size
+            while len(self._gops) > 1 and (self.size > self.maxBytes
+                                           or now - self._gops[1].startTime >= self.maxSeconds):
+                self.size -= self._gops.popleft().size
+                self.evictedGops += 1
+
+    def duration(self):
+        """
+        :return: 缓冲中最早的 GOP 到现在的秒数
+        """
+        with self._lock:
+            return monotonic() - self._gops[0].startTime if self._gops else 0.0
+
+    def snapshot(self):
+        """ 复制当前缓冲的 sample 列表, 之后的 consume/淘汰不会影响返回值
+        第一个视频/音频 sample 带上当时的 FormatDescription, 写入端从头就能得到 SPS/PPS
+        :return: [CMSampleBuffer]
+        """
+        with self._lock:
+            if not self._gops:
+                return []
+            videoFormat = self._gops[0].videoFormat
+            samples = [sample for gop in self._gops for sample in gop.samples]
+        audioFormat = self._audioFormat
+        for i, sample in enumerate(samples):
+            if sample.MediaType == DescriptorConst.MediaTypeVideo:
+                samples[i] = with_format(sample, videoFormat)
+                break
+        if audioFormat is not None:
+            for i, sample in enumerate(samples):
+                if sample.MediaType == DescriptorConst.MediaTypeSound:
+                    samples[i] = with_format(sample, audioFormat)
+                    break
+        return samples
+
+    def dump(self, consumer: Consumer, wait=False):
+        """ 把当前缓冲写入 consumer (AVFileWriter/Mp4Writer 等), 在独立线程中执行, 完成后调用 consumer.stop()
+        :param wait: 是否等待写完
+        :return: 写入线程
+        """
+        samples = self.snapshot()
+
+        def run():
+            try:
+                for sample in samples:
+                    if consumer.wants(sample.MediaType):
+                        consumer.consume(sample)
+            except Exception as E:
+                logger.exception(E)
+            finally:
+                consumer.stop()
+            logger.info(f'replay dumped {len(samples)} samples')
+
+        thread = threading.Thread(target=run, name='ioscreen-replay-dump', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return thread
+
+    def dump_files(self, h264FilePath, wavFilePath, wait=False):
+        """ 导出为 h264 裸流和 wav
+        """
+        return self.dump(AVFileWriter(h264FilePath=h264FilePath, wavFilePath=wavFilePath), wait)
+
+
+def with_format(sample: CMSampleBuffer, formatDescription):
+    """ 浅拷贝 sample 并设置 FormatDescription, 不修改缓冲中的对象
+    """
+    if formatDescription is None:
+        return sample
+    result = copy.copy(sample)
+    result.FormatDescription = formatDescription
+    result.HasFormatDescription = True
+    result.FormatChanged = True
+    return result
+
+
+def register_dump_signal(replay: ReplayBuffer, directory, prefix='replay', signum=signal.SIGUSR1):
+    """ 收到 signum 时把缓冲导出到 directory/{prefix}-{时间}.h264/.wav
+    信号处理函数只启动导出线程, 快照和写入都不在信号处理中进行
+    """
+
+    def dump():
+        base = os.path.join(directory, f'{prefix}-{time.strftime("%Y%m%d-%H%M%S")}')
+        logger.info(f'dumping replay buffer to {base}')
+        replay.dump_files(base + '.h264', base + '.wav')
+
+    def handler(num, frame):
+        threading.Thread(target=dump, name='ioscreen-replay-signal', daemon=True).start()
+
+    os.makedirs(directory, exist_ok=True)
+    signal.signal(signum, handler)
@@ -0,0 +1,231 @@
+"""
+RTP H.264 封包 (RFC 6184): Single NAL / STAP-A / FU-A, 一帧的所有包用 sendmmsg 一次发送
+"""
+import base64
+import ctypes
+import ctypes.util
+import logging
+import random
+import socket
+import struct
+import sys
+
+logger = logging.getLogger("ioscreen")
+
+RtpHeaderSize = 12
+RtpVersion = 0x80
+StapA = 24
+FuA = 28
+
+rtpHeaderStruct = struct.Struct('>BBHII')
+uint16Struct = struct.Struct('>H')
+
+UIO_MAXIOV = 1024
+
+
+class RtpPacketizer:
+    """
+    :param mtu: 每个 RTP 包 (不含 IP/UDP 头) 的最大字节数
+    :param payloadType: 动态负载类型
+    :param ssrc: 默认随机
+    """
+
+    def __init__(self, mtu=1400, payloadType=96, ssrc=None):
+        if mtu <= RtpHeaderSize + 2:
+            raise Exception(f'mtu {mtu} too small')
+        self.mtu = mtu
+        self.payloadType = payloadType
+        self.ssrc = random.getrandbits(32) if ssrc is None else ssrc
+        self.sequenceNumber = random.getrandbits(16)
+        self.timestampOffset = random.getrandbits(32)
+        self.packetCount = 0
+
+    def packetize(self, nalus, timestamp):
+        """ 一个 access unit 的所有 NALU 封包, 最后一个包设置 marker
+        :param nalus: 不含起始码/长度前缀的 NALU 序列
+        :param timestamp: 90kHz 时间戳
+        :return: [bytes]
+        """
+        maxPayload = self.mtu - RtpHeaderSize
+        payloads = []
+        pending = []  # 等待聚合为 STAP-A 的小 NALU
+        pendingSize = 1
+        for nalu in nalus:
+            size = len(nalu)
+            if not size:
+                continue
+            if pending and pendingSize + 2 + size <= maxPayload:
+                pending.append(nalu)
+                pendingSize += 2 + size
+                continue
+            self._aggregate(pending, payloads)
+            pending = []
+            pendingSize = 1
+            if size > maxPayload:
+                self._fragment(nalu, maxPayload, payloads)
+            else:
+                pending.append(nalu)
+                pendingSize += 2 + size
+        self._aggregate(pending, payloads)
+
+        timestamp = (timestamp + self.timestampOffset) & 0xFFFFFFFF
+        packets = []
+        last = len(payloads) - 1
+        for i, payload in enumerate(payloads):
+            marker = 0x80 if i == last else 0
+            header = rtpHeaderStruct.pack(RtpVersion, marker | self.payloadType, self.sequenceNumber, timestamp,
+                                          self.ssrc)
+            self.sequenceNumber = (self.sequenceNumber + 1) & 0xFFFF
+            packets.append(header + payload)
+        self.packetCount += len(packets)
+        return packets
+
+    @staticmethod
+    def _aggregate(pending, payloads):
+        if len(pending) == 1:
+            payloads.append(bytes(pending[0]))
+        elif pending:
+            nri = max(nalu[0] & 0x60 for nalu in pending)
+            forbidden = max(nalu[0] & 0x80 for nalu in pending)
+            parts = [bytes((forbidden | nri | StapA,))]
+            for nalu in pending:
+                parts.append(uint16Struct.pack(len(nalu)))
+                parts.append(nalu)
+            payloads.append(b''.join(parts))
+
+    @staticmethod
+    def _fragment(nalu, maxPayload, payloads):
+        nalu = memoryview(nalu)
+        header = nalu[0]
+        indicator = bytes((header & 0xE0 | FuA,))
+        nalType = header & 0x1F
+        chunkSize = maxPayload - 2
+        end = len(nalu)
+        index = 1
+        while index < end:
+            fuHeader = nalType
+            if index == 1:
+                fuHeader |= 0x80
+            if index + chunkSize >= end:
+                fuHeader |= 0x40
+            payloads.append(b''.join((indicator, bytes((fuHeader,)), nalu[index:index + chunkSize])))
+            index += chunkSize
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+def load_sendmmsg():
+    """
+    :return: libc sendmmsg, 不支持的平台返回 None
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+class RtpSender:
+    """ 通过已 connect 的 UDP socket 批量发送, 有 sendmmsg 时一次系统调用发送一批, 否则逐个 send
+
+    :param sock: 已 connect 到目标地址的 UDP socket
+    :param useSendmmsg: False 时总是逐个 send
+    """
+
+    def __init__(self, sock: socket.socket, useSendmmsg=True):
+        self.sock = sock
+        self._sendmmsg = load_sendmmsg() if useSendmmsg else None
+        self.packetsSent = 0
+        self.sendCalls = 0
+        self.errorCount = 0
+
+    @property
+    def batched(self):
+        return self._sendmmsg is not None
+
+    def send(self, packets):
+        if self._sendmmsg is None:
+            for packet in packets:
+                self._send_one(packet)
+            return
+        for start in range(0, len(packets), UIO_MAXIOV):
+            self._send_batch(packets[start:start + UIO_MAXIOV])
+
+    def _send_one(self, packet):
+        self.sendCalls += 1
+        try:
+            self.sock.send(packet)
+            self.packetsSent += 1
+        except OSError as E:
+            # 接收端未启动时 connect 的 UDP socket 会收到 ECONNREFUSED, 丢弃该包
+            self.errorCount += 1
+            logger.debug(f'rtp send error: {E}')
+
+    def _send_batch(self, packets):
+        count = len(packets)
+        iovecs = (iovec * count)()
+        messages = (mmsghdr * count)()
+        for i, packet in enumerate(packets):
+            iovecs[i].iov_base = ctypes.cast(ctypes.c_char_p(packet), ctypes.c_void_p)
+            iovecs[i].iov_len = len(packet)
+            messages[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+            messages[i].msg_hdr.msg_iovlen = 1
+        sent = 0
+        fd = self.sock.fileno()
+        while sent < count:
+            self.sendCalls += 1
+            ret = self._sendmmsg(fd, ctypes.addressof(messages) + sent * ctypes.sizeof(mmsghdr), count - sent, 0)
+            if ret < 0:
+                # 出错的包丢弃, 继续发送剩下的
+                self.errorCount += 1
+                logger.debug(f'rtp sendmmsg error: {ctypes.get_errno()}')
+                sent += 1
+                continue
+            sent += ret
+            self.packetsSent += ret
+
+
+def sdp_description(host, port, sps, pps, payloadType=96):
+    """ VLC/ffplay 可以直接打开的 SDP
+    """
+    spropParameterSets = ','.join(base64.b64encode(nalu).decode() for nalu in (sps, pps))
+    return '\r\n'.join((
+        'v=0',
+        f'o=- 0 0 IN IP4 {host}',
+        's=ioscreen',
+        f'c=IN IP4 {host}',
+        't=0 0',
+        f'm=video {port} RTP/AVP {payloadType}',
+        f'a=rtpmap:{payloadType} H264/90000',
+        f'a=fmtp:{payloadType} packetization-mode=1;profile-level-id={sps[1:4].hex()};'
+        f'sprop-parameter-sets={spropParameterSets}',
+        '',
+    ))
+
+
+def write_sdp(path, host, port, sps, pps, payloadType=96):
+    with open(path, 'w') as file:
+        file.write(sdp_description(host, port, sps, pps, payloadType))
@@ -0,0 +1,243 @@
+"""
+分段录制: 在关键帧处按时长或大小切换到新的 h264/wav 文件, 旧分段在后台线程中收尾
+"""
+import collections
+import logging
+import os
+import threading
+from time import monotonic
+
+from .CMFormatDescription import DescriptorConst
+from .CMSampleBuffer import CMSampleBuffer
+from .consumer import Consumer
+from .filewriter import AsyncFileWriter, FsyncPolicy
+from .nalu import contains_idr, parameter_sets_annexb, to_annexb
+from .wav import get_wav_header, set_wav_header
+
+logger = logging.getLogger("ioscreen")
+
+WavHeaderSize = 44
+MaxWavDataSize = 0xFFFFFFFF - 36  # RIFF ChunkSize = 36 + data 大小, 不能超过 4GB
+
+
+class Segment:
+    """ 一个分段的 h264/wav 文件
+    """
+    __slots__ = ('index', 'h264Path', 'wavPath', 'h264Writer', 'wavWriter', 'startTime', 'h264Bytes', 'wavBytes')
+
+    def __init__(self, index, h264Path, wavPath, h264Writer, wavWriter, startTime):
+        self.index = index
+        self.h264Path = h264Path
+        self.wavPath = wavPath
+        self.h264Writer = h264Writer
+        self.wavWriter = wavWriter
+        self.startTime = startTime
+        self.h264Bytes = 0
+        self.wavBytes = 0
+
+    @property
+    def size(self):
+        return self.h264Bytes + self.wavBytes + (WavHeaderSize if self.wavWriter else 0)
+
+    def paths(self):
+        return [path for path in (self.h264Path, self.wavPath) if path]
+
+    def finalize(self):
+        """ 写完剩余数据并关闭, 修正 wav 头中的长度
+        """
+        try:
+            if self.h264Writer:
+                self.h264Writer.close()
+        finally:
+            if self.wavWriter:
+                self.wavWriter.close()
+                with open(self.wavPath, 'rb+') as file:
+                    set_wav_header(os.stat(self.wavPath).st_size - WavHeaderSize, file)
+
+
+class SegmentedWriter(Consumer):
+    """ 分段保存 h264/wav, 每个视频分段从 IDR 开始并带有 SPS/PPS
+    解析线程只负责打开新文件和入队, 磁盘写入由 AsyncFileWriter 完成, 关闭/修正 wav 头/删除旧分段在收尾线程中完成
+    wav 头在打开时写入最大长度, 进程中断时文件仍可按流式 wav 读取
+
+    :param directory: 输出目录
+    :param prefix: 文件名前缀, 文件名为 {prefix}-{index:05d}.h264/.wav
+    :param maxDuration: 分段最长时长(秒), 按视频时间戳计算, 只有音频时按本地时间
+    :param maxBytes: 分段最大字节数
+    :param diskBudget: 所有分段的总字节数上限, 超过时删除最早的分段, None 表示不限制
+    """
+    fields = frozenset(('SampleData', 'FormatDescription'))
+
+    def __init__(self, directory, prefix='ioscreen', maxDuration=600.0, maxBytes=1024 * 1024 * 1024, diskBudget=None,
+                 video=True, audio=True, writeBufferSize=8 * 1024 * 1024, fsync=FsyncPolicy.Never,
+                 fsyncInterval=5.0):
+        if not video and not audio:
+            raise Exception('SegmentedWriter needs at least one stream')
+        self.directory = directory
+        self.prefix = prefix
+        self.maxDuration = maxDuration
+        self.maxBytes = maxBytes
+        self.diskBudget = diskBudget
+        self.video = video
+        self.audio = audio
+        self.mediaTypes = frozenset(mediaType for mediaType, enabled in ((DescriptorConst.MediaTypeVideo, video),
+                                                                         (DescriptorConst.MediaTypeSound, audio))
+                                    if enabled)
+        self.writeBufferSize = writeBufferSize
+        self.fsync = fsync
+        self.fsyncInterval = fsyncInterval
+        self.segment: Segment = None
+        self.nextIndex = 0
+        self.deletedSegments = 0
+        self._parameterSets = None  # Annex-B 格式的 SPS/PPS, 每个分段开头写入
+        self._writeParameterSets = False
+        self._lastTime = 0.0  # 上一个有效视频时间戳(秒)
+        self._completed = collections.deque()  # 已收尾的 Segment, 用于 diskBudget
+        self._completedBytes = 0
+        self._finalizeQueue = collections.deque()  # (Segment.finalize 或 _delete, Segment)
+        self._closed = False
+        self._cond = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._finalize_loop, name='ioscreen-segment-finalizer', daemon=True)
+        self._thread.start()
+
+    def consume(self, data: CMSampleBuffer):
+        if data.MediaType == DescriptorConst.MediaTypeSound:
+            if self.audio:
+                self.consume_audio(data)
+        elif self.video:
+            self.consume_video(data)
+
+    def consume_video(self, data: CMSampleBuffer):
+        if data.HasFormatDescription and (data.FormatChanged or self._parameterSets is None):
+            parameterSets = parameter_sets_annexb(data.FormatDescription)
+            if parameterSets != self._parameterSets:
+                self._parameterSets = parameterSets
+                self._writeParameterSets = True
+        if not data.SampleData or self._parameterSets is None:
+            return
+        isIdr = contains_idr(data.SampleData)
+        timestamp = data.OutputPresentationTimestamp
+        if timestamp is not None and timestamp.is_valid():
+            startTime = self._lastTime = timestamp.to_nanoseconds() / 1e9
+        else:
+            startTime = self._lastTime  # 无效时间戳沿用上一帧的时间
+        if self.segment is None or self.segment.startTime is None:
+            if not isIdr:
+                return  # 分段从关键帧开始
+            if self.segment is None:
+                self.rotate(startTime)
+            self.segment.startTime = startTime
+        elif isIdr and self._full(startTime - self.segment.startTime):
+            self.rotate(startTime)
+        prefix = b''
+        if self._writeParameterSets:
+            prefix = self._parameterSets
+            self._writeParameterSets = False
+        buf = to_annexb(data.SampleData, prefix)
+        self.segment.h264Writer.write(buf)
+        self.segment.h264Bytes += len(buf)
+        self._enforce_budget()
+
+    def consume_audio(self, data: CMSampleBuffer):
+        if not data.SampleData:
+            return
+        if self.segment is None:
+            if self.video:
+                return  # 第一个分段从视频关键帧开始
+            self.rotate(monotonic())
+        elif self.segment.wavBytes + len(data.SampleData) > MaxWavDataSize:
+            if self.video:
+                logger.warning('wav segment reached the RIFF size limit before the next keyframe')
+            self.rotate(None if self.video else monotonic())
+        elif not self.video and self._full(monotonic() - self.segment.startTime):
+            self.rotate(monotonic())
+        data.materialize()
+        self.segment.wavWriter.write(data.SampleData)
+        self.segment.wavBytes += len(data.SampleData)
+        self._enforce_budget()
+
+    def _full(self, duration):
+        return (self.maxDuration and duration >= self.maxDuration) or \
+               (self.maxBytes and self.segment.size >= self.maxBytes)
+
+    def rotate(self, startTime=None):
+        """ 打开新的分段, 当前分段交给收尾线程
+        :param startTime: 新分段第一个 sample 的时间(秒), None 时视频分段等待下一个关键帧
+        """
+        previous = self.segment
+        index = self.nextIndex
+        self.nextIndex += 1
+        base = os.path.join(self.directory, f'{self.prefix}-{index:05d}')
+        h264Path = base + '.h264' if self.video else None
+        wavPath = base + '.wav' if self.audio else None
+        h264Writer = wavWriter = None
+        if h264Path:
+            h264Writer = AsyncFileWriter(h264Path, self.writeBufferSize, self.fsync, self.fsyncInterval)
+        if wavPath:
+            wavWriter = AsyncFileWriter(wavPath, self.writeBufferSize, self.fsync, self.fsyncInterval)
+            wavWriter.write(get_wav_header(MaxWavDataSize))
+        self.segment = Segment(index, h264Path, wavPath, h264Writer, wavWriter, startTime)
+        self._writeParameterSets = True
+        if previous is not None:
+            with self._cond:
+                self._finalizeQueue.append((Segment.finalize, previous))
+                self._cond.notify_all()
+        logger.info(f'recording segment {base}')
+
+    def _enforce_budget(self):
+        """ 超出 diskBudget 时把最早的已收尾分段加入删除队列, 最新的分段总是保留
+        """
+        if not self.diskBudget or not self._completed:
+            return
+        with self._cond:
+            segment = self.segment
+            current, keep = (segment.size, 0) if segment is not None else (0, 1)
+            pending = sum(segment.size for action, segment in self._finalizeQueue if action == Segment.finalize)
+            while len(self._completed) > keep and self._completedBytes + pending + current > self.diskBudget:
+                segment = self._completed.popleft()
+                self._completedBytes -= segment.size
+                self._finalizeQueue.append((self._delete, segment))
+                self._cond.notify_all()
+
+    def _finalize_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._finalizeQueue or self._closed)
+                if not self._finalizeQueue:
+                    return
+                action, segment = self._finalizeQueue.popleft()
+            try:
+                action(segment)
+            except Exception as E:
+                logger.exception(E)
+                continue
+            if action == Segment.finalize:
+                with self._cond:
+                    self._completed.append(segment)
+                    self._completedBytes += segment.size
+                self._enforce_budget()
+
+    def _delete(self, segment: Segment):
+        for path in segment.paths():
+            if os.path.exists(path):
+                os.remove(path)
+        self.deletedSegments += 1
+        logger.info(f'deleted segment {segment.index} to stay within the disk budget')
+
+    def stats(self):
+        return {
+            'segments': self.nextIndex,
+            'deletedSegments': self.deletedSegments,
+            'pendingFinalize': len(self._finalizeQueue),
+            'currentBytes': self.segment.size if self.segment else 0,
+        }
+
+    def stop(self):
+        with self._cond:
+            if self.segment is not None:
+                self._finalizeQueue.append((Segment.finalize, self.segment))
+                self.segment = None
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -4,7 +4,7 @@ bytes 流序列化
 import enum
 import struct
 
-from .common import NSNumber
+from .common import NSNumber, numberStructs
 
 
 class DictConst(enum.IntEnum):
@@ -18,74 +18,154 @@ class DictConst(enum.IntEnum):
     NumberValueMagic = 0x6E6D6276
 
 
+lengthMagicStruct = struct.Struct('<II')
+boolValueStruct = struct.Struct('<II?')
+uint16Struct = struct.Struct('<H')
+# 序列化/解析时直接使用 int, 避免每个字段都做一次枚举成员查找
+_keyValuePairMagic, _stringKey, _intKey, _booleanValueMagic, _dictionaryMagic, _dataValueMagic, _stringValueMagic, \
+    _numberValueMagic = (int(DictConst.KeyValuePairMagic), int(DictConst.StringKey), int(DictConst.IntKey),
+                         int(DictConst.BooleanValueMagic), int(DictConst.DictionaryMagic),
+                         int(DictConst.DataValueMagic), int(DictConst.StringValueMagic),
+                         int(DictConst.NumberValueMagic))
+
+
 def write_length_magic(length, magic):
-    buf = b''
-    buf += struct.pack('<I', length)
-    buf += struct.pack('<I', magic)
-    return buf
+    return lengthMagicStruct.pack(length, magic)
+
+
+def string_size(value):
+    return len(value) if value.isascii() else len(value.encode('utf8'))
+
+
+def key_size(key):
+    return string_size(key) + 8
+
+
+def value_size(value):
+    """ 序列化后的字节数, 与 pack_value 写入的长度一致
+    不支持的类型抛出 TypeError, 不能只写 keyv 头而缺少 value
+    """
+    if isinstance(value, bool):
+        return 9
+    elif isinstance(value, NSNumber):
+        check_number(value)
+        return value.size() + 8
+    elif isinstance(value, str):
+        return string_size(value) + 8
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value) + 8
+    elif isinstance(value, dict):
+        return dict_size(value)
+    raise TypeError(f'cannot serialize {type(value)}')
+
+
+def check_number(value: NSNumber):
+    if value.typeSpecifier not in numberStructs:
+        raise TypeError(f'cannot serialize {type(value)} with typeSpecifier {value.typeSpecifier}')
+
+
+def dict_size(data):
+    size = 8
+    for key, value in data.items():
+        size += 16 + (len(key) if key.isascii() else len(key.encode('utf8'))) + value_size(value)
+    return size
+
+
+def pack_key(buf, offset, key):
+    """
+    :return: 写入后的偏移
+    """
+    keyBytes = key.encode('utf8')
+    end = offset + 8 + len(keyBytes)
+    lengthMagicStruct.pack_into(buf, offset, len(keyBytes) + 8, _stringKey)
+    buf[offset + 8:end] = keyBytes
+    return end
+
+
+def pack_value(buf, offset, value):
+    """
+    :return: 写入后的偏移
+    """
+    if isinstance(value, bool):
+        boolValueStruct.pack_into(buf, offset, 9, _booleanValueMagic, value)
+        return offset + 9
+    elif isinstance(value, NSNumber):
+        check_number(value)
+        size = value.size()
+        lengthMagicStruct.pack_into(buf, offset, size + 8, _numberValueMagic)
+        value.pack_into(buf, offset + 8)
+        return offset + 8 + size
+    elif isinstance(value, str):
+        valueBytes = value.encode('utf8')
+        end = offset + 8 + len(valueBytes)
+        lengthMagicStruct.pack_into(buf, offset, len(valueBytes) + 8, _stringValueMagic)
+        buf[offset + 8:end] = valueBytes
+        return end
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        end = offset + 8 + len(value)
+        lengthMagicStruct.pack_into(buf, offset, len(value) + 8, _dataValueMagic)
+        buf[offset + 8:end] = value
+        return end
+    elif isinstance(value, dict):
+        return pack_dict(buf, offset, value)
+    raise TypeError(f'cannot serialize {type(value)}')
+
+
+def pack_dict(buf, offset, data):
+    """ 将 data 写入 buf[offset:], buf 需要预留 dict_size(data) 字节
+    :return: 写入后的偏移
+    """
+    start = offset
+    offset += 8
+    # keyv 头和 strk key 直接在这里写, 省去每个字段一次函数调用
+    for key, value in data.items():
+        keyBytes = key.encode('utf8')
+        keyEnd = offset + 16 + len(keyBytes)
+        lengthMagicStruct.pack_into(buf, offset + 8, len(keyBytes) + 8, _stringKey)
+        buf[offset + 16:keyEnd] = keyBytes
+        end = pack_value(buf, keyEnd, value)
+        lengthMagicStruct.pack_into(buf, offset, end - offset, _keyValuePairMagic)
+        offset = end
+    lengthMagicStruct.pack_into(buf, start, offset - start, _dictionaryMagic)
+    return offset
 
 
 def serialize_key(key):
-    buf = b''
-    keyLength = len(key) + 8
-    buf += write_length_magic(keyLength, DictConst.StringKey)
-    buf += bytes(key, encoding='utf8')
-    return buf, keyLength
+    buf = bytearray(key_size(key))
+    pack_key(buf, 0, key)
+    return bytes(buf), len(buf)
 
 
 def serialize_value(Value):
-    buf = b''
-    if isinstance(Value, bool):
-        buf += write_length_magic(9, DictConst.BooleanValueMagic)
-        boolValue = 0
-        if Value:
-            boolValue = 1
-        buf += struct.pack('?', boolValue)
-        return buf, 9
-    elif isinstance(Value, NSNumber):
-        numberBytes = Value.to_bytes()
-        _length = len(numberBytes) + 8
-        buf += write_length_magic(_length, DictConst.NumberValueMagic)
-        buf += numberBytes
-        return buf, _length
-    elif isinstance(Value, str):
-        _length = len(Value) + 8
-        buf += write_length_magic(_length, DictConst.StringValueMagic)
-        buf += bytes(Value, encoding='utf8')
-        return buf, _length
-    elif isinstance(Value, (bytes, bytearray)):
-        _length = len(Value) + 8
-        buf += write_length_magic(_length, DictConst.DataValueMagic)
-        buf += bytes(Value)
-        return buf, _length
-    elif isinstance(Value, dict):
-        dictValue = SerializeStringKeyDict(Value).to_bytes()
-        buf += dictValue
-        return buf, len(buf)
+    buf = bytearray(value_size(Value))
+    pack_value(buf, 0, Value)
+    return bytes(buf), len(buf)
 
 
 class SerializeStringKeyDict:
+    """ 先计算总长度, 再一次性写入 bytearray
+    """
+
     def __init__(self, data):
-        self.buf = bytes()
         self.data = data
 
+    def size(self):
+        return dict_size(self.data)
+
+    def pack_into(self, buf, offset=0):
+        """
+        :return: 写入后的偏移
+        """
+        return pack_dict(buf, offset, self.data)
+
     def to_bytes(self):
-        index = 0
-        for key, value in self.data.items():
-            key_buf, keyLength = serialize_key(key)
-            value_buf, valueLength = serialize_value(value)
-            self.buf += write_length_magic(keyLength + valueLength + 8, DictConst.KeyValuePairMagic)
-            self.buf += key_buf
-            self.buf += value_buf
-            index += 8 + valueLength + keyLength
-        dictSizePlusHeaderAndLength = index + 4 + 4
-        buf = write_length_magic(dictSizePlusHeaderAndLength, DictConst.DictionaryMagic) + self.buf
-        return buf
+        buf = bytearray(self.size())
+        self.pack_into(buf)
+        return bytes(buf)
 
 
 def parse_length_magic(buf, exptectMagic):
-    _length = struct.unpack('<I', buf[:4])[0]
-    magic = struct.unpack('<I', buf[4:8])[0]
+    _length, magic = struct.unpack_from('<II', buf)
     if int(_length) > len(buf):
         raise Exception()
     if magic != exptectMagic:
@@ -93,90 +173,131 @@ def parse_length_magic(buf, exptectMagic):
     return int(_length), buf[8:]
 
 
-def parse_int_dict(buf):
-    key, remainingBytes = parse_int_key(buf)
-    value = parse_value(remainingBytes)
-    return {key: value}
-
-
-def parse_int_key(buf):
-    keyLength, _, = parse_length_magic(buf, DictConst.IntKey)
-    key = struct.unpack('<H', buf[8:10])[0]
-    return key, buf[keyLength:]
-
-
-def parse_key(buf):
-    keyLength, _ = parse_length_magic(buf, DictConst.StringKey)
-    key = buf[8:keyLength].decode()
-    return key, buf[keyLength:]
-
-
-def parse_dict(buf):
-    key, remainingBytes = parse_key(buf)
-    value = parse_value(remainingBytes)
-    return {key: value}
+def parse_string_value(buf, offset, end):
+    return bytes(buf[offset + 8:end]).decode()
+
+
+def parse_data_value(buf, offset, end):
+    # 字典中的数据会被长期持有(如 SPS/PPS)，这里拷贝出来，不再引用 USB 读取缓冲区
+    return bytes(buf[offset + 8:end])
+
+
+def parse_boolean_value(buf, offset, end):
+    return buf[offset + 8] == 1
+
+
+def parse_number_value(buf, offset, end):
+    return NSNumber.from_bytes(buf[offset + 8:end])
+
+
+# value magic -> parser(buf, offset, end), offset/end 为整个 value (含 length/magic) 的范围
+valueParsers = {
+    _stringValueMagic: parse_string_value,
+    _dataValueMagic: parse_data_value,
+    _booleanValueMagic: parse_boolean_value,
+    _numberValueMagic: parse_number_value,
+}
+
+
+def register_value_parser(magic, parser):
+    """ 注册其它类型的 value 解析, 如 CMFormatDescription 注册 fdsc
+    :param magic:
+    :param parser: parser(buf, offset, end)
+    """
+    valueParsers[int(magic)] = parser
+
+
+def get_value_parser(magic):
+    """ 未注册的 magic 先导入 CMFormatDescription (注册 fdsc) 再查找, 只使用 serialize 时也能解析 fdsc
+    """
+    parser = valueParsers.get(magic)
+    if parser is None:
+        from . import CMFormatDescription  # noqa: F401
+        parser = valueParsers.get(magic)
+        if parser is None:
+            raise Exception(f"unknown value magic {magic:x}")
+    return parser
+
+
+def decode_entries(buf, offset, end, result, keys=None):
+    """ 解析 [offset, end) 范围内连续的 keyv 到 result 中, 用显式栈处理嵌套的 dict, 不递归、不切片
+    key 按 strk/idxk 区分字符串或 int
+
+    :param keys: 只解析这些顶层 key, 其它 key 的 value 直接跳过
+    :return: result
+    """
+    unpack_from = lengthMagicStruct.unpack_from
+    stack = [(result, offset, end)]
+    while stack:
+        current, offset, end = stack[-1]
+        if offset >= end:
+            stack.pop()
+            continue
+        pairLength, magic = unpack_from(buf, offset)
+        if magic != _keyValuePairMagic or pairLength < 16 or offset + pairLength > end:
+            raise Exception(f"dict entry error at {offset}, magic {magic:x}")
+        stack[-1] = (current, offset + pairLength, end)
+
+        keyLength, keyMagic = unpack_from(buf, offset + 8)
+        if keyMagic == _stringKey:
+            key = bytes(buf[offset + 16:offset + 8 + keyLength]).decode()
+        elif keyMagic == _intKey:
+            key = uint16Struct.unpack_from(buf, offset + 16)[0]
+        else:
+            raise Exception(f"unknown key magic {keyMagic:x}")
+        if keys is not None and len(stack) == 1 and key not in keys:
+            continue
+
+        valueOffset = offset + 8 + keyLength
+        valueLength, valueMagic = unpack_from(buf, valueOffset)
+        if valueMagic == _dictionaryMagic:
+            child = current[key] = {}
+            stack.append((child, valueOffset + 8, valueOffset + valueLength))
+            continue
+        current[key] = get_value_parser(valueMagic)(buf, valueOffset, valueOffset + valueLength)
+    return result
+
+
+def decode_dict(buf, magic=DictConst.DictionaryMagic, keys=None):
+    """
+    :param buf: 以 length/magic 开头的字典
+    :param magic: 字典的 magic, 如 dict/extn/satt
+    :param keys: 只解析这些顶层 key
+    :return: dict
+    """
+    buf = memoryview(buf)
+    length, _ = parse_length_magic(buf, magic)
+    return decode_entries(buf, 8, length, {}, keys)
 
 
 def parse_key_value_dict(data):
+    """ 单个 keyv
+    """
+    data = memoryview(data)
     keyValuePairLength, _, = parse_length_magic(data, DictConst.KeyValuePairMagic)
-    keyValuePairData = data[8:keyValuePairLength]
-    return parse_dict(keyValuePairData)
+    return decode_entries(data, 0, keyValuePairLength, {})
 
 
 def parse_value(buf):
-    from ioscreen.coremedia.CMFormatDescription import DescriptorConst, FormatDescriptor
-
-    valueLength = struct.unpack('<I', buf[:4])[0]
-    magic = struct.unpack('<I', buf[4:8])[0]
-    if magic == DictConst.StringValueMagic:
-        return buf[8:valueLength].decode()
-    elif magic == DictConst.DataValueMagic:
-        return buf[8:valueLength]
-    elif magic == DictConst.BooleanValueMagic:
-        return buf[8] == 1
-    elif magic == DictConst.NumberValueMagic:
-        return NSNumber.from_bytes(buf[8:])
-    elif magic == DictConst.DictionaryMagic:
-        try:
-            _dict = new_string_dict_from_bytes(buf)
-        except Exception:
-            _dict = new_dictionary_from_bytes(buf, DictConst.DictionaryMagic)
-        return _dict
-    elif magic == DescriptorConst.FormatDescriptorMagic:
-        _dict = FormatDescriptor.from_bytes(buf)
-        return _dict
+    buf = memoryview(buf)
+    valueLength, magic = lengthMagicStruct.unpack_from(buf)
+    if magic == _dictionaryMagic:
+        return decode_dict(buf)
+    return get_value_parser(magic)(buf, 0, valueLength)
 
 
 def parse_header(buffer, packet_magic, message_magic):
-    magic = struct.unpack('<I', buffer[:4])[0]
+    magic, clockRef, messageType = struct.unpack_from('<IQI', buffer)
     if magic != packet_magic:
         return False
-    clockRef = struct.unpack('<Q', buffer[4:12])[0]
-    messageType = struct.unpack('<I', buffer[12:16])[0]
     if messageType != message_magic:
         return False
     return buffer[16:], clockRef
 
 
-def new_string_dict_from_bytes(buf):
-    _, remainingBytes, = parse_length_magic(buf, DictConst.DictionaryMagic)
-    _dict = {}
-    while 0 != len(remainingBytes):
-        keyValuePairLength, _, = parse_length_magic(remainingBytes, DictConst.KeyValuePairMagic)
-        keyValuePair = remainingBytes[8:keyValuePairLength]
-        parseDictEntry = parse_dict(keyValuePair)
-        remainingBytes = remainingBytes[keyValuePairLength:]
-        _dict.update(parseDictEntry)
-    return _dict
-
-
-def new_dictionary_from_bytes(buf, magic):
-    _, remainingBytes, = parse_length_magic(buf, magic)
-    _dict = {}
-    while 0 != len(remainingBytes):
-        keyValuePairLength, _, = parse_length_magic(remainingBytes, DictConst.KeyValuePairMagic)
-        keyValuePair = remainingBytes[8:keyValuePairLength]
-        intDictEntry = parse_int_dict(keyValuePair)
-        _dict.update(intDictEntry)
-        remainingBytes = remainingBytes[keyValuePairLength:]
-    return _dict
+def new_string_dict_from_bytes(buf, keys=None):
+    return decode_dict(buf, DictConst.DictionaryMagic, keys)
+
+
+def new_dictionary_from_bytes(buf, magic, keys=None):
+    return decode_dict(buf, magic, keys)
@@ -0,0 +1,81 @@
+"""
+NEED 流控: 设备每收到一个 NEED 才会发送下一帧 FEED
+"""
+import logging
+import threading
+from time import monotonic
+
+logger = logging.getLogger("ioscreen")
+
+
+class NeedFlowControl:
+    """ 按目标帧率和 consumer 积压发放 NEED
+    未设置 maxFps/maxBacklog 时收到 FEED 立即回复 NEED，否则由独立线程在满足条件后发送
+
+    :param send: 发送 NEED 的函数
+    :param maxFps: 帧率上限, 两个 NEED 之间至少间隔 1/maxFps 秒
+    :param maxBacklog: consumer 积压超过该值时暂停发放 NEED
+    :param backlog: 返回当前 consumer 积压数量的函数
+    """
+    backlogPollInterval = 0.005
+
+    def __init__(self, send, maxFps=None, maxBacklog=None, backlog=None):
+        self.send = send
+        self.minInterval = 1.0 / maxFps if maxFps else 0
+        self.maxBacklog = maxBacklog
+        self.backlog = backlog or (lambda: 0)
+        self.throttledCount = 0  # 被延迟发送的 NEED 个数
+        self._pending = False
+        self._lastSent = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        if self.minInterval or self.maxBacklog is not None:
+            self._thread = threading.Thread(target=self._loop, name='ioscreen-need', daemon=True)
+            self._thread.start()
+
+    def feed(self):
+        """ 收到一帧 FEED, 需要再发放一个 NEED
+        """
+        if self._thread is None:
+            self.send()
+            return
+        with self._cond:
+            self._pending = True
+            self._cond.notify_all()
+
+    def _blocked(self):
+        """
+        :return: 还需要等待的秒数, 0 表示可以发送
+        """
+        delay = self._lastSent + self.minInterval - monotonic()
+        if delay > 0:
+            return delay
+        if self.maxBacklog is not None and self.backlog() > self.maxBacklog:
+            return self.backlogPollInterval
+        return 0
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if self._closed:
+                    return
+                delay = self._blocked()
+                if delay:
+                    self.throttledCount += 1
+                while delay and not self._closed:
+                    self._cond.wait(delay)
+                    delay = self._blocked()
+                if self._closed:
+                    return
+                self._pending = False
+                self._lastSent = monotonic()
+            self.send()
+
+    def stop(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,198 @@
+"""
+sync/asyn 消息处理: 每种消息一个 handler, MessageProcessor 按 magic 查表分发
+"""
+import logging
+
+from .asyn import AyncConst, AsynCmSampleBufPacket, AsynSprpPacket, AsynTjmpPacket, AsynSratPacket, AsynTbasPacket, \
+    AsynRelsPacket, asyn_need_packet_bytes
+from .coremedia.CMclock import CMClock
+from .coremedia.CMSampleBuffer import parse_output_presentation_timestamp
+from .sync import SyncConst, SyncOGPacket, SyncCwpaPacket, clock_ref_reply, SyncCvrpPacket, SyncClockPacket, \
+    SyncTimePacket, SyncAfmtPacket, SyncSkewPacket, SyncStopPacket
+from .transfer import WritePriority
+
+logger = logging.getLogger("ioscreen")
+
+
+class PacketHandler:
+    """ 处理一种消息
+    handle(processor, buffer) 在 USB 读取线程中调用, buffer 为不含长度前缀的 memoryview
+    """
+    packetClass = None
+
+    def handle(self, processor, buffer):
+        raise NotImplementedError
+
+
+class DebugLogHandler(PacketHandler):
+    """ 只用于调试输出的消息, 没有开启 DEBUG 日志时不解析 """
+
+    def __init__(self, packetClass):
+        self.packetClass = packetClass
+
+    def handle(self, processor, buffer):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(self.packetClass.from_bytes(buffer))
+
+
+# ------------------- sync ——————————————————————
+
+class OgHandler(PacketHandler):
+    packetClass = SyncOGPacket
+
+    def handle(self, processor, buffer):
+        ogPacket = SyncOGPacket.from_bytes(buffer)
+        logger.debug(ogPacket)
+        processor.usbWrite(ogPacket.to_bytes())
+
+
+class CwpaHandler(PacketHandler):
+    packetClass = SyncCwpaPacket
+
+    def handle(self, processor, buffer):
+        cwpaPacket = SyncCwpaPacket.from_bytes(buffer)
+        logger.debug(cwpaPacket)
+        clockRef = cwpaPacket.DeviceClockRef + 1000
+        processor.localAudioClock = CMClock.new(clockRef)
+        processor.deviceAudioClockRef = cwpaPacket.DeviceClockRef
+        if processor.mediaMode.video:
+            logger.debug("Sending ASYN HPD1")
+            processor.usbWrite(processor.hpd1Packet)
+
+        logger.debug("Send CWPA-RPLY {correlation:%x, clockRef:%x}", cwpaPacket.CorrelationID, clockRef)
+        processor.usbWrite(clock_ref_reply(clockRef, cwpaPacket.CorrelationID))
+        if processor.mediaMode.video:
+            logger.debug("Sending ASYN HPD1")
+            processor.usbWrite(processor.hpd1Packet)
+        if processor.mediaMode.audio:
+            logger.debug("Sending ASYN HPA1")
+            processor.usbWrite(processor.hpa1Template.render(clockRef=cwpaPacket.DeviceClockRef))
+
+
+class CvrpHandler(PacketHandler):
+    packetClass = SyncCvrpPacket
+
+    def handle(self, processor, buffer):
+        cvrpPacket = SyncCvrpPacket.from_bytes(buffer)
+        logger.debug(cvrpPacket)
+        processor.needClockRef = cvrpPacket.DeviceClockRef
+        processor.needMessage = asyn_need_packet_bytes(cvrpPacket.DeviceClockRef)
+        logger.debug(f"Sending needMessage")
+        processor.usbWrite(processor.needMessage)
+        clockRef2 = cvrpPacket.DeviceClockRef + 0x1000AF
+        processor.usbWrite(clock_ref_reply(clockRef2, cvrpPacket.CorrelationID))
+
+
+class ClockHandler(PacketHandler):
+    packetClass = SyncClockPacket
+
+    def handle(self, processor, buffer):
+        clockPacket = SyncClockPacket.from_bytes(buffer)
+        logger.debug(clockPacket)
+        clockRef = clockPacket.ClockRef + 0x10000
+        processor.clock = CMClock.new(clockRef)  # 本地时钟用来同步时间差
+        processor.usbWrite(clock_ref_reply(clockRef, clockPacket.CorrelationID), WritePriority.Urgent)
+
+
+class TimeHandler(PacketHandler):
+    packetClass = SyncTimePacket
+
+    def handle(self, processor, buffer):
+        timePacket = SyncTimePacket.from_bytes(buffer)
+        logger.debug(timePacket)
+        processor.usbWrite(timePacket.to_bytes(processor.clock.getTime()), WritePriority.Urgent)
+
+
+class AfmtHandler(PacketHandler):
+    packetClass = SyncAfmtPacket
+
+    def handle(self, processor, buffer):
+        afmtPacket = SyncAfmtPacket.from_bytes(buffer)
+        logger.debug(afmtPacket)
+        processor.usbWrite(afmtPacket.to_bytes())
+
+
+class SkewHandler(PacketHandler):
+    packetClass = SyncSkewPacket
+
+    def handle(self, processor, buffer):
+        skewPacket = SyncSkewPacket.from_bytes(buffer)
+        logger.debug(skewPacket)
+        processor.usbWrite(skewPacket.to_bytes(processor.audioSkew()), WritePriority.Urgent)
+
+
+class StopHandler(PacketHandler):
+    packetClass = SyncStopPacket
+
+    def handle(self, processor, buffer):
+        stopPacket = SyncStopPacket.from_bytes(buffer)
+        logger.debug(stopPacket)
+        processor.usbWrite(stopPacket.to_bytes())
+
+
+# ------------------- asyn ——————————————————————
+
+class EatHandler(PacketHandler):
+    """ 音频帧, 同时记录设备音频时钟用于计算 SKEW
+    consumer 不需要音频时只读取时间戳
+    """
+    packetClass = AsynCmSampleBufPacket
+
+    def handle(self, processor, buffer):
+        if not processor.wantAudio:
+            deviceTime = parse_output_presentation_timestamp(buffer, 16)
+            if deviceTime is not None:
+                processor.recordAudioTime(deviceTime)
+            return
+        eatPacket = AsynCmSampleBufPacket.from_bytes(buffer, processor.formatCache, processor.sampleFields)
+        processor.recordAudioTime(eatPacket.CMSampleBuf.OutputPresentationTimestamp)
+        processor.cmSampleBufConsumer.consume(eatPacket.CMSampleBuf)
+
+
+class FeedHandler(PacketHandler):
+    """ 视频帧, 处理完后发放下一个 NEED
+    consumer 不需要视频时不解析, 但仍然回复 NEED
+    """
+    packetClass = AsynCmSampleBufPacket
+
+    def handle(self, processor, buffer):
+        if processor.wantVideo:
+            feedPacket = AsynCmSampleBufPacket.from_bytes(buffer, processor.formatCache, processor.sampleFields)
+            processor.cmSampleBufConsumer.consume(feedPacket.CMSampleBuf)
+        processor.needFlow.feed()
+
+
+class RelsHandler(PacketHandler):
+    packetClass = AsynRelsPacket
+
+    def handle(self, processor, buffer):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(AsynRelsPacket.from_bytes(buffer))
+        processor.releaseWaiter.set()
+
+
+def default_handlers():
+    """
+    :return: {包类型 magic: {消息类型 magic: handler}}
+    """
+    return {
+        SyncConst.SyncPacketMagic: {
+            SyncConst.OG: OgHandler(),
+            SyncConst.CWPA: CwpaHandler(),
+            SyncConst.CVRP: CvrpHandler(),
+            SyncConst.CLOK: ClockHandler(),
+            SyncConst.TIME: TimeHandler(),
+            SyncConst.AFMT: AfmtHandler(),
+            SyncConst.SKEW: SkewHandler(),
+            SyncConst.STOP: StopHandler(),
+        },
+        AyncConst.AsyncPacketMagic: {
+            AyncConst.EAT: EatHandler(),
+            AyncConst.FEED: FeedHandler(),
+            AyncConst.SPRP: DebugLogHandler(AsynSprpPacket),
+            AyncConst.TJMP: DebugLogHandler(AsynTjmpPacket),
+            AyncConst.SRAT: DebugLogHandler(AsynSratPacket),
+            AyncConst.TBAS: DebugLogHandler(AsynTbasPacket),
+            AyncConst.RELS: RelsHandler(),
+        },
+    }
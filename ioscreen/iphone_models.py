@@ -1,77 +1,87 @@
 # Source: https://raw.githubusercontent.com/blacktop/ipsw/master/pkg/info/data/ipsw_db.json
 class iPhoneModels:
     MODELS = {
-        'iPhone1,1': {'model': 'iPhone', 'width': 547},
-        'iPhone1,2': {'model': 'iPhone 3G', 'width': 547},
-        'iPhone10,1': {'model': 'iPhone 8 (CDMA)', 'width': 529},                       # 4,7"
-        'iPhone10,2': {'model': 'iPhone 8 Plus (CDMA)', 'width': 529},                  # 5,5"
-        'iPhone10,3': {'model': 'iPhone X (CDMA)', 'width': 435},                       # 5,8"
-        'iPhone10,4': {'model': 'iPhone 8 (GSM)', 'width': 529},                        # 4,7"
-        'iPhone10,5': {'model': 'iPhone 8 Plus (GSM)', 'width': 529},                   # 5,5"
-        'iPhone10,6': {'model': 'iPhone X (GSM)', 'width': 435},                        # 5,8"
-        'iPhone11,2': {'model': 'iPhone XS', 'width': 435},                             # 5,8"
-        'iPhone11,4': {'model': 'iPhone XS Max (China mainland)', 'width': 452},        # 6,5"
-        'iPhone11,6': {'model': 'iPhone XS Max', 'width': 452},                         # 6,5"
-        'iPhone11,8': {'model': 'iPhone XR', 'width': 435},                             # 6,1"
-        'iPhone12,1': {'model': 'iPhone 11', 'width': 435},                             # 6,1"
-        'iPhone12,3': {'model': 'iPhone 11 Pro', 'width': 435},                         # 5,8"
-        'iPhone12,5': {'model': 'iPhone 11 Pro Max', 'width': 452},                     # 6,5"
+        'iPhone1,1': {'model': 'iPhone', 'width': 547, 'screen': (320, 480)},
+        'iPhone1,2': {'model': 'iPhone 3G', 'width': 547, 'screen': (320, 480)},
+        'iPhone10,1': {'model': 'iPhone 8 (CDMA)', 'width': 529, 'screen': (750, 1334)},                       # 4,7"
+        'iPhone10,2': {'model': 'iPhone 8 Plus (CDMA)', 'width': 529, 'screen': (1080, 1920)},                  # 5,5"
+        'iPhone10,3': {'model': 'iPhone X (CDMA)', 'width': 435, 'screen': (1125, 2436)},                       # 5,8"
+        'iPhone10,4': {'model': 'iPhone 8 (GSM)', 'width': 529, 'screen': (750, 1334)},                        # 4,7"
+        'iPhone10,5': {'model': 'iPhone 8 Plus (GSM)', 'width': 529, 'screen': (1080, 1920)},                   # 5,5"
+        'iPhone10,6': {'model': 'iPhone X (GSM)', 'width': 435, 'screen': (1125, 2436)},                        # 5,8"
+        'iPhone11,2': {'model': 'iPhone XS', 'width': 435, 'screen': (1125, 2436)},                             # 5,8"
+        'iPhone11,4': {'model': 'iPhone XS Max (China mainland)', 'width': 452, 'screen': (1242, 2688)},        # 6,5"
+        'iPhone11,6': {'model': 'iPhone XS Max', 'width': 452, 'screen': (1242, 2688)},                         # 6,5"
+        'iPhone11,8': {'model': 'iPhone XR', 'width': 435, 'screen': (828, 1792)},                             # 6,1"
+        'iPhone12,1': {'model': 'iPhone 11', 'width': 435, 'screen': (828, 1792)},                             # 6,1"
+        'iPhone12,3': {'model': 'iPhone 11 Pro', 'width': 435, 'screen': (1125, 2436)},                         # 5,8"
+        'iPhone12,5': {'model': 'iPhone 11 Pro Max', 'width': 452, 'screen': (1242, 2688)},                     # 6,5"
         'iPhone12,6': {'model': 'Unnamed iPhone with A13 Bionic', 'width': 452},
         'iPhone12,7': {'model': 'Unnamed iPhone with A13 Bionic', 'width': 452},
-        'iPhone12,8': {'model': 'iPhone SE (2nd generation)', 'width': 529},            # 4,7"
-        'iPhone13,1': {'model': 'iPhone 12 mini', 'width': 547},
-        'iPhone13,2': {'model': 'iPhone 12', 'width': 435},                             # 6,1"
-        'iPhone13,3': {'model': 'iPhone 12 Pro', 'width': 435},                         # 6,1"
-        'iPhone13,4': {'model': 'iPhone 12 Pro Max', 'width': 547},
+        'iPhone12,8': {'model': 'iPhone SE (2nd generation)', 'width': 529, 'screen': (750, 1334)},            # 4,7"
+        'iPhone13,1': {'model': 'iPhone 12 mini', 'width': 547, 'screen': (1080, 2340)},
+        'iPhone13,2': {'model': 'iPhone 12', 'width': 435, 'screen': (1170, 2532)},                             # 6,1"
+        'iPhone13,3': {'model': 'iPhone 12 Pro', 'width': 435, 'screen': (1170, 2532)},                         # 6,1"
+        'iPhone13,4': {'model': 'iPhone 12 Pro Max', 'width': 547, 'screen': (1284, 2778)},
         'iPhone13,5': {'model': 'Unnamed iPhone with A14 Bionic', 'width': 547},
         'iPhone14,1': {'model': 'Unnamed iPhone with A15 Bionic', 'width': 435},
-        'iPhone14,2': {'model': 'iPhone 13 Pro', 'width': 435},                         # 6,1"
-        'iPhone14,3': {'model': 'iPhone 13 Pro Max', 'width': 547},
-        'iPhone14,4': {'model': 'iPhone 13 mini', 'width': 547},
-        'iPhone14,5': {'model': 'iPhone 13', 'width': 435},                             # 6,1"
-        'iPhone14,6': {'model': 'iPhone SE (3rd generation)', 'width': 529},            # 4,7"
-        'iPhone14,7': {'model': 'iPhone 14', 'width': 435},                             # 6,1"
-        'iPhone14,8': {'model': 'iPhone 14 Plus', 'width': 547},
+        'iPhone14,2': {'model': 'iPhone 13 Pro', 'width': 435, 'screen': (1170, 2532)},                         # 6,1"
+        'iPhone14,3': {'model': 'iPhone 13 Pro Max', 'width': 547, 'screen': (1284, 2778)},
+        'iPhone14,4': {'model': 'iPhone 13 mini', 'width': 547, 'screen': (1080, 2340)},
+        'iPhone14,5': {'model': 'iPhone 13', 'width': 435, 'screen': (1170, 2532)},                             # 6,1"
+        'iPhone14,6': {'model': 'iPhone SE (3rd generation)', 'width': 529, 'screen': (750, 1334)},            # 4,7"
+        'iPhone14,7': {'model': 'iPhone 14', 'width': 435, 'screen': (1170, 2532)},                             # 6,1"
+        'iPhone14,8': {'model': 'iPhone 14 Plus', 'width': 547, 'screen': (1284, 2778)},
         'iPhone14,9': {'model': 'Unnamed iPhone with A?', 'width': 547},
         'iPhone15,1': {'model': 'Unnamed iPhone with A16 Bionic', 'width': 547},
-        'iPhone15,2': {'model': 'iPhone 14 Pro', 'width': 435},                         # 6,1"
-        'iPhone15,3': {'model': 'iPhone 14 Pro Max', 'width': 547},
-        'iPhone15,4': {'model': 'iPhone 15', 'width': 435},                             # 6,1"
-        'iPhone15,5': {'model': 'iPhone 15 Plus', 'width': 547},
-        'iPhone16,1': {'model': 'iPhone 15 Pro', 'width': 435},                         # 6,1"
-        'iPhone16,2': {'model': 'iPhone 15 Pro Max', 'width': 547},
-        'iPhone17,1': {'model': 'iPhone 16 Pro', 'width': 435},
-        'iPhone17,2': {'model': 'iPhone 16 Pro Max', 'width': 435},
-        'iPhone17,3': {'model': 'iPhone 16', 'width': 435},                             # 6,1"
-        'iPhone17,4': {'model': 'iPhone 16 Plus', 'width': 435},
-        'iPhone17,5': {'model': 'iPhone 16e', 'width': 435},                            # 6,1"
-        'iPhone18,1': {'model': 'iPhone 17 Pro', 'width': 435},
-        'iPhone18,2': {'model': 'iPhone 17 Pro Max', 'width': 435},
-        'iPhone18,3': {'model': 'iPhone 17', 'width': 435},
-        'iPhone18,4': {'model': 'iPhone Air', 'width': 452},                            # 6,5"
-        'iPhone18,5': {'model': 'iPhone 17e', 'width': 435},                            # 6,1"
-        'iPhone2,1': {'model': 'iPhone 3GS', 'width': 547},
-        'iPhone3,1': {'model': 'iPhone 4 (GSM)', 'width': 547},
-        'iPhone3,2': {'model': 'iPhone 4 (GSM, 2012)', 'width': 547},
-        'iPhone3,3': {'model': 'iPhone 4 (CDMA)', 'width': 547},
-        'iPhone4,1': {'model': 'iPhone 4S', 'width': 547},
-        'iPhone5,1': {'model': 'iPhone 5 (GSM)', 'width': 525},                         # 4″
-        'iPhone5,2': {'model': 'iPhone 5 (CDMA)', 'width': 525},                        # 4″
-        'iPhone5,3': {'model': 'iPhone 5c (GSM)', 'width': 525},                        # 4″
-        'iPhone5,4': {'model': 'iPhone 5c (CDMA)', 'width': 525},                       # 4″
-        'iPhone6,1': {'model': 'iPhone 5s (GSM)', 'width': 525},                        # 4″
-        'iPhone6,2': {'model': 'iPhone 5s (CDMA)', 'width': 525},                       # 4″
-        'iPhone7,1': {'model': 'iPhone 6 Plus', 'width': 529},                          # 5,5"
-        'iPhone7,2': {'model': 'iPhone 6', 'width': 529},                               # 4,7"
-        'iPhone8,1': {'model': 'iPhone 6s', 'width': 529},                              # 4,7"
-        'iPhone8,2': {'model': 'iPhone 6s Plus', 'width': 529},                         # 5,5"
-        'iPhone8,4': {'model': 'iPhone SE (1st generation)', 'width': 525},             # 4″
-        'iPhone9,1': {'model': 'iPhone 7 (CDMA)', 'width': 529},                        # 4,7"
-        'iPhone9,2': {'model': 'iPhone 7 Plus (CDMA)', 'width': 529},                   # 5,5"
-        'iPhone9,3': {'model': 'iPhone 7 (GSM)', 'width': 529},                         # 4,7"
-        'iPhone9,4': {'model': 'iPhone 7 Plus (GSM)', 'width': 529},                    # 5,5"
+        'iPhone15,2': {'model': 'iPhone 14 Pro', 'width': 435, 'screen': (1179, 2556)},                         # 6,1"
+        'iPhone15,3': {'model': 'iPhone 14 Pro Max', 'width': 547, 'screen': (1290, 2796)},
+        'iPhone15,4': {'model': 'iPhone 15', 'width': 435, 'screen': (1179, 2556)},                             # 6,1"
+        'iPhone15,5': {'model': 'iPhone 15 Plus', 'width': 547, 'screen': (1290, 2796)},
+        'iPhone16,1': {'model': 'iPhone 15 Pro', 'width': 435, 'screen': (1179, 2556)},                         # 6,1"
+        'iPhone16,2': {'model': 'iPhone 15 Pro Max', 'width': 547, 'screen': (1290, 2796)},
+        'iPhone17,1': {'model': 'iPhone 16 Pro', 'width': 435, 'screen': (1206, 2622)},
+        'iPhone17,2': {'model': 'iPhone 16 Pro Max', 'width': 435, 'screen': (1320, 2868)},
+        'iPhone17,3': {'model': 'iPhone 16', 'width': 435, 'screen': (1179, 2556)},                             # 6,1"
+        'iPhone17,4': {'model': 'iPhone 16 Plus', 'width': 435, 'screen': (1290, 2796)},
+        'iPhone17,5': {'model': 'iPhone 16e', 'width': 435, 'screen': (1170, 2532)},                            # 6,1"
+        'iPhone18,1': {'model': 'iPhone 17 Pro', 'width': 435, 'screen': (1206, 2622)},
+        'iPhone18,2': {'model': 'iPhone 17 Pro Max', 'width': 435, 'screen': (1320, 2868)},
+        'iPhone18,3': {'model': 'iPhone 17', 'width': 435, 'screen': (1206, 2622)},
+        'iPhone18,4': {'model': 'iPhone Air', 'width': 452, 'screen': (1260, 2736)},                            # 6,5"
+        'iPhone18,5': {'model': 'iPhone 17e', 'width': 435, 'screen': (1170, 2532)},                            # 6,1"
+        'iPhone2,1': {'model': 'iPhone 3GS', 'width': 547, 'screen': (320, 480)},
+        'iPhone3,1': {'model': 'iPhone 4 (GSM)', 'width': 547, 'screen': (640, 960)},
+        'iPhone3,2': {'model': 'iPhone 4 (GSM, 2012)', 'width': 547, 'screen': (640, 960)},
+        'iPhone3,3': {'model': 'iPhone 4 (CDMA)', 'width': 547, 'screen': (640, 960)},
+        'iPhone4,1': {'model': 'iPhone 4S', 'width': 547, 'screen': (640, 960)},
+        'iPhone5,1': {'model': 'iPhone 5 (GSM)', 'width': 525, 'screen': (640, 1136)},                         # 4″
+        'iPhone5,2': {'model': 'iPhone 5 (CDMA)', 'width': 525, 'screen': (640, 1136)},                        # 4″
+        'iPhone5,3': {'model': 'iPhone 5c (GSM)', 'width': 525, 'screen': (640, 1136)},                        # 4″
+        'iPhone5,4': {'model': 'iPhone 5c (CDMA)', 'width': 525, 'screen': (640, 1136)},                       # 4″
+        'iPhone6,1': {'model': 'iPhone 5s (GSM)', 'width': 525, 'screen': (640, 1136)},                        # 4″
+        'iPhone6,2': {'model': 'iPhone 5s (CDMA)', 'width': 525, 'screen': (640, 1136)},                       # 4″
+        'iPhone7,1': {'model': 'iPhone 6 Plus', 'width': 529, 'screen': (1080, 1920)},                          # 5,5"
+        'iPhone7,2': {'model': 'iPhone 6', 'width': 529, 'screen': (750, 1334)},                               # 4,7"
+        'iPhone8,1': {'model': 'iPhone 6s', 'width': 529, 'screen': (750, 1334)},                              # 4,7"
+        'iPhone8,2': {'model': 'iPhone 6s Plus', 'width': 529, 'screen': (1080, 1920)},                         # 5,5"
+        'iPhone8,4': {'model': 'iPhone SE (1st generation)', 'width': 525, 'screen': (640, 1136)},             # 4″
+        'iPhone9,1': {'model': 'iPhone 7 (CDMA)', 'width': 529, 'screen': (750, 1334)},                        # 4,7"
+        'iPhone9,2': {'model': 'iPhone 7 Plus (CDMA)', 'width': 529, 'screen': (1080, 1920)},                   # 5,5"
+        'iPhone9,3': {'model': 'iPhone 7 (GSM)', 'width': 529, 'screen': (750, 1334)},                         # 4,7"
+        'iPhone9,4': {'model': 'iPhone 7 Plus (GSM)', 'width': 529, 'screen': (1080, 1920)},                    # 5,5"
     }
 
+    # 请求的 DisplaySize 长边像素, native 表示设备原始分辨率
+    DISPLAY_PRESETS = {
+        '1080p': 1920,
+        '720p': 1280,
+        '540p': 960,
+        '480p': 854,
+        '360p': 640,
+    }
+    DEFAULT_DISPLAY_SIZE = (1920, 1200)
+
     @staticmethod
     def get_model(key):
         return iPhoneModels.MODELS.get(key, "Unknown model")['model']
@@ -79,3 +89,31 @@ class iPhoneModels:
     @staticmethod
     def get_width(key):
         return iPhoneModels.MODELS.get(key, "Unknown model")['width']
+
+    @staticmethod
+    def get_screen(key):
+        """ 设备原始分辨率 (宽, 高)，未命名的机型 (Unnamed iPhone ...) 和未知设备没有 screen，返回 None
+        """
+        return iPhoneModels.MODELS.get(key, {}).get('screen')
+
+    @staticmethod
+    def get_display_size(key, preset='native'):
+        """ HPD1 中请求的 DisplaySize (Width, Height)，Width 为长边，保持设备屏幕比例
+        没有 screen 的设备 (见 get_screen) 按默认的 1920x1200 比例缩放
+        :param key: 设备标识，如 iPhone14,5
+        :param preset: DISPLAY_PRESETS 中的名称或 native
+        :return:
+        """
+        screen = iPhoneModels.get_screen(key)
+        if screen:
+            longEdge, shortEdge = max(screen), min(screen)
+        else:
+            longEdge, shortEdge = iPhoneModels.DEFAULT_DISPLAY_SIZE
+        if preset == 'native':
+            return longEdge, shortEdge
+        if preset not in iPhoneModels.DISPLAY_PRESETS:
+            raise Exception(f'unknown display preset {preset}')
+        width = iPhoneModels.DISPLAY_PRESETS[preset]
+        if width >= longEdge:
+            return longEdge, shortEdge
+        return width, 2 * round(shortEdge * width / longEdge / 2)  # H.264 编码要求偶数尺寸
@@ -1,23 +1,92 @@
 import _thread
 import argparse
+import os
 
 from ioscreen.util import *
 
 
+def display_size(value: str):
+    """ WxH 或 iPhoneModels.DISPLAY_PRESETS 中的名称/native
+    """
+    if value == 'native' or value in iPhoneModels.DISPLAY_PRESETS:
+        return value
+    try:
+        width, height = value.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid display size {value}')
+
+
+def reading_options(args: argparse.Namespace):
+    return {
+        'queueDepth': args.queueDepth,
+        'transferSize': args.transferSize,
+        'bufferSize': args.bufferSize,
+        'dropPolicy': DropPolicy(args.dropPolicy),
+        'maxFps': args.maxFps,
+        'maxBacklog': args.maxBacklog,
+        'displaySize': args.displaySize,
+    }
+
+
 def cmd_record_wav(args: argparse.Namespace):
     device = find_ios_device(args.udid)
-    consumer = AVFileWriter(h264FilePath=args.h264File, wavFilePath=args.wavFile)
+    mediaMode = MediaMode(args.media or MediaMode.AudioVideo.value)
+    consumer = AVFileWriter(h264FilePath=args.h264File, wavFilePath=args.wavFile,
+                            audioOnly=mediaMode == MediaMode.AudioOnly, asyncWrite=args.asyncWrite,
+                            writeBufferSize=args.writeBufferSize, fsync=FsyncPolicy(args.fsync),
+                            fsyncInterval=args.fsyncInterval)
+    stopSignal = threading.Event()
+    register_signal(stopSignal)
+    start_reading(consumer, device, stopSignal, mediaMode=mediaMode, **reading_options(args))
+
+
+def cmd_record_mp4(args: argparse.Namespace):
+    from ioscreen.coremedia.mp4 import Mp4Writer
+    device = find_ios_device(args.udid)
+    mediaMode = MediaMode(args.media or MediaMode.AudioVideo.value)
+    consumer = Mp4Writer(args.mp4File, video=mediaMode.video, audio=mediaMode.audio,
+                         fragmentDuration=args.fragmentDuration, asyncWrite=args.asyncWrite,
+                         writeBufferSize=args.writeBufferSize, fsync=FsyncPolicy(args.fsync),
+                         fsyncInterval=args.fsyncInterval)
+    stopSignal = threading.Event()
+    register_signal(stopSignal)
+    start_reading(consumer, device, stopSignal, mediaMode=mediaMode, **reading_options(args))
+
+
+def cmd_record_segments(args: argparse.Namespace):
+    from ioscreen.coremedia.segment import SegmentedWriter
+    device = find_ios_device(args.udid)
+    mediaMode = MediaMode(args.media or MediaMode.AudioVideo.value)
+    consumer = SegmentedWriter(args.directory, prefix=args.prefix, maxDuration=args.segmentDuration,
+                               maxBytes=args.segmentSize, diskBudget=args.diskBudget, video=mediaMode.video,
+                               audio=mediaMode.audio, writeBufferSize=args.writeBufferSize,
+                               fsync=FsyncPolicy(args.fsync), fsyncInterval=args.fsyncInterval)
+    stopSignal = threading.Event()
+    register_signal(stopSignal)
+    start_reading(consumer, device, stopSignal, mediaMode=mediaMode, **reading_options(args))
+
+
+def cmd_replay(args: argparse.Namespace):
+    from ioscreen.coremedia.replay import ReplayBuffer, register_dump_signal
+    device = find_ios_device(args.udid)
+    mediaMode = MediaMode(args.media or MediaMode.AudioVideo.value)
+    consumer = ReplayBuffer(maxSeconds=args.replaySeconds, maxBytes=args.replayBytes)
+    register_dump_signal(consumer, args.directory)
     stopSignal = threading.Event()
     register_signal(stopSignal)
-    start_reading(consumer, device, stopSignal)
+    logger.info(f'keeping the last {args.replaySeconds}s in memory, send SIGUSR1 to pid {os.getpid()} to save it')
+    start_reading(consumer, device, stopSignal, mediaMode=mediaMode, **reading_options(args))
 
 
 def cmd_record_udp(args: argparse.Namespace):
     device = find_ios_device(args.udid)
-    consumer = SocketUDP()
+    consumer = SocketUDP(rtp=args.rtp, mtu=args.mtu, sdpPath=args.sdp)
     stopSignal = threading.Event()
     register_signal(stopSignal)
-    start_reading(consumer, device, stopSignal)
+    # SocketUDP 只转发视频
+    mediaMode = MediaMode(args.media or MediaMode.VideoOnly.value)
+    start_reading(consumer, device, stopSignal, mediaMode=mediaMode, **reading_options(args))
 
 
 def cmd_record_gstreamer(args: argparse.Namespace):
@@ -28,21 +97,58 @@ def cmd_record_gstreamer(args: argparse.Namespace):
     register_signal(stopSignal)
     model, width = get_device_info(device)
     consumer = GstAdapter.new(stopSignal, model, width)
-    _thread.start_new_thread(start_reading, (consumer, device, stopSignal,))
+    options = reading_options(args)
+    options['mediaMode'] = MediaMode(args.media or MediaMode.AudioVideo.value)
+    _thread.start_new_thread(start_reading, (consumer, device, stopSignal,), options)
     consumer.loop.run()
 
 
+def add_file_writer_arguments(parser: argparse.ArgumentParser, asyncOption=True):
+    if asyncOption:
+        parser.add_argument('--asyncWrite', action='store_true', default=False,
+                            help='write files on a separate thread with batched writev calls')
+    parser.add_argument('--writeBufferSize', type=int, default=8 * 1024 * 1024,
+                        help='bytes queued per file before recording blocks')
+    parser.add_argument('--fsync', choices=[policy.value for policy in FsyncPolicy],
+                        default=FsyncPolicy.Never.value, help='when to fsync the files written on the writer thread')
+    parser.add_argument('--fsyncInterval', type=float, default=5.0,
+                        help='seconds between fsync calls with --fsync interval')
+
+
 def main():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest='subparser')
     parser.add_argument("-u", "--udid", help="specify unique device identifier")
     parser.add_argument('-v', '--verbose', action='store_true', default=False)
+    parser.add_argument('--queueDepth', type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help='number of USB bulk IN transfers kept in flight')
+    parser.add_argument('--transferSize', type=int, default=DEFAULT_TRANSFER_SIZE,
+                        help='buffer size in bytes of each USB bulk IN transfer')
+    parser.add_argument('--bufferSize', type=int, default=0,
+                        help='run the output on its own thread behind a queue of this many samples (0: disabled)')
+    parser.add_argument('--dropPolicy', choices=[policy.value for policy in DropPolicy], default=DropPolicy.Block.value,
+                        help='what to do when the output queue is full')
+    parser.add_argument('--maxFps', type=float, default=None,
+                        help='limit the video frame rate requested from the device')
+    parser.add_argument('--maxBacklog', type=int, default=None,
+                        help='stop requesting video frames while more than this many samples are queued')
+    parser.add_argument('--displaySize', type=display_size, default=None,
+                        help='display size requested from the device, WxH or one of native, '
+                             + ', '.join(iPhoneModels.DISPLAY_PRESETS))
+    parser.add_argument('--media', choices=[mode.value for mode in MediaMode], default=None,
+                        help='streams negotiated with the device: av, video or audio '
+                             '(default: av, udp defaults to video)')
     gstreamer_parser = subparsers.add_parser("gstreamer",
                                              help="record will open a new window and push AV data to gstreamer.")
     gstreamer_parser.set_defaults(func=cmd_record_gstreamer)
 
     udp_parser = subparsers.add_parser("udp",
                                        help="forward H264 data to UDP broadcast. You can use VLC to play the URL")
+    udp_parser.add_argument('--rtp', action='store_true', default=False,
+                            help='send RTP/H.264 (RFC 6184) instead of raw UDP chunks')
+    udp_parser.add_argument('--mtu', type=int, default=1400, help='maximum RTP packet size in bytes (with --rtp)')
+    udp_parser.add_argument('--sdp', type=str, default=None,
+                            help='write an SDP file for VLC/ffplay to this path (with --rtp)')
     udp_parser.set_defaults(func=cmd_record_udp)
 
     parser_foo = subparsers.add_parser('record', help="will start video&audio recording. Video will be saved in a raw "
@@ -51,7 +157,37 @@ def main():
                             help='lease specify a valid path like /home/test/out.h264')
     parser_foo.add_argument('-wavFile', type=str, required=True,
                             help='lease specify a valid path like /home/test/out.wav')
+    add_file_writer_arguments(parser_foo)
     parser_foo.set_defaults(func=cmd_record_wav)
+
+    mp4_parser = subparsers.add_parser('mp4', help="record video&audio into a fragmented MP4 file, playable while "
+                                                   "recording and readable up to the last fragment after a crash")
+    mp4_parser.add_argument('-mp4File', type=str, required=True,
+                            help='lease specify a valid path like /home/test/out.mp4')
+    mp4_parser.add_argument('--fragmentDuration', type=float, default=1.0,
+                            help='seconds per fragment, cut at the next keyframe')
+    add_file_writer_arguments(mp4_parser)
+    mp4_parser.set_defaults(func=cmd_record_mp4)
+
+    segment_parser = subparsers.add_parser('segment', help="record h264/wav files split at keyframes by duration "
+                                                           "or size")
+    segment_parser.add_argument('-directory', type=str, required=True, help='directory for the segment files')
+    segment_parser.add_argument('--prefix', type=str, default='ioscreen', help='segment file name prefix')
+    segment_parser.add_argument('--segmentDuration', type=float, default=600.0,
+                                help='start a new segment at the next keyframe after this many seconds')
+    segment_parser.add_argument('--segmentSize', type=int, default=1024 * 1024 * 1024,
+                                help='start a new segment at the next keyframe after this many bytes')
+    segment_parser.add_argument('--diskBudget', type=int, default=None,
+                                help='delete the oldest segments when all segments exceed this many bytes')
+    add_file_writer_arguments(segment_parser, asyncOption=False)
+    segment_parser.set_defaults(func=cmd_record_segments)
+
+    replay_parser = subparsers.add_parser('replay', help="keep the last seconds of video&audio in memory and save "
+                                                         "them as h264/wav when SIGUSR1 is received")
+    replay_parser.add_argument('-directory', type=str, required=True, help='directory for the saved files')
+    replay_parser.add_argument('--replaySeconds', type=float, default=30.0, help='seconds kept in memory')
+    replay_parser.add_argument('--replayBytes', type=int, default=256 * 1024 * 1024, help='bytes kept in memory')
+    replay_parser.set_defaults(func=cmd_replay)
     args = parser.parse_args()
     if not args.subparser:
         parser.print_help()
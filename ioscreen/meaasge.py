@@ -1,19 +1,38 @@
+import enum
 import logging
 import multiprocessing
 import struct
 import threading
 
 from .coremedia.consumer import Consumer
-from .asyn import AyncConst, create_hpd1_device, new_asyn_dict_packet, create_hpa1_device, \
-    asyn_need_packet_bytes, AsynCmSampleBufPacket, AsynSprpPacket, AsynTjmpPacket, AsynSratPacket, AsynTbasPacket, \
-    AsynRelsPacket, asyn_hpa0, asyn_hpd0
-from .coremedia.CMclock import CMClock, calculate_skew
+from .asyn import AyncConst, create_hpd1_device, new_asyn_dict_packet, new_asyn_dict_template, create_hpa1_device, \
+    asyn_hpa0, asyn_hpd0
+from .coremedia.CMclock import calculate_skew
+from .coremedia.CMFormatDescription import DescriptorConst, FormatDescriptorCache
+from .handler import default_handlers
 from .ping import PingConst, new_ping_packet_bytes
-from .sync import SyncConst, SyncOGPacket, SyncCwpaPacket, clock_ref_reply, SyncCvrpPacket, SyncClockPacket, \
-    SyncTimePacket, SyncAfmtPacket, SyncSkewPacket, SyncStopPacket
+from .sync import SyncConst
+from .flow import NeedFlowControl
+from .transfer import UsbWriter, WritePriority
 
 logger = logging.getLogger("ioscreen")
 
+NominalAudioSkew = 48000.0  # 还没有足够的 EAT 计算时钟偏差时按标称采样率回复
+
+
+class MediaMode(enum.Enum):
+    AudioVideo = 'av'
+    VideoOnly = 'video'  # 不发送 HPA1，设备不会传输音频
+    AudioOnly = 'audio'  # 不发送 HPD1，设备不会传输视频
+
+    @property
+    def video(self):
+        return self != MediaMode.AudioOnly
+
+    @property
+    def audio(self):
+        return self != MediaMode.VideoOnly
+
 
 class MessageProcessor:
     stopSignal = None
@@ -28,7 +47,14 @@ class MessageProcessor:
     lastEatFrameReceivedLocalAudioClockTime = None
     releaseWaiter = threading.Event()  # 主动结束回调
 
-    def __init__(self, device, inEndpoint, outEndpoint, stopSignal, cmSampleBufConsumer: Consumer):
+    def __init__(self, device, inEndpoint, outEndpoint, stopSignal, cmSampleBufConsumer: Consumer, maxFps=None,
+                 maxBacklog=None, hpd1Device=None, mediaMode=MediaMode.AudioVideo):
+        """
+        :param maxFps: 限制设备发送视频帧的帧率
+        :param maxBacklog: consumer 积压超过该值时暂停发放 NEED
+        :param hpd1Device: HPD1 设备信息字典，默认 create_hpd1_device()
+        :param mediaMode: 握手时只协商需要的音频/视频流，不需要的流不会经过 USB 传输
+        """
         self.device = device
         self.inEndpoint = inEndpoint  # 输出数据端口
         self.outEndpoint = outEndpoint  # 写入数据端口
@@ -36,150 +62,123 @@ class MessageProcessor:
         self.localAudioClock = None
         self.deviceAudioClockRef = None
         self.cmSampleBufConsumer: Consumer = cmSampleBufConsumer  # 处理输出数据
-
-    def usbWrite(self, data):
-        # print('写入:',data)
-        self.device.write(self.outEndpoint, data, 100)
-
-    def handleSyncPacket(self, buffer: bytes):
-
-        code = struct.unpack('<I', buffer[12:16])[0]
-        if code == SyncConst.OG:
-            ogPacket = SyncOGPacket.from_bytes(buffer)
-            logger.debug(ogPacket)
-            self.usbWrite(ogPacket.to_bytes())
-
-        elif code == SyncConst.CWPA:
-            cwpaPacket = SyncCwpaPacket.from_bytes(buffer)
-            logger.debug(cwpaPacket)
-            clockRef = cwpaPacket.DeviceClockRef + 1000
-            self.localAudioClock = CMClock.new(clockRef)
-            self.deviceAudioClockRef = cwpaPacket.DeviceClockRef
-            deviceInfo = new_asyn_dict_packet(create_hpd1_device(), AyncConst.HPD1, 1)
-            logger.debug("Sending ASYN HPD1")
-            self.usbWrite(deviceInfo)
-
-            logger.debug("Send CWPA-RPLY {correlation:%x, clockRef:%x}", cwpaPacket.CorrelationID, clockRef)
-            self.usbWrite(clock_ref_reply(clockRef, cwpaPacket.CorrelationID))
-            logger.debug("Sending ASYN HPD1")
-            self.usbWrite(deviceInfo)
-            deviceInfo1 = new_asyn_dict_packet(create_hpa1_device(), AyncConst.HPA1, cwpaPacket.DeviceClockRef)
-            logger.debug("Sending ASYN HPA1")
-            self.usbWrite(deviceInfo1)
-
-        elif code == SyncConst.CVRP:
-            cvrpPacket = SyncCvrpPacket.from_bytes(buffer)
-            logger.debug(cvrpPacket)
-            self.needClockRef = cvrpPacket.DeviceClockRef
-            self.needMessage = asyn_need_packet_bytes(cvrpPacket.DeviceClockRef)
-            logger.debug(f"Sending needMessage")
-            self.usbWrite(self.needMessage)
-            clockRef2 = cvrpPacket.DeviceClockRef + 0x1000AF
-            self.usbWrite(clock_ref_reply(clockRef2, cvrpPacket.CorrelationID))
-
-        elif code == SyncConst.CLOK:
-            clockPacket = SyncClockPacket.from_bytes(buffer)
-            logger.debug(clockPacket)
-            clockRef = clockPacket.ClockRef + 0x10000
-            self.clock = CMClock.new(clockRef)  # 本地时钟用来同步时间差
-            replyBytes = clock_ref_reply(clockRef, clockPacket.CorrelationID)
-            self.usbWrite(replyBytes)
-
-        elif code == SyncConst.TIME:
-            timePacket = SyncTimePacket.from_bytes(buffer)
-            logger.debug(timePacket)
-            timeToSend = self.clock.getTime()
-            replyBytes = timePacket.to_bytes(timeToSend)
-            self.usbWrite(replyBytes)
-
-        elif code == SyncConst.AFMT:
-            afmtPacket = SyncAfmtPacket.from_bytes(buffer)
-            logger.debug(afmtPacket)
-            replyBytes = afmtPacket.to_bytes()
-            self.usbWrite(replyBytes)
-
-        elif code == SyncConst.SKEW:
-            skewPacket = SyncSkewPacket.from_bytes(buffer)
-            logger.debug(skewPacket)
-            skewValue = calculate_skew(self.startTimeLocalAudioClock, self.lastEatFrameReceivedLocalAudioClockTime,
-                                       self.startTimeDeviceAudioClock, self.lastEatFrameReceivedDeviceAudioClockTime)
-            replyBytes = skewPacket.to_bytes(skewValue)
-            self.usbWrite(replyBytes)
-
-        elif code == SyncConst.STOP:
-            stopPacket = SyncStopPacket.from_bytes(buffer)
-            logger.debug(stopPacket)
-            replyBytes = stopPacket.to_bytes()
-            self.usbWrite(replyBytes)
-
+        # consumer 不需要的媒体类型不构建 CMSampleBuffer
+        self.wantVideo = cmSampleBufConsumer.wants(DescriptorConst.MediaTypeVideo)
+        self.wantAudio = cmSampleBufConsumer.wants(DescriptorConst.MediaTypeSound)
+        self.sampleFields = cmSampleBufConsumer.fields
+        self.hpd1Device = hpd1Device or create_hpd1_device()
+        self.mediaMode = MediaMode(mediaMode)
+        self.formatCache = FormatDescriptorCache()  # 关键帧重复的 fdsc 只解析一次
+        self.hpd1Packet = new_asyn_dict_packet(self.hpd1Device, AyncConst.HPD1, 1)  # 会话内只序列化一次
+        self.hpa1Template = new_asyn_dict_template(create_hpa1_device(), AyncConst.HPA1)
+        self.handlers = {int(packetMagic): {int(messageMagic): handler for messageMagic, handler in handlers.items()}
+                         for packetMagic, handlers in default_handlers().items()}  # 包类型 -> 消息类型 -> handler
+        self.observers = {}
+        self.usbWriter = UsbWriter(self._write).start()  # 独立的 USB 写入线程
+        self.needFlow = NeedFlowControl(self.sendNeed, maxFps=maxFps, maxBacklog=maxBacklog,
+                                        backlog=cmSampleBufConsumer.backlog)
+
+    def _write(self, data):
+        if self.outEndpoint:
+            self.device.write(self.outEndpoint, data, 100)
+
+    def usbWrite(self, data, priority=WritePriority.Normal, key=None):
+        """ 写入队列, 由 usbWriter 线程发送
+        :param priority: 同步回复中 TIME/CLOK/SKEW 使用 WritePriority.Urgent
+        :param key: 队列中已有相同 key 的包时合并
+        """
+        self.usbWriter.put(data, priority, key)
+
+    def sendNeed(self):
+        self.usbWrite(self.needMessage, key=AyncConst.NEED)
+
+    def register_handler(self, packetMagic, messageMagic, handler):
+        """ 注册或替换某种消息的处理
+        :param packetMagic: SyncConst.SyncPacketMagic / AyncConst.AsyncPacketMagic
+        :param messageMagic: 消息类型, 如 AyncConst.FEED
+        :param handler: PacketHandler, handle(processor, buffer)
+        """
+        self.handlers.setdefault(int(packetMagic), {})[int(messageMagic)] = handler
+
+    def add_observer(self, packetMagic, messageMagic, observer):
+        """ 消息处理完后回调 observer(buffer), buffer 只在回调期间有效
+        """
+        self.observers.setdefault((int(packetMagic), int(messageMagic)), []).append(observer)
+
+    def dispatch(self, packetMagic, buffer: memoryview):
+        messageMagic = struct.unpack_from('<I', buffer, 12)[0]
+        handler = self.handlers[packetMagic].get(messageMagic)
+        if handler is None:
+            logger.warning("received unknown %x packet type: %x", packetMagic, messageMagic)
+        else:
+            handler.handle(self, buffer)
+        observers = self.observers.get((packetMagic, messageMagic))
+        if observers:
+            for observer in observers:
+                observer(buffer)
+
+    def handleSyncPacket(self, buffer: memoryview):
+        self.dispatch(SyncConst.SyncPacketMagic, buffer)
+
+    def handleAsyncPacket(self, buffer: memoryview):
+        self.dispatch(AyncConst.AsyncPacketMagic, buffer)
+
+    def recordAudioTime(self, deviceTime):
+        """ 记录 EAT 的设备时间和对应的本地时间, 用于计算 SKEW
+        """
+        if self.firstAudioTimeTaken:  # 第一次接入记录本地时间
+            self.lastEatFrameReceivedDeviceAudioClockTime = deviceTime
+            self.lastEatFrameReceivedLocalAudioClockTime = self.localAudioClock.getTime()
         else:
-            logger.warning("received unknown sync ioscreen type: %x", buffer)
-
-    def handleAsyncPacket(self, buffer: bytes):
-        code = struct.unpack('<I', buffer[12:16])[0]
-        if code == AyncConst.EAT:
-            eatPacket = AsynCmSampleBufPacket.from_bytes(buffer)
-            if self.firstAudioTimeTaken:  # 第一次接入记录本地时间
-                self.lastEatFrameReceivedDeviceAudioClockTime = eatPacket.CMSampleBuf.OutputPresentationTimestamp
-                self.lastEatFrameReceivedLocalAudioClockTime = self.localAudioClock.getTime()
-            else:
-                self.startTimeDeviceAudioClock = eatPacket.CMSampleBuf.OutputPresentationTimestamp
-                self.startTimeLocalAudioClock = self.localAudioClock.getTime()
-                self.lastEatFrameReceivedDeviceAudioClockTime = eatPacket.CMSampleBuf.OutputPresentationTimestamp
-                self.lastEatFrameReceivedLocalAudioClockTime = self.startTimeLocalAudioClock
-                self.firstAudioTimeTaken = True
-            self.cmSampleBufConsumer.consume(eatPacket.CMSampleBuf)
-        elif code == AyncConst.FEED:
-            feedPacket = AsynCmSampleBufPacket.from_bytes(buffer)
-            self.cmSampleBufConsumer.consume(feedPacket.CMSampleBuf)
-            self.usbWrite(self.needMessage)
-        elif code == AyncConst.SPRP:
-            Packet = AsynSprpPacket.from_bytes(buffer)
-            logger.debug(Packet)
-
-        elif code == AyncConst.TJMP:
-            Packet = AsynTjmpPacket.from_bytes(buffer)
-            logger.debug(Packet)
-
-        elif code == AyncConst.SRAT:
-            Packet = AsynSratPacket.from_bytes(buffer)
-            logger.debug(Packet)
-
-        elif code == AyncConst.TBAS:
-            Packet = AsynTbasPacket.from_bytes(buffer)
-            logger.debug(Packet)
-
-        elif code == AyncConst.RELS:
-            Packet = AsynRelsPacket.from_bytes(buffer)
-            logger.debug(Packet)
-            self.releaseWaiter.set()
-
-    def receive_data(self, buffer, event: multiprocessing.Event = None):
-        code = struct.unpack('<I', buffer[:4])[0]
+            self.startTimeDeviceAudioClock = deviceTime
+            self.startTimeLocalAudioClock = self.localAudioClock.getTime()
+            self.lastEatFrameReceivedDeviceAudioClockTime = deviceTime
+            self.lastEatFrameReceivedLocalAudioClockTime = self.startTimeLocalAudioClock
+            self.firstAudioTimeTaken = True
+
+    def audioSkew(self):
+        if not self.firstAudioTimeTaken or \
+                self.lastEatFrameReceivedDeviceAudioClockTime.CMTimeValue == self.startTimeDeviceAudioClock.CMTimeValue:
+            return NominalAudioSkew
+        return calculate_skew(self.startTimeLocalAudioClock, self.lastEatFrameReceivedLocalAudioClockTime,
+                              self.startTimeDeviceAudioClock, self.lastEatFrameReceivedDeviceAudioClockTime)
+
+    def receive_data(self, buffer: memoryview, event: multiprocessing.Event = None):
+        """ 处理一个完整的数据包
+        :param buffer: ByteStream 返回的 memoryview, 各级解析只做切片不拷贝
+        :param event:
+        :return:
+        """
+        buffer = memoryview(buffer)
+        code = struct.unpack_from('<I', buffer)[0]
         if code == PingConst.PingPacketMagic:
             logger.info("AudioVideo-Stream has start success")
             self.usbWrite(new_ping_packet_bytes())
-        elif code == SyncConst.SyncPacketMagic:
-            self.handleSyncPacket(buffer)
-            if event is not None and not event.is_set():
+        elif code in self.handlers:
+            self.dispatch(code, buffer)
+            if code == SyncConst.SyncPacketMagic and event is not None and not event.is_set():
                 event.set()
-        elif code == AyncConst.AsyncPacketMagic:
-            self.handleAsyncPacket(buffer)
         else:
-            logger.warning(f'received unknown ioscreen {buffer}')
+            logger.warning(f'received unknown ioscreen {bytes(buffer)}')
 
     def close_session(self):
         # 如非正常关闭有可能会造成设备无法访问，需要重插 usb 或重启设备
         logger.info("Telling device to stop streaming..")
+        self.needFlow.stop()
         if self.outEndpoint:
-            self.usbWrite(asyn_hpa0(self.deviceAudioClockRef))
-            self.usbWrite(asyn_hpd0())
+            if self.mediaMode.audio:
+                self.usbWrite(asyn_hpa0(self.deviceAudioClockRef))
+            if self.mediaMode.video:
+                self.usbWrite(asyn_hpd0())
             while not self.releaseWaiter.wait(5):
                 logger.warning("Timed out waiting for device closing")
                 break
             logger.info("Waiting for device to tell us to stop..")
-            self.usbWrite(asyn_hpd0())
-            logger.info("Ready to release USB Device.")
+            if self.mediaMode.video:
+                self.usbWrite(asyn_hpd0())
+        self.usbWriter.stop()
+        logger.debug(f"usb writer stats: {self.usbWriter.stats()}")
+        logger.info("Ready to release USB Device.")
 
     def stop(self):
         self.stopSignal.set()
@@ -1,6 +1,8 @@
 import enum
 import struct
 
+from .template import PacketTemplate
+
 
 class PingConst(enum.IntEnum):
     PingPacketMagic = 0x70696E67
@@ -12,8 +14,7 @@ def new_ping_packet_bytes():
     """default Ping ioscreen
     :return:
     """
-    packet_bytes = b''
-    packet_bytes += struct.pack('<I', PingConst.PingLength)
-    packet_bytes += struct.pack('<I', PingConst.PingPacketMagic)
-    packet_bytes += struct.pack('<Q', PingConst.PingHeader)
-    return packet_bytes
\ No newline at end of file
+    return pingTemplate.render()
+
+
+pingTemplate = PacketTemplate(struct.pack('<IIQ', PingConst.PingLength, PingConst.PingPacketMagic, PingConst.PingHeader))
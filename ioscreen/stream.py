@@ -0,0 +1,82 @@
+"""
+USB 读取数据的重组缓冲区
+"""
+import array
+import collections
+import threading
+from time import monotonic
+
+
+class ByteStream:
+    """ USB 数据重组缓冲区
+    按读取到的块保存数据，get 只拷贝本次取出的字节，数据不足时在条件变量上等待 put 唤醒
+    """
+
+    def __init__(self):
+        self._chunks = collections.deque()
+        self._offset = 0  # 首块中已被取走的字节数
+        self._size = 0  # 可读字节总数
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, _byte: array):
+        if not len(_byte):
+            return True
+        with self._cond:
+            self._chunks.append(_byte)
+            self._size += len(_byte)
+            self._cond.notify()
+        return True
+
+    def get(self, num: int, timeout=5):
+        """ 取出 num 个字节
+        :param num:
+        :param timeout: 秒, None 表示一直等待
+        :return: memoryview, 尽量直接引用 USB 读取块; 超时或已关闭时返回 None, 不会消耗已有数据
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self._cond:
+            while num > self._size:
+                if self._closed:
+                    return None
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self._take(num)
+
+    def _take(self, num):
+        head = self._chunks[0]
+        if len(head) - self._offset >= num:
+            # 整包都在同一个 USB 读取块内时直接返回该块的切片，不做拷贝
+            _byte = memoryview(head)[self._offset:self._offset + num]
+            self._offset += num
+            if self._offset == len(head):
+                self._chunks.popleft()
+                self._offset = 0
+            self._size -= num
+            return _byte
+        _byte = bytearray(num)
+        index = 0
+        while index < num:
+            head = self._chunks[0]
+            count = min(len(head) - self._offset, num - index)
+            _byte[index:index + count] = memoryview(head)[self._offset:self._offset + count]
+            index += count
+            self._offset += count
+            if self._offset == len(head):
+                self._chunks.popleft()
+                self._offset = 0
+        self._size -= num
+        return memoryview(_byte)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -9,6 +9,10 @@ from .coremedia.AudioStream import AudioStreamBasicDescription
 from .coremedia.common import NSNumber
 from .coremedia.serialize import SerializeStringKeyDict, new_string_dict_from_bytes, parse_header
 
+replyHeaderStruct = struct.Struct('<IIQI')  # length, magic, correlationID, 0
+clockRefReplyStruct = struct.Struct('<IIQIQ')
+skewReplyStruct = struct.Struct('<IIQId')
+
 
 def parse_sync_header(buffer, message_magic):
     remainingBytes, clockRef = parse_header(buffer, SyncConst.SyncPacketMagic, message_magic)
@@ -30,6 +34,7 @@ class SyncConst(enum.IntEnum):
 
 
 class SyncPacket:
+    __slots__ = ('ClockRef', 'CorrelationID')
     messageMagic = None
 
     def __init__(self, ClockRef, CorrelationID):
@@ -46,19 +51,14 @@ class SyncPacket:
 
 
 def clock_ref_reply(clockRef, CorrelationID):
-    packet_bytes = b''
-    packet_bytes += struct.pack('<I', 28)
-    packet_bytes += struct.pack('<I', SyncConst.ReplyPacketMagic)
-    packet_bytes += struct.pack('<Q', CorrelationID)
-    packet_bytes += struct.pack('<I', 0)
-    packet_bytes += struct.pack('<Q', clockRef)
-    return packet_bytes
+    return clockRefReplyStruct.pack(28, SyncConst.ReplyPacketMagic, CorrelationID, 0, clockRef)
 
 
 # ------------------- SyncPacket ——————————————————————
 
 
 class SyncAfmtPacket(SyncPacket):
+    __slots__ = ('AudioStreamBasicDescription',)
     messageMagic = SyncConst.AFMT
 
     def __init__(self, ClockRef, CorrelationID, AudioStreamBasicDescription=None):
@@ -70,16 +70,12 @@ class SyncAfmtPacket(SyncPacket):
 
     def to_bytes(self):
         _data = {'Error': NSNumber(3, 0)}
-        dictBytes = SerializeStringKeyDict(_data).to_bytes()
-        dictLength = len(dictBytes)
-        _length = dictLength + 20
-        packet_bytes = b''
-        packet_bytes += struct.pack('<I', _length)
-        packet_bytes += struct.pack('<I', SyncConst.ReplyPacketMagic)
-        packet_bytes += struct.pack('<Q', self.CorrelationID)
-        packet_bytes += struct.pack('<I', 0)
-        packet_bytes += dictBytes
-        return packet_bytes
+        serialize = SerializeStringKeyDict(_data)
+        _length = serialize.size() + 20
+        packet_bytes = bytearray(_length)
+        replyHeaderStruct.pack_into(packet_bytes, 0, _length, SyncConst.ReplyPacketMagic, self.CorrelationID, 0)
+        serialize.pack_into(packet_bytes, 20)
+        return bytes(packet_bytes)
 
     @classmethod
     def from_bytes(self, buffer):
@@ -89,6 +85,7 @@ class SyncAfmtPacket(SyncPacket):
 
 
 class SyncClockPacket(SyncPacket):
+    __slots__ = ()
     messageMagic = SyncConst.CLOK
 
     def __init__(self, ClockRef, CorrelationID):
@@ -109,6 +106,7 @@ class SyncClockPacket(SyncPacket):
 
 
 class SyncCvrpPacket(SyncPacket):
+    __slots__ = ('DeviceClockRef', 'Payload')
     messageMagic = SyncConst.CVRP
 
     def __init__(self, ClockRef, CorrelationID, DeviceClockRef=None, Payload=None):
@@ -133,6 +131,7 @@ class SyncCvrpPacket(SyncPacket):
 
 
 class SyncCwpaPacket(SyncPacket):
+    __slots__ = ('DeviceClockRef',)
     messageMagic = SyncConst.CWPA
 
     def __init__(self, ClockRef, CorrelationID, DeviceClockRef=None):
@@ -155,6 +154,7 @@ class SyncCwpaPacket(SyncPacket):
 
 
 class SyncOGPacket(SyncPacket):
+    __slots__ = ('Unknown',)
     messageMagic = SyncConst.OG
 
     def __init__(self, ClockRef, CorrelationID, Unknown=None):
@@ -164,12 +164,7 @@ class SyncOGPacket(SyncPacket):
         self.Unknown = Unknown
 
     def to_bytes(self):
-        packet_bytes = b''
-        packet_bytes += struct.pack('<I', 24)
-        packet_bytes += struct.pack('<I', SyncConst.ReplyPacketMagic)
-        packet_bytes += struct.pack('<Q', self.CorrelationID)
-        packet_bytes += struct.pack('<Q', 0)
-        return packet_bytes
+        return replyHeaderStruct.pack(24, SyncConst.ReplyPacketMagic, self.CorrelationID, 0) + bytes(4)
 
     @classmethod
     def from_bytes(self, buffer):
@@ -182,6 +177,7 @@ class SyncOGPacket(SyncPacket):
 
 
 class SyncSkewPacket(SyncPacket):
+    __slots__ = ()
     messageMagic = SyncConst.SKEW
 
     def __init__(self, ClockRef, CorrelationID):
@@ -190,16 +186,11 @@ class SyncSkewPacket(SyncPacket):
         self.CorrelationID = CorrelationID
 
     def to_bytes(self, skew):
-        packet_bytes = b''
-        packet_bytes += struct.pack('<I', 28)
-        packet_bytes += struct.pack('<I', SyncConst.ReplyPacketMagic)
-        packet_bytes += struct.pack('<Q', self.CorrelationID)
-        packet_bytes += struct.pack('<I', 0)
-        packet_bytes += struct.pack('<d', skew)
-        return packet_bytes
+        return skewReplyStruct.pack(28, SyncConst.ReplyPacketMagic, self.CorrelationID, 0, skew)
 
 
 class SyncStopPacket(SyncPacket):
+    __slots__ = ()
     messageMagic = SyncConst.STOP
 
     def __init__(self, ClockRef, CorrelationID):
@@ -208,16 +199,11 @@ class SyncStopPacket(SyncPacket):
         self.CorrelationID = CorrelationID
 
     def to_bytes(self):
-        packet_bytes = b''
-        packet_bytes += struct.pack('<I', 24)
-        packet_bytes += struct.pack('<I', SyncConst.ReplyPacketMagic)
-        packet_bytes += struct.pack('<Q', self.CorrelationID)
-        packet_bytes += struct.pack('<I', 0)
-        packet_bytes += struct.pack('<I', 0)
-        return packet_bytes
+        return replyHeaderStruct.pack(24, SyncConst.ReplyPacketMagic, self.CorrelationID, 0) + bytes(4)
 
 
 class SyncTimePacket(SyncPacket):
+    __slots__ = ()
     messageMagic = SyncConst.TIME
 
     def __init__(self, ClockRef, CorrelationID):
@@ -226,10 +212,4 @@ class SyncTimePacket(SyncPacket):
         self.CorrelationID = CorrelationID
 
     def to_bytes(self, time:CMTime):
-        packet_bytes = b''
-        packet_bytes += struct.pack('<I', 44)
-        packet_bytes += struct.pack('<I', SyncConst.ReplyPacketMagic)
-        packet_bytes += struct.pack('<Q', self.CorrelationID)
-        packet_bytes += struct.pack('<I', 0)
-        packet_bytes += bytes(time)
-        return packet_bytes
+        return replyHeaderStruct.pack(44, SyncConst.ReplyPacketMagic, self.CorrelationID, 0) + bytes(time)
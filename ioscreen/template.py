@@ -0,0 +1,37 @@
+"""
+预先构建的包模板: 常量包只构建一次, 只有个别字段变化的包复制模板后改写对应字段
+"""
+import struct
+
+
+class PacketTemplate:
+    """
+    :param data: 完整的包内容, 可变字段的值任意
+    :param fields: 可变字段 {name: (offset, struct 格式)}
+    """
+    __slots__ = ('data', 'fields')
+
+    def __init__(self, data, **fields):
+        self.data = bytes(data)
+        self.fields = {name: (offset, struct.Struct(fmt)) for name, (offset, fmt) in fields.items()}
+
+    def render(self, **values):
+        """ 没有可变字段时直接返回共享的 bytes, 否则返回新的 bytearray, 已入队未发送的包不会被改写
+        """
+        if not values:
+            return self.data
+        buf = bytearray(self.data)
+        for name, value in values.items():
+            offset, fieldStruct = self.fields[name]
+            fieldStruct.pack_into(buf, offset, value)
+        return buf
+
+    def bind(self, **values):
+        """ 固定部分字段, 得到新的模板, 如整个会话内不变的 clockRef
+        """
+        fields = {name: (offset, fieldStruct.format) for name, (offset, fieldStruct) in self.fields.items()
+                  if name not in values}
+        return PacketTemplate(self.render(**values), **fields)
+
+    def __len__(self):
+        return len(self.data)
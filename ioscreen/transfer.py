@@ -0,0 +1,277 @@
+"""
+USB bulk 传输
+"""
+import enum
+import heapq
+import logging
+import threading
+from ctypes import Structure, addressof, byref, c_long, c_ubyte, c_void_p, POINTER
+from time import monotonic, perf_counter
+
+logger = logging.getLogger("ioscreen")
+
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_TRANSFER_SIZE = 1024 * 1024
+
+LIBUSB_TRANSFER_TYPE_BULK = 2
+LIBUSB_TRANSFER_COMPLETED = 0
+LIBUSB_TRANSFER_CANCELLED = 3
+LIBUSB_ERROR_INTERRUPTED = -10
+
+
+class timeval(Structure):
+    _fields_ = [
+        ('tv_sec', c_long),
+        ('tv_usec', c_long),
+    ]
+
+
+class BulkReader:
+    """ 预先挂起 queueDepth 个 bulk IN 传输，Python 处理上一块数据时设备可以继续发送
+    libusb1 后端使用 libusb 异步传输，其它后端退化为单线程同步读取
+
+    :param onData: 每个完成的传输回调一次，参数为该次读取的 memoryview，按提交顺序回调
+    :param onError: 出错或 timeout 秒内没有收到任何数据时回调一次，之后读取停止
+    """
+
+    def __init__(self, device, endpoint, onData, onError, queueDepth=DEFAULT_QUEUE_DEPTH,
+                 transferSize=DEFAULT_TRANSFER_SIZE, timeout=3):
+        self.device = device
+        self.endpoint = endpoint
+        self.onData = onData
+        self.onError = onError
+        self.queueDepth = max(1, int(queueDepth))
+        self.transferSize = int(transferSize)
+        self.timeout = timeout
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        loop = self._sync_loop
+        try:
+            self._setup_async()
+            loop = self._async_loop
+        except Exception as E:
+            logger.debug(f'libusb async transfer not available, fallback to sync read: {E}')
+        self._thread = threading.Thread(target=loop, name='ioscreen-usb-reader', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _fail(self, error):
+        if not self._stopping.is_set():
+            self._stopping.set()
+            self.onError(error)
+
+    # ------------------- 同步读取 ——————————————————————
+
+    def _sync_loop(self):
+        while not self._stopping.is_set():
+            try:
+                data = self.device.read(self.endpoint, self.transferSize, int(self.timeout * 1000))
+            except Exception as E:
+                self._fail(E)
+                break
+            self.onData(memoryview(data))
+
+    # ------------------- libusb 异步传输 ——————————————————————
+
+    def _setup_async(self):
+        from usb.backend import libusb1
+
+        backend = self.device._ctx.backend
+        if not isinstance(backend, libusb1._LibUSB):
+            raise Exception(f'unsupported backend {type(backend).__name__}')
+        lib = backend.lib
+        lib.libusb_cancel_transfer.argtypes = [POINTER(libusb1._libusb_transfer)]
+        lib.libusb_handle_events_timeout.argtypes = [c_void_p, POINTER(timeval)]
+        self.device._ctx.managed_open()
+        _, ep = self.device._ctx.setup_request(self.device, self.endpoint)
+
+        self._lib = lib
+        self._usbCtx = backend.ctx
+        self._callback = libusb1._libusb_transfer_cb_fn_p(self._on_transfer)  # 必须持有引用，防止被回收
+        self._transfers = {}
+        for _ in range(self.queueDepth):
+            transfer_p = lib.libusb_alloc_transfer(0)
+            if not transfer_p:
+                self._free_transfers()
+                raise Exception('libusb_alloc_transfer failed')
+            transfer = transfer_p.contents
+            transfer.dev_handle = self.device._ctx.handle.handle
+            transfer.endpoint = ep.bEndpointAddress
+            transfer.type = LIBUSB_TRANSFER_TYPE_BULK
+            transfer.timeout = 0  # 由 _async_loop 统一判断超时
+            transfer.callback = self._callback
+            transfer.num_iso_packets = 0
+            # 缓冲区在整个读取过程中复用，完成时只拷贝 actual_length 字节交给 onData
+            buf = bytearray(self.transferSize)
+            transfer.buffer = addressof((c_ubyte * self.transferSize).from_buffer(buf))
+            transfer.length = self.transferSize
+            self._transfers[addressof(transfer)] = [transfer_p, buf, False]
+
+    def _submit(self, key):
+        slot = self._transfers[key]
+        slot[2] = True
+        ret = self._lib.libusb_submit_transfer(slot[0])
+        if ret < 0:
+            slot[2] = False
+            raise Exception(f'libusb_submit_transfer error {ret}')
+        self._pending += 1
+
+    def _on_transfer(self, transfer_p):
+        transfer = transfer_p.contents
+        slot = self._transfers[addressof(transfer)]
+        slot[2] = False
+        self._pending -= 1
+        status = transfer.status
+        if transfer.actual_length:
+            self._lastData = monotonic()
+            # 拷贝后再重新提交，已交给 onData 的数据不会被下一次传输覆盖
+            self.onData(memoryview(bytes(memoryview(slot[1])[:transfer.actual_length])))
+        if status == LIBUSB_TRANSFER_COMPLETED:
+            if not self._stopping.is_set():
+                try:
+                    self._submit(addressof(transfer))
+                except Exception as E:
+                    self._fail(E)
+        elif status != LIBUSB_TRANSFER_CANCELLED:
+            self._fail(Exception(f'bulk transfer failed, status {status}'))
+
+    def _async_loop(self):
+        self._pending = 0
+        self._lastData = monotonic()
+        try:
+            for key in self._transfers:
+                self._submit(key)
+        except Exception as E:
+            self._fail(E)
+        tv = timeval(0, 100000)
+        cancelled = False
+        while self._pending:
+            if self._stopping.is_set() and not cancelled:
+                cancelled = True
+                for key, slot in self._transfers.items():
+                    if slot[2]:
+                        self._lib.libusb_cancel_transfer(slot[0])
+            ret = self._lib.libusb_handle_events_timeout(self._usbCtx, byref(tv))
+            if ret < 0 and ret != LIBUSB_ERROR_INTERRUPTED:
+                self._fail(Exception(f'libusb_handle_events error {ret}'))
+            elif self.timeout and monotonic() - self._lastData > self.timeout:
+                self._fail(Exception(f'no data received in {self.timeout}s'))
+        self._free_transfers()
+
+    def _free_transfers(self):
+        for slot in self._transfers.values():
+            self._lib.libusb_free_transfer(slot[0])
+        self._transfers = {}
+
+
+class WritePriority(enum.IntEnum):
+    Urgent = 0  # 对时间敏感的同步回复 (TIME/CLOK/SKEW)
+    Normal = 1
+
+
+class UsbWriter:
+    """ USB 写入线程，解析线程只负责入队，不会被慢速的 OUT 传输阻塞
+    Urgent 包优先发送，同优先级按入队顺序发送；带 key 的包在队列中已有同 key 的包时直接合并丢弃
+
+    :param write: 实际写入函数，在写入线程中调用
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self._queue = []
+        self._keys = set()
+        self._seq = 0
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self.writeCount = 0
+        self.coalescedCount = 0
+        self.errorCount = 0
+        self.maxQueueDepth = 0
+        self.totalLatency = 0.0  # 入队到写完
+        self.maxLatency = 0.0
+        self.totalWriteTime = 0.0  # write 本身耗时
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='ioscreen-usb-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, data, priority=WritePriority.Normal, key=None):
+        with self._cond:
+            if self._closed:
+                return False
+            if key is not None:
+                if key in self._keys:
+                    self.coalescedCount += 1
+                    return True
+                self._keys.add(key)
+            heapq.heappush(self._queue, (priority, self._seq, perf_counter(), data, key))
+            self._seq += 1
+            self.maxQueueDepth = max(self.maxQueueDepth, len(self._queue))
+            self._cond.notify_all()
+        return True
+
+    def qsize(self):
+        return len(self._queue)
+
+    def flush(self, timeout=None):
+        """ 等待队列中的包全部写完
+        :return: 是否在超时前写完
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def stop(self, timeout=5):
+        """ 写完已入队的包后结束写入线程
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def stats(self):
+        writes = self.writeCount or 1
+        return {
+            'queueDepth': len(self._queue),
+            'maxQueueDepth': self.maxQueueDepth,
+            'writes': self.writeCount,
+            'coalesced': self.coalescedCount,
+            'errors': self.errorCount,
+            'avgLatency': self.totalLatency / writes,
+            'maxLatency': self.maxLatency,
+            'avgWriteTime': self.totalWriteTime / writes,
+        }
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                while not self._queue:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                _, _, queuedAt, data, key = heapq.heappop(self._queue)
+                self._keys.discard(key)
+                self._busy = True
+            start = perf_counter()
+            try:
+                self.write(data)
+            except Exception as E:
+                self.errorCount += 1
+                logger.warning(f'usb write error: {E}')
+            end = perf_counter()
+            self.writeCount += 1
+            self.totalWriteTime += end - start
+            self.totalLatency += end - queuedAt
+            self.maxLatency = max(self.maxLatency, end - queuedAt)
@@ -1,20 +1,23 @@
 import _thread
-import array
 import logging
 import multiprocessing
 import signal
 import struct
 import sys
 import threading
-from time import sleep, time
+from time import sleep
 
 import libusb_package
 import usb
 from usb.core import Device
 
-from .coremedia.consumer import AVFileWriter, SocketUDP, Consumer
+from .asyn import create_hpd1_device
+from .coremedia.consumer import AVFileWriter, SocketUDP, Consumer, BufferedConsumer, DropPolicy
+from .coremedia.filewriter import FsyncPolicy
 from .iphone_models import iPhoneModels
-from .meaasge import MessageProcessor
+from .meaasge import MessageProcessor, MediaMode
+from .stream import ByteStream
+from .transfer import BulkReader, DEFAULT_QUEUE_DEPTH, DEFAULT_TRANSFER_SIZE
 
 logger = logging.getLogger("ioscreen")
 
@@ -67,8 +70,12 @@ def find_ios_device(udid=None):
     return _device
 
 
+def get_device_identifier(device: usb.Device):
+    return f"iPhone{hex(device.bcdDevice >> 8)[2:]},{hex(device.bcdDevice)[-1]}"
+
+
 def get_device_info(device: usb.Device):
-    identifier: str = f"iPhone{hex(device.bcdDevice >> 8)[2:]},{hex(device.bcdDevice)[-1]}"
+    identifier: str = get_device_identifier(device)
     udid: str = str(device.serial_number).rstrip('\x00')
     return f'{iPhoneModels.get_model(identifier)} ({udid})', iPhoneModels.get_width(identifier)
 
@@ -105,27 +112,6 @@ def disable_qt_config(device):
         logger.warning('Failed sending control transfer for enabling hidden QT config')
 
 
-class ByteStream:
-    # mutex = threading.Lock()
-
-    def __init__(self):
-        self._byte = bytearray()
-
-    def put(self, _byte: array):
-        self._byte.extend(_byte)
-        return True
-
-    def get(self, num: int, timeout=5):
-        t1 = time()
-        while num > len(self._byte):
-            sleep(0.01)
-            if timeout < t1 - time():
-                break
-        _byte = self._byte[:num]
-        self._byte = self._byte[num:]
-        return _byte
-
-
 def register_signal(stopSignal):
     def shutdown(num, frame):
         stopSignal.set()
@@ -134,27 +120,29 @@ def register_signal(stopSignal):
         signal.signal(sig, shutdown)
 
 
-def record_wav(device, h264FilePath, wavFilePath, audio_only=False):
+def record_wav(device, h264FilePath, wavFilePath, audio_only=False, displaySize=None):
     consumer = AVFileWriter(h264FilePath=h264FilePath, wavFilePath=wavFilePath, audioOnly=audio_only)
     stopSignal = threading.Event()
     register_signal(stopSignal)
-    start_reading(consumer, device, stopSignal)
+    mediaMode = MediaMode.AudioOnly if audio_only else MediaMode.AudioVideo
+    start_reading(consumer, device, stopSignal, displaySize=displaySize, mediaMode=mediaMode)
 
 
-def record_udp(device, audio_only=False):
+def record_udp(device, audio_only=False, displaySize=None):
     consumer = SocketUDP(audioOnly=audio_only)
     stopSignal = threading.Event()
     register_signal(stopSignal)
-    start_reading(consumer, device, stopSignal)
+    # SocketUDP 只转发视频
+    start_reading(consumer, device, stopSignal, displaySize=displaySize, mediaMode=MediaMode.VideoOnly)
 
 
-def record_gstreamer(device, event: multiprocessing.Event):
+def record_gstreamer(device, event: multiprocessing.Event, displaySize=None):
     from .coremedia.gstreamer import GstAdapter
     stopSignal = threading.Event()
     register_signal(stopSignal)
     model, width = get_device_info(device)
     consumer = GstAdapter.new(stopSignal, model, width)
-    _thread.start_new_thread(start_reading, (consumer, device, stopSignal, event,))
+    _thread.start_new_thread(start_reading, (consumer, device, stopSignal, event,), {'displaySize': displaySize})
     consumer.loop.run()
 
 
@@ -170,8 +158,28 @@ def init_logger(verbosity: bool):
 
 
 def start_reading(consumer: Consumer, device: Device, stopSignal: threading.Event = None,
-                  event: multiprocessing.Event = None):
+                  event: multiprocessing.Event = None, queueDepth=DEFAULT_QUEUE_DEPTH,
+                  transferSize=DEFAULT_TRANSFER_SIZE, bufferSize=0, dropPolicy=DropPolicy.Block, maxFps=None,
+                  maxBacklog=None, displaySize=None, hpd1Options=None, mediaMode=MediaMode.AudioVideo):
+    """
+    :param queueDepth: 同时挂起的 bulk IN 传输个数
+    :param transferSize: 每个 bulk IN 传输的缓冲区大小
+    :param bufferSize: 大于 0 时 consumer 在独立线程中执行，解析线程与其之间最多缓存 bufferSize 个 CMSampleBuffer
+    :param dropPolicy: 缓存满时的处理方式
+    :param maxFps: 通过 NEED 流控限制视频帧率
+    :param maxBacklog: consumer 积压超过该值时暂停请求新的视频帧
+    :param displaySize: 请求的画面尺寸, (width, height) 或 iPhoneModels.DISPLAY_PRESETS 中的名称/native
+    :param hpd1Options: HPD1 设备信息中追加或覆盖的键
+    :param mediaMode: 只传输视频或只传输音频
+    """
     stopSignal = stopSignal or threading.Event()
+    if isinstance(displaySize, str):
+        displaySize = iPhoneModels.get_display_size(get_device_identifier(device), displaySize)
+    displaySize = displaySize or iPhoneModels.DEFAULT_DISPLAY_SIZE
+    hpd1Device = create_hpd1_device(*displaySize, extra=hpd1Options)
+    logger.info(f"Requesting display size {displaySize[0]}x{displaySize[1]}")
+    if bufferSize:
+        consumer = BufferedConsumer(consumer, bufferSize, dropPolicy)
     disable_qt_config(device)
     device.set_configuration()
     logger.info("enable_qt_config..")
@@ -197,39 +205,39 @@ def start_reading(consumer: Consumer, device: Device, stopSignal: threading.Even
     logger.info("USB connection ready, waiting for ping..")
 
     message = MessageProcessor(device, inEndpoint=inEndpoint, outEndpoint=outEndpoint, stopSignal=stopSignal,
-                               cmSampleBufConsumer=consumer)
+                               cmSampleBufConsumer=consumer, maxFps=maxFps, maxBacklog=maxBacklog,
+                               hpd1Device=hpd1Device, mediaMode=mediaMode)
     byteStream = ByteStream()
 
-    def writeStream():
-        """ 异步写入线程
-        :return:
-        """
-        while True:
-            try:
-                data = device.read(inEndpoint, 1024 * 1024, 3000)
-                byteStream.put(data)
-            except Exception as E:
-                logger.warning(E)
-                message.outEndpoint = None
-                message.inEndpoint = None
-                stopSignal.set()
-                break
+    def onError(E):
+        logger.warning(E)
+        message.outEndpoint = None
+        message.inEndpoint = None
+        stopSignal.set()
+        byteStream.close()
 
     def readStream():
-        """ 异步读取流数据
+        """ 异步读取流数据, 直到 byteStream 关闭
         :return:
         """
         while True:
-            lengthBuffer = byteStream.get(4)
+            lengthBuffer = byteStream.get(4, timeout=None)
+            if lengthBuffer is None:
+                break
             _length = struct.unpack('<I', lengthBuffer)[0] - 4
-            buffer = byteStream.get(_length)
+            buffer = byteStream.get(_length, timeout=None)
+            if buffer is None:
+                break
             message.receive_data(buffer, event)
 
-    _thread.start_new_thread(writeStream, ())
+    reader = BulkReader(device, inEndpoint, onData=byteStream.put, onError=onError, queueDepth=queueDepth,
+                        transferSize=transferSize).start()
     _thread.start_new_thread(readStream, ())
 
     while not stopSignal.wait(1):
         pass
     message.close_session()
+    reader.stop()
+    byteStream.close()
     disable_qt_config(device)
     consumer.stop()
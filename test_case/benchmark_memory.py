@@ -0,0 +1,72 @@
+"""
+每帧解析分配的内存, 在 test_case 目录下运行:
+python benchmark_memory.py revision [revision ...]
+
+对比指定的 git revision (如加 __slots__ 之前/之后的提交) 与当前工作区
+每个 revision 用 git archive 导出到临时目录, 在子进程中解析同样的 fixtures
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+FIXTURES = [
+    ('asyn-feed', 4),
+    ('asyn-feed-nofdsc', 0),
+    ('asyn-eat', 0),
+]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(data, number):
+    """ 保留 number 个解析结果(模拟 consumer 积压), 统计每帧仍占用的内存和峰值
+    """
+    from ioscreen.asyn import AsynCmSampleBufPacket
+
+    gc.collect()
+    tracemalloc.start()
+    packets = []
+    for _ in range(number):
+        packet = AsynCmSampleBufPacket.from_bytes(data)
+        packet.CMSampleBuf.SampleTimingInfoArray[0]
+        packets.append(packet)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / number, peak / number
+
+
+def measure_all(number=1000):
+    for name, offset in FIXTURES:
+        with open(f'./fixtures/{name}', "rb") as f:
+            data = f.read()[offset:]
+        current, peak = measure(data, number)
+        print(f'  {name:<18} retained {current:8.0f} bytes/frame  peak {peak:8.0f} bytes/frame')
+
+
+def run(path, label):
+    print(f'{label}:', flush=True)
+    env = dict(os.environ, PYTHONPATH=path)
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--measure'], env=env, check=True)
+
+
+def main(revisions):
+    for revision in revisions:
+        with tempfile.TemporaryDirectory() as path:
+            archive = subprocess.run(['git', '-C', ROOT, 'archive', revision, 'ioscreen'], check=True,
+                                     stdout=subprocess.PIPE).stdout
+            subprocess.run(['tar', '-x', '-C', path], input=archive, check=True)
+            run(path, revision)
+    run(ROOT, 'working tree')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--measure']:
+        measure_all()
+    else:
+        parser = argparse.ArgumentParser(description='bytes retained per parsed frame')
+        parser.add_argument('revisions', nargs='+', help='git revisions to compare with the working tree')
+        main(parser.parse_args().revisions)
@@ -0,0 +1,169 @@
+"""
+CMSampleBuffer 解析性能对比，在 test_case 目录下运行:
+python benchmark_sample_buffer.py
+
+legacy 为 baseline 中的 from_bytes/parse_stia/parse_samples_list/parse_length_magic 及 ctypes CMTime 原样拷贝,
+输入为 bytes, 每个原子都切片拷贝剩余数据; fdsc/satt/sary 的解析使用当前实现 (比 baseline 快, 对比结果偏保守)
+current 为当前 from_bytes, current+decode 额外访问 FormatDescription/Attachments/CreateIfNecessary
+"""
+import struct
+import timeit
+from ctypes import Structure, c_uint32, c_uint64
+
+from ioscreen.coremedia.CMFormatDescription import DescriptorConst, FormatDescriptor
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer, CMSampleConst
+from ioscreen.coremedia.CMTime import CMTimeConst
+from ioscreen.coremedia.serialize import new_dictionary_from_bytes, DictConst
+
+FIXTURES = [
+    ('asyn-feed', 20, CMSampleBuffer.from_bytesVideo, DescriptorConst.MediaTypeVideo),
+    ('asyn-feed-nofdsc', 16, CMSampleBuffer.from_bytesVideo, DescriptorConst.MediaTypeVideo),
+    ('asyn-eat', 16, CMSampleBuffer.from_bytesAudio, DescriptorConst.MediaTypeSound),
+]
+
+
+# ------------------- baseline 实现 ——————————————————————
+
+class CMTime(Structure):
+    _fields_ = [
+        ('CMTimeValue', c_uint64),
+        ('CMTimeScale', c_uint32),
+        ('CMTimeFlags', c_uint32),
+        ('CMTimeEpoch', c_uint64),
+    ]
+
+
+class SampleTimingInfo:
+    def __init__(self, Duration, PresentationTimeStamp, DecodeTimeStamp):
+        self.Duration = Duration  # 创建时间
+        self.PresentationTimeStamp = PresentationTimeStamp  # 提交时间
+        self.DecodeTimeStamp = DecodeTimeStamp  # 解码时间
+
+
+class LegacySampleBuffer:
+    def __init__(self, OutputPresentationTimestamp=None, FormatDescription=None, HasFormatDescription=None,
+                 NumSamples=None, SampleTimingInfoArray=None, SampleData=None, SampleSizes=None, Attachments=None,
+                 CreateIfNecessary=None, MediaType=None):
+        self.OutputPresentationTimestamp: CMTime = OutputPresentationTimestamp
+        self.FormatDescription: FormatDescriptor = FormatDescription
+        self.HasFormatDescription = HasFormatDescription
+        self.NumSamples = NumSamples
+        self.SampleTimingInfoArray = SampleTimingInfoArray
+        self.SampleData = SampleData
+        self.SampleSizes = SampleSizes
+        self.Attachments = Attachments
+        self.CreateIfNecessary = CreateIfNecessary
+        self.MediaType = MediaType
+
+    @classmethod
+    def from_bytes(self, buffer, mediaType):
+        sampleBuffer = LegacySampleBuffer()
+        sampleBuffer.MediaType = mediaType
+        sampleBuffer.HasFormatDescription = False
+        length, remainingBytes = parse_length_magic(buffer, CMSampleConst.sbuf)
+        if length > len(buffer):
+            raise Exception("CMSampleBuffer >> from_bytes length error")
+
+        while len(remainingBytes) > 0:
+            code = struct.unpack('<I', remainingBytes[4:8])[0]
+            if code == CMSampleConst.opts:
+                sampleBuffer.OutputPresentationTimestamp = CMTime.from_buffer_copy(remainingBytes[8:])
+                remainingBytes = remainingBytes[32:]
+
+            elif code == CMSampleConst.stia:
+                sampleBuffer.SampleTimingInfoArray, remainingBytes = parse_stia(remainingBytes)
+
+            elif code == CMSampleConst.sdat:
+                length, remainingBytes = parse_length_magic(remainingBytes, CMSampleConst.sdat)
+                sampleBuffer.SampleData = remainingBytes[:length - 8]
+                remainingBytes = remainingBytes[length - 8:]
+
+            elif code == CMSampleConst.nsmp:
+                length, remainingBytes = parse_length_magic(remainingBytes, CMSampleConst.nsmp)
+                sampleBuffer.NumSamples = struct.unpack('<I', remainingBytes[:4])[0]
+                remainingBytes = remainingBytes[4:]
+
+            elif code == CMSampleConst.ssiz:
+                sampleBuffer.SampleSizes, remainingBytes = parse_samples_list(remainingBytes)
+
+            elif code == DescriptorConst.FormatDescriptorMagic:
+                sampleBuffer.HasFormatDescription = True
+                fdscLength = struct.unpack('<I', remainingBytes[:4])[0]
+                sampleBuffer.FormatDescription = FormatDescriptor.from_bytes(remainingBytes[:fdscLength])
+                remainingBytes = remainingBytes[fdscLength:]
+
+            elif code == CMSampleConst.satt:
+                attachmentsLength = struct.unpack('<I', remainingBytes[:4])[0]
+                sampleBuffer.Attachments = new_dictionary_from_bytes(remainingBytes[:attachmentsLength],
+                                                                     CMSampleConst.satt)
+                remainingBytes = remainingBytes[attachmentsLength:]
+
+            elif code == CMSampleConst.sary:
+                saryLength = struct.unpack('<I', remainingBytes[:4])[0]
+                sampleBuffer.CreateIfNecessary = new_dictionary_from_bytes(remainingBytes[8:saryLength],
+                                                                           DictConst.DictionaryMagic)
+                remainingBytes = remainingBytes[saryLength:]
+            else:
+                unknownMagic = str(remainingBytes[4:8])
+                raise Exception(f"unknown magic type {unknownMagic}, cannot parse value {remainingBytes[4:8]}")
+        return sampleBuffer
+
+
+def parse_length_magic(buf, exptectMagic):
+    _length = struct.unpack('<I', buf[:4])[0]
+    magic = struct.unpack('<I', buf[4:8])[0]
+    if int(_length) > len(buf):
+        raise Exception()
+    if magic != exptectMagic:
+        raise Exception()
+    return int(_length), buf[8:]
+
+
+def parse_stia(data):
+    stiaLength, _, = parse_length_magic(data, CMSampleConst.stia)
+    stiaLength -= 8
+    numEntries, modulus = stiaLength / CMSampleConst.cmSampleTimingInfoLength, stiaLength % CMSampleConst.cmSampleTimingInfoLength
+    result = []
+    data = data[8:]
+    for i in range(int(numEntries)):
+        index = i * CMSampleConst.cmSampleTimingInfoLength
+        duration = CMTime.from_buffer_copy(data[index:])
+        presentationTimeStamp = CMTime.from_buffer_copy(data[CMTimeConst.CMTimeLengthInBytes + index:])
+        decodeTimeStamp = CMTime.from_buffer_copy(data[2 * CMTimeConst.CMTimeLengthInBytes + index:])
+        result.append(SampleTimingInfo(duration, presentationTimeStamp, decodeTimeStamp))
+    return result, data[stiaLength:]
+
+
+def parse_samples_list(data):
+    ssizLength, _, = parse_length_magic(data, CMSampleConst.ssiz)
+    ssizLength -= 8
+    numEntries, modulus = ssizLength / 4, ssizLength % 4
+    result = []
+    data = data[8:]
+    for i in range(int(numEntries)):
+        index = 4 * i
+        result.append(int(struct.unpack('<I', data[index + i * 4:index + i * 4 + 4])[0]))
+    return result, data[ssizLength:]
+
+
+# ------------------- 对比 ——————————————————————
+
+def decode_all(parse, data):
+    sampleBuffer = parse(data)
+    sampleBuffer.FormatDescription, sampleBuffer.Attachments, sampleBuffer.CreateIfNecessary
+
+
+def main(number=2000):
+    for name, offset, parse, mediaType in FIXTURES:
+        with open(f'./fixtures/{name}', "rb") as f:
+            data = f.read()[offset:]
+        legacy = timeit.timeit(lambda: LegacySampleBuffer.from_bytes(data, mediaType), number=number) / number
+        current = timeit.timeit(lambda: parse(data), number=number) / number
+        decoded = timeit.timeit(lambda: decode_all(parse, data), number=number) / number
+        print(f'{name:<18} {len(data):>7} bytes  legacy {legacy * 1e6:8.2f}us  '
+              f'current {current * 1e6:8.2f}us x{legacy / current:.1f}  '
+              f'current+decode {decoded * 1e6:8.2f}us x{legacy / decoded:.1f}')
+
+
+if __name__ == '__main__':
+    main()
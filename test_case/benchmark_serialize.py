@@ -0,0 +1,63 @@
+"""
+SerializeStringKeyDict 序列化性能对比, 在 test_case 目录下运行:
+python benchmark_serialize.py
+"""
+import struct
+import timeit
+
+from ioscreen.asyn import create_hpa1_device, create_hpd1_device
+from ioscreen.coremedia.common import NSNumber
+from ioscreen.coremedia.serialize import SerializeStringKeyDict, DictConst
+
+
+def concat_serialize(data):
+    """ 旧实现: 每个字段都 bytes += 拼接
+    """
+    buf = b''
+    index = 0
+    for key, value in data.items():
+        key_buf = struct.pack('<I', len(key) + 8) + struct.pack('<I', DictConst.StringKey) + bytes(key, 'utf8')
+        if isinstance(value, bool):
+            value_buf = struct.pack('<I', 9) + struct.pack('<I', DictConst.BooleanValueMagic) + struct.pack('?', value)
+        elif isinstance(value, NSNumber):
+            numberBytes = value.to_bytes()
+            value_buf = struct.pack('<I', len(numberBytes) + 8) + struct.pack('<I', DictConst.NumberValueMagic)
+            value_buf += numberBytes
+        elif isinstance(value, str):
+            value_buf = struct.pack('<I', len(value) + 8) + struct.pack('<I', DictConst.StringValueMagic)
+            value_buf += bytes(value, 'utf8')
+        elif isinstance(value, (bytes, bytearray)):
+            value_buf = struct.pack('<I', len(value) + 8) + struct.pack('<I', DictConst.DataValueMagic) + bytes(value)
+        else:
+            value_buf = concat_serialize(value)
+        buf += struct.pack('<I', len(key_buf) + len(value_buf) + 8)
+        buf += struct.pack('<I', DictConst.KeyValuePairMagic)
+        buf += key_buf
+        buf += value_buf
+        index += 8 + len(key_buf) + len(value_buf)
+    return struct.pack('<I', index + 8) + struct.pack('<I', DictConst.DictionaryMagic) + buf
+
+
+def nested(depth, width):
+    data = {f'key{i}': NSNumber(6, float(i)) for i in range(width)}
+    for i in range(depth):
+        data = {f'level{i}': data, 'name': 'Valeria', 'flag': True}
+    return data
+
+
+def main(number=2000):
+    cases = [
+        ('hpd1', create_hpd1_device()),
+        ('hpa1', create_hpa1_device()),
+        ('flat 1000', nested(0, 1000)),
+        ('nested 8x50', nested(8, 50)),
+    ]
+    for name, data in cases:
+        assert concat_serialize(data) == SerializeStringKeyDict(data).to_bytes()
+        legacy = timeit.timeit(lambda: concat_serialize(data), number=number) / number
+        current = timeit.timeit(lambda: SerializeStringKeyDict(data).to_bytes(), number=number) / number
+        print(f'{name:<12} bytes += {legacy * 1e6:8.2f}us  pack_into {current * 1e6:8.2f}us  x{legacy / current:.1f}')
+
+
+if __name__ == '__main__':
+    main()
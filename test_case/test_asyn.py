@@ -1,3 +1,5 @@
+import struct
+
 from ioscreen.asyn import *
 
 
@@ -48,3 +50,33 @@ def test_tjmp():
         BufPacket = AsynTjmpPacket.from_bytes(data)
         print(BufPacket)
 
+
+
+def test_build_packets():
+    with open('./fixtures/asyn-hpd1', "rb") as f:
+        assert f.read() == new_asyn_dict_packet(create_hpd1_device(), AyncConst.HPD1, 1)
+    with open('./fixtures/asyn-hpa1', "rb") as f:
+        data = f.read()
+        clockRef = struct.unpack_from('<Q', data, 8)[0]
+        assert data == new_asyn_dict_packet(create_hpa1_device(), AyncConst.HPA1, clockRef)
+    with open('./fixtures/asyn-need', "rb") as f:
+        data = f.read()
+        assert data == asyn_need_packet_bytes(struct.unpack_from('<Q', data, 8)[0])
+    with open('./fixtures/asyn-hpa0', "rb") as f:
+        data = f.read()
+        assert data == asyn_hpa0(struct.unpack_from('<Q', data, 8)[0])
+    with open('./fixtures/asyn-hpd0', "rb") as f:
+        assert f.read() == asyn_hpd0()
+
+
+def test_packet_template():
+    with open('./fixtures/asyn-hpa1', "rb") as f:
+        data = f.read()
+    clockRef = struct.unpack_from('<Q', data, 8)[0]
+    template = new_asyn_dict_template(create_hpa1_device(), AyncConst.HPA1)
+    first = template.render(clockRef=clockRef)
+    assert data == first
+    second = template.render(clockRef=1)
+    assert data == first
+    assert 1 == struct.unpack_from('<Q', second, 8)[0]
+    assert asyn_hpd0() is asyn_hpd0()
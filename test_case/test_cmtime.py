@@ -0,0 +1,72 @@
+from ioscreen.coremedia.CMclock import calculate_skew
+from ioscreen.coremedia.CMTime import CMTime, CMTimeConst, CMTimeRoundingMethod, rescale_values
+
+
+def test_round_trip():
+    with open('./fixtures/time-reply1', "rb") as f:
+        data = f.read()
+    _time = CMTime.from_buffer_copy(data, 20)
+    assert 0x0000BA62C442E1E1 == _time.CMTimeValue
+    assert 0x3B9ACA00 == _time.CMTimeScale
+    assert data[20:44] == bytes(_time)
+
+
+def test_rescale():
+    _time = CMTime(CMTimeValue=1001, CMTimeScale=30000)
+    assert 3003 == _time.to_90khz()
+    assert CMTime(2, 3).rescale(1).CMTimeValue == 1
+    assert CMTime(2, 3).rescale(1, CMTimeRoundingMethod.RoundTowardZero).CMTimeValue == 0
+    assert CMTime(-2, 3).rescale(1, CMTimeRoundingMethod.RoundTowardNegativeInfinity).CMTimeValue == -1
+    assert CMTime(1, 2).rescale(1).CMTimeFlags & CMTimeConst.KCMTimeFlagsHasBeenRounded
+    assert not CMTime(1, 2).rescale(4).CMTimeFlags & CMTimeConst.KCMTimeFlagsHasBeenRounded
+    # 2^53 以上的纳秒时间戳不能有精度损失
+    big = CMTime(2 ** 53 + 1, 1000000000)
+    assert 2 ** 53 + 1 == big.to_nanoseconds()
+    assert [0, 3003, 1] == list(rescale_values([0, 1001, 1], [30000, 30000, 90000], 90000))
+
+
+def test_arithmetic():
+    a = CMTime(1, 2)
+    b = CMTime(1, 3)
+    assert CMTime(5, 6) == a + b
+    assert CMTime(1, 6) == a - b
+    assert b < a
+    assert CMTime(2, 4) == a
+    assert hash(CMTime(2, 4)) == hash(a)
+
+
+def test_calculate_skew():
+    start1 = CMTime(0, 1000000000)
+    end1 = CMTime(2 ** 60, 1000000000)
+    start2 = CMTime(0, 48000)
+    end2 = CMTime(2 ** 60 * 48 // 1000000 + 1, 48000)
+    skew = calculate_skew(start1, end1, start2, end2)
+    assert skew == 48000 * 48000 * 2 ** 60 / (1000000000 * end2.CMTimeValue)
+    assert 47999.0 < skew <= 48000.0
+
+
+def test_invalid_time():
+    invalid = CMTime()
+    assert not invalid.is_valid()
+    assert 0 == invalid.to_90khz()
+    assert 0 == invalid.to_nanoseconds()
+    assert 0 == invalid.seconds()
+    assert 0.0 == invalid.get_time_scale(CMTime(0, 90000))
+    assert not invalid.rescale(90000).is_valid()
+    assert not (CMTime(1, 2) + invalid).is_valid()
+    assert [0, 3003] == list(rescale_values([5, 1001], [0, 30000], 90000))
+
+
+def test_invalid_time_compare():
+    invalid = CMTime()
+    zero = CMTime(0, 600)
+    assert invalid != zero
+    assert invalid == CMTime(5, 0)
+    assert hash(invalid) == hash(CMTime(5, 0))
+    assert zero < invalid
+    assert 2 == len({invalid, CMTime(5, 0), zero, CMTime(0, 1)})
+    # 与无效时间加减的结果无效, 不会丢掉另一个值
+    assert not (CMTime(1, 2) + invalid).is_valid()
+    assert not (invalid + CMTime(1, 2)).is_valid()
+    assert not (CMTime(1, 2) - invalid).is_valid()
+    assert not (invalid - CMTime(1, 2)).is_valid()
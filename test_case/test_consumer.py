@@ -0,0 +1,114 @@
+import threading
+
+from ioscreen.coremedia.CMFormatDescription import DescriptorConst
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.coremedia.consumer import AVFileWriter, BufferedConsumer, Consumer, DropPolicy
+from ioscreen.coremedia.nalu import parameter_sets_annexb
+
+idrNalu = b'\x00\x00\x00\x01\x65'
+pNalu = b'\x00\x00\x00\x01\x41'
+
+
+class SlowConsumer(Consumer):
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.consumed = []
+        self.stopped = False
+
+    def consume(self, data: CMSampleBuffer):
+        self.started.set()
+        self.release.wait(2)
+        self.consumed.append(data.SampleData)
+
+    def stop(self):
+        self.stopped = True
+
+
+def video(name, nalu):
+    return CMSampleBuffer(MediaType=DescriptorConst.MediaTypeVideo, SampleData=nalu + name)
+
+
+def test_buffered_consumer_drop_non_idr():
+    slow = SlowConsumer()
+    consumer = BufferedConsumer(slow, maxSize=2, policy=DropPolicy.DropNonIdr)
+    consumer.consume(video(b'first', idrNalu))
+    assert slow.started.wait(2)
+    consumer.consume(video(b'p1', pNalu))
+    consumer.consume(video(b'p2', pNalu))
+    consumer.consume(video(b'p3', pNalu))
+    consumer.consume(CMSampleBuffer(MediaType=DescriptorConst.MediaTypeSound, SampleData=b'audio'))
+    consumer.consume(video(b'p4', pNalu))
+    consumer.consume(video(b'idr', idrNalu))
+    slow.release.set()
+    consumer.stop()
+    assert [idrNalu + b'first', b'audio', idrNalu + b'idr'] == slow.consumed
+    assert 4 == consumer.stats()['droppedVideo']
+    assert 0 == consumer.stats()['droppedAudio']
+    assert slow.stopped
+
+
+def test_buffered_consumer_drop_oldest():
+    slow = SlowConsumer()
+    consumer = BufferedConsumer(slow, maxSize=2, policy=DropPolicy.DropOldest)
+    consumer.consume(video(b'first', idrNalu))
+    assert slow.started.wait(2)
+    for name in (b'p1', b'p2', b'p3'):
+        consumer.consume(video(name, pNalu))
+    slow.release.set()
+    consumer.stop()
+    assert [idrNalu + b'first', pNalu + b'p2', pNalu + b'p3'] == slow.consumed
+    assert 1 == consumer.stats()['droppedVideo']
+
+
+def test_buffered_consumer_drop_non_idr_bounded():
+    slow = SlowConsumer()
+    consumer = BufferedConsumer(slow, maxSize=3, policy=DropPolicy.DropNonIdr)
+    consumer.consume(video(b'first', idrNalu))
+    assert slow.started.wait(2)
+    for i in range(10):
+        consumer.consume(CMSampleBuffer(MediaType=DescriptorConst.MediaTypeSound, SampleData=b'audio%d' % i))
+        assert consumer.qsize() <= consumer.maxSize
+    consumer.consume(video(b'idr', idrNalu))
+    assert consumer.qsize() <= consumer.maxSize
+    slow.release.set()
+    consumer.stop()
+    assert [idrNalu + b'first', b'audio8', b'audio9', idrNalu + b'idr'] == slow.consumed
+    assert 8 == consumer.stats()['droppedAudio']
+    assert 3 == consumer.stats()['maxQueueDepth']
+
+
+class GatedWriter(AVFileWriter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def consume(self, data: CMSampleBuffer):
+        self.started.set()
+        self.release.wait(2)
+        return super().consume(data)
+
+
+def test_drop_oldest_first_keyframe_keeps_parameter_sets(tmp_path):
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()
+    first = CMSampleBuffer.from_bytesVideo(data[20:])
+    second = CMSampleBuffer.from_bytesVideo(data[20:])
+    second.FormatChanged = False  # 只有第一个关键帧带 FormatChanged
+    h264Path = str(tmp_path / 'out.h264')
+    writer = GatedWriter(h264FilePath=h264Path, wavFilePath=str(tmp_path / 'out.wav'))
+    consumer = BufferedConsumer(writer, maxSize=1, policy=DropPolicy.DropOldest)
+    consumer.consume(CMSampleBuffer(MediaType=DescriptorConst.MediaTypeSound, SampleData=b'\x00' * 4))
+    assert writer.started.wait(2)
+    consumer.consume(first)
+    consumer.consume(video(b'p1', b'\x00\x00\x00\x03\x41'))  # 挤掉第一个关键帧
+    consumer.consume(second)
+    writer.release.set()
+    consumer.stop()
+    assert 2 == consumer.stats()['droppedVideo']
+    with open(h264Path, 'rb') as f:
+        output = f.read()
+    parameterSets = parameter_sets_annexb(second.FormatDescription)
+    assert output.startswith(parameterSets)
+    assert len(parameterSets) + len(second.SampleData) == len(output)
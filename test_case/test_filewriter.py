@@ -0,0 +1,57 @@
+import os
+
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.coremedia.consumer import AVFileWriter
+from ioscreen.coremedia.filewriter import AsyncFileWriter, FsyncPolicy
+
+
+def test_async_file_writer(tmp_path):
+    path = str(tmp_path / 'out.bin')
+    writer = AsyncFileWriter(path, bufferSize=16, fsync=FsyncPolicy.OnStop)
+    chunks = [bytes([i]) * 10 for i in range(20)]
+    for chunk in chunks:
+        writer.write(chunk)
+    writer.write(memoryview(b'tail'))
+    assert writer.flush(2)
+    stats = writer.stats()
+    assert 0 == stats['queueBytes']
+    assert 204 == stats['bytesWritten']
+    assert stats['maxQueueBytes'] <= 20
+    writer.close()
+    assert 1 == writer.stats()['fsyncCount']
+    with open(path, 'rb') as f:
+        assert b''.join(chunks) + b'tail' == f.read()
+
+
+def test_async_file_writer_error(tmp_path):
+    writer = AsyncFileWriter(str(tmp_path / 'out.bin'))
+    os.close(writer.fd)
+    writer.fd = os.open(str(tmp_path / 'out.bin'), os.O_RDONLY)
+    writer.write(b'data')
+    writer.flush(2)
+    for call in (lambda: writer.write(b'data'), writer.close):
+        try:
+            call()
+            assert False
+        except Exception as E:
+            assert 'failed' in str(E)
+
+
+def record(tmp_path, name, **kwargs):
+    h264, wav = str(tmp_path / f'{name}.h264'), str(tmp_path / f'{name}.wav')
+    writer = AVFileWriter(h264FilePath=h264, wavFilePath=wav, **kwargs)
+    with open('./fixtures/asyn-feed', "rb") as f:
+        video = CMSampleBuffer.from_bytesVideo(f.read()[20:])
+    with open('./fixtures/asyn-eat', "rb") as f:
+        audio = CMSampleBuffer.from_bytesAudio(f.read()[16:])
+    for _ in range(3):
+        writer.consume(video)
+        writer.consume(audio)
+    writer.stop()
+    with open(h264, 'rb') as f1, open(wav, 'rb') as f2:
+        return f1.read(), f2.read()
+
+
+def test_av_file_writer_async(tmp_path):
+    assert record(tmp_path, 'sync') == record(tmp_path, 'async', asyncWrite=True, fsync=FsyncPolicy.Interval,
+                                              fsyncInterval=0)
@@ -0,0 +1,42 @@
+import threading
+from time import monotonic
+
+from ioscreen.flow import NeedFlowControl
+
+
+def test_need_without_limit_is_immediate():
+    sent = []
+    flow = NeedFlowControl(lambda: sent.append(monotonic()))
+    flow.feed()
+    flow.feed()
+    flow.stop()
+    assert 2 == len(sent)
+
+
+def test_need_max_fps():
+    sent = []
+    done = threading.Event()
+
+    def send():
+        sent.append(monotonic())
+        done.set()
+
+    flow = NeedFlowControl(send, maxFps=20)
+    for _ in range(2):
+        done.clear()
+        flow.feed()
+        assert done.wait(1)
+    flow.stop()
+    assert sent[1] - sent[0] >= 0.05 - 0.005
+
+
+def test_need_backlog():
+    sent = threading.Event()
+    backlog = [5]
+    flow = NeedFlowControl(sent.set, maxBacklog=2, backlog=lambda: backlog[0])
+    flow.feed()
+    assert not sent.wait(0.05)
+    backlog[0] = 1
+    assert sent.wait(1)
+    flow.stop()
+    assert 1 == flow.throttledCount
@@ -0,0 +1,16 @@
+from ioscreen.iphone_models import iPhoneModels
+
+
+def test_display_size():
+    assert (2532, 1170) == iPhoneModels.get_display_size('iPhone14,5')
+    assert (1280, 592) == iPhoneModels.get_display_size('iPhone14,5', '720p')
+    assert (1334, 750) == iPhoneModels.get_display_size('iPhone12,8', '1080p')
+    assert (1280, 800) == iPhoneModels.get_display_size('iPhone99,1', '720p')
+    # 未命名的机型没有 screen, 同样按默认比例
+    assert (1280, 800) == iPhoneModels.get_display_size('iPhone14,1', '720p')
+
+
+def test_named_models_have_screen():
+    for key, info in iPhoneModels.MODELS.items():
+        if not info['model'].startswith('Unnamed'):
+            assert iPhoneModels.get_screen(key), key
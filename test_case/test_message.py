@@ -0,0 +1,127 @@
+import logging
+import struct
+
+from ioscreen.asyn import AyncConst
+from ioscreen.coremedia.CMclock import CMClock
+from ioscreen.coremedia.CMTime import CMTime
+from ioscreen.coremedia.CMFormatDescription import DescriptorConst
+from ioscreen.coremedia.consumer import Consumer
+from ioscreen.handler import PacketHandler, DebugLogHandler
+from ioscreen.meaasge import MessageProcessor, MediaMode
+
+
+class FakeDevice:
+    def __init__(self):
+        self.written = []
+
+    def write(self, endpoint, data, timeout):
+        self.written.append(bytes(data))
+
+
+def async_types(written):
+    return [struct.unpack('<I', data[16:20])[0] for data in written
+            if struct.unpack('<I', data[4:8])[0] == AyncConst.AsyncPacketMagic]
+
+
+def handshake(mediaMode):
+    device = FakeDevice()
+    message = MessageProcessor(device, inEndpoint=1, outEndpoint=2, stopSignal=None, cmSampleBufConsumer=Consumer(),
+                               mediaMode=mediaMode)
+    with open('./fixtures/cwpa-request1', "rb") as f:
+        message.receive_data(f.read()[4:])
+    assert message.usbWriter.flush(2)
+    message.usbWriter.stop()
+    message.needFlow.stop()
+    return async_types(device.written)
+
+
+def test_cwpa_media_mode():
+    assert [AyncConst.HPD1, AyncConst.HPD1, AyncConst.HPA1] == handshake(MediaMode.AudioVideo)
+    assert [AyncConst.HPD1, AyncConst.HPD1] == handshake(MediaMode.VideoOnly)
+    assert [AyncConst.HPA1] == handshake(MediaMode.AudioOnly)
+
+
+class RecordingConsumer(Consumer):
+    def __init__(self):
+        self.buffers = []
+
+    def consume(self, data):
+        self.buffers.append(data)
+
+
+def new_processor(consumer=None):
+    message = MessageProcessor(FakeDevice(), inEndpoint=1, outEndpoint=2, stopSignal=None,
+                               cmSampleBufConsumer=consumer or Consumer())
+    message.usbWriter.stop()
+    message.needFlow.stop()
+    return message
+
+
+def test_dispatch_registry():
+    consumer = RecordingConsumer()
+    message = new_processor(consumer)
+    message.needMessage = b'need'
+    observed = []
+    message.add_observer(AyncConst.AsyncPacketMagic, AyncConst.FEED, lambda buffer: observed.append(len(buffer)))
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()[4:]
+    message.receive_data(data)
+    assert 1 == len(consumer.buffers)
+    assert [len(data)] == observed
+
+    handled = []
+
+    class TjmpHandler(PacketHandler):
+        def handle(self, processor, buffer):
+            handled.append(processor)
+
+    message.register_handler(AyncConst.AsyncPacketMagic, AyncConst.TJMP, TjmpHandler())
+    with open('./fixtures/asyn-tjmp', "rb") as f:
+        message.receive_data(f.read())
+    assert [message] == handled
+
+
+def test_debug_only_handler_skips_decoding():
+    decoded = []
+
+    class Packet:
+        @classmethod
+        def from_bytes(cls, buffer):
+            decoded.append(buffer)
+            return 'packet'
+
+    handler = DebugLogHandler(Packet)
+    logger = logging.getLogger("ioscreen")
+    level = logger.level
+    try:
+        logger.setLevel(logging.INFO)
+        handler.handle(None, b'')
+        assert [] == decoded
+        logger.setLevel(logging.DEBUG)
+        handler.handle(None, b'')
+        assert [b''] == decoded
+    finally:
+        logger.setLevel(level)
+
+
+def test_consumer_interest():
+    class VideoConsumer(RecordingConsumer):
+        mediaTypes = frozenset((DescriptorConst.MediaTypeVideo,))
+        fields = frozenset(('SampleData',))
+
+    consumer = VideoConsumer()
+    message = new_processor(consumer)
+    message.localAudioClock = CMClock.new(1)
+    with open('./fixtures/asyn-eat', "rb") as f:
+        message.receive_data(f.read())
+    assert [] == consumer.buffers
+    assert message.firstAudioTimeTaken
+    assert CMTime(2056, 48000, 1) == message.startTimeDeviceAudioClock
+
+    message.needMessage = b'need'
+    with open('./fixtures/asyn-feed', "rb") as f:
+        message.receive_data(f.read()[4:])
+    assert 1 == len(consumer.buffers)
+    assert consumer.buffers[0].SampleTimingInfoArray is None
+    assert consumer.buffers[0].SampleSizes is None
+    assert 90750 == len(consumer.buffers[0].SampleData)
@@ -0,0 +1,104 @@
+import struct
+
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer, SampleTimingTable
+from ioscreen.coremedia.CMTime import CMTime
+from ioscreen.coremedia.mp4 import Mp4Writer, SyncSampleFlags
+from ioscreen.coremedia.nalu import classify_parameter_sets
+
+
+def walk(buf, offset=0, end=None):
+    """ [(type, start, payload)] """
+    end = len(buf) if end is None else end
+    boxes = []
+    while offset < end:
+        size, boxType = struct.unpack_from('>I4s', buf, offset)
+        boxes.append((boxType, offset, buf[offset + 8:offset + size]))
+        offset += size
+    assert offset == end
+    return boxes
+
+
+def child(payload, *path):
+    for boxType in path:
+        payload = dict((t, p) for t, _, p in walk(payload))[boxType]
+    return payload
+
+
+def video_frame(index):
+    with open('./fixtures/asyn-feed', "rb") as f:
+        sbuf = CMSampleBuffer.from_bytesVideo(f.read()[20:])
+    table: SampleTimingTable = sbuf.SampleTimingInfoArray
+    table.Values[SampleTimingTable.PresentationTimeStamp] += index * 1000000000 // 60
+    return sbuf
+
+
+def audio_frame():
+    with open('./fixtures/asyn-eat', "rb") as f:
+        return CMSampleBuffer.from_bytesAudio(f.read()[16:])
+
+
+def test_mp4_writer(tmp_path):
+    path = str(tmp_path / 'out.mp4')
+    writer = Mp4Writer(path, fragmentDuration=0.02)
+    writer.consume(audio_frame())  # moov 之前的音频被丢弃
+    frames = [video_frame(i) for i in range(3)]
+    for frame in frames:
+        writer.consume(frame)
+        writer.consume(audio_frame())
+    writer.stop()
+    assert 1 == writer.droppedSamples
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    boxes = walk(data)
+    assert [b'ftyp', b'moov', b'moof', b'mdat', b'moof', b'mdat'] == [box[0] for box in boxes]
+
+    moov = boxes[1][2]
+    traks = [p for t, _, p in walk(moov) if t == b'trak']
+    assert 2 == len(traks)
+    stsd = child(traks[0], b'mdia', b'minf', b'stbl', b'stsd')
+    avc1 = walk(stsd, 8)[0]
+    assert b'avc1' == avc1[0]
+    assert (1126, 2436) == struct.unpack_from('>HH', avc1[2], 24)
+    avcC = walk(avc1[2], 78)[0][2]
+    sps, pps = classify_parameter_sets(frames[0].FormatDescription)
+    assert sps == avcC[8:8 + len(sps)]
+    assert b'sowt' == walk(child(traks[1], b'mdia', b'minf', b'stbl', b'stsd'), 8)[0][0]
+
+    # 第一个分片: 两帧视频 (第三帧是关键帧时切分) 和两段音频
+    moofStart = boxes[2][1]
+    videoTraf, firstAudioTraf = [p for t, _, p in walk(boxes[2][2]) if t == b'traf']
+    videoTrun = child(videoTraf, b'trun')
+    count, dataOffset = struct.unpack_from('>Ii', videoTrun, 4)
+    assert 2 == count
+    duration, size, flags, _ = struct.unpack_from('>IIIi', videoTrun, 12)
+    assert (1500, len(frames[0].SampleData), SyncSampleFlags) == (duration, size, flags)
+    assert bytes(frames[0].SampleData) == data[moofStart + dataOffset:moofStart + dataOffset + size]
+    audioCount, audioOffset = struct.unpack_from('>Ii', child(firstAudioTraf, b'trun'), 4)
+    assert 2048 == audioCount
+    assert dataOffset + 2 * len(frames[0].SampleData) == audioOffset
+    assert boxes[3][1] + len(boxes[3][2]) + 8 == moofStart + audioOffset + 2048 * 4
+
+    # 第二个分片的 tfdt 接在第一个分片之后
+    videoTraf, audioTraf = [p for t, _, p in walk(boxes[4][2]) if t == b'traf']
+    assert 3000 == struct.unpack_from('>Q', child(videoTraf, b'tfdt'), 4)[0]
+    audioStart = struct.unpack_from('>Q', child(firstAudioTraf, b'tfdt'), 4)[0]
+    assert audioStart + 2048 == struct.unpack_from('>Q', child(audioTraf, b'tfdt'), 4)[0]
+
+
+def test_mp4_writer_invalid_timestamp(tmp_path):
+    path = str(tmp_path / 'out.mp4')
+    writer = Mp4Writer(path, audio=False)
+    frames = [video_frame(i) for i in range(3)]
+    for i, frame in enumerate(frames):
+        frame.SampleTimingInfoArray = None
+        frame.OutputPresentationTimestamp = CMTime(i * 1500, 90000) if i != 1 else CMTime()
+        writer.consume(frame)
+    writer.stop()
+    with open(path, 'rb') as f:
+        boxes = walk(f.read())
+    trun = child(boxes[2][2], b'traf', b'trun')
+    assert 3 == struct.unpack_from('>I', trun, 4)[0]
+    # 无效时间戳的帧按默认时长估算
+    durations = [struct.unpack_from('>I', trun, 12 + 16 * i)[0] for i in range(3)]
+    assert [1500, 1500, 1500] == durations
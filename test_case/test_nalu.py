@@ -0,0 +1,49 @@
+import struct
+
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.coremedia.nalu import iter_nalus, contains_idr, avcc_to_annexb, to_annexb, startCode, NaluType, \
+    get_nalu_details
+
+
+def avcc(*nalus):
+    return b''.join(struct.pack('>I', len(nalu)) + nalu for nalu in nalus)
+
+
+def test_iter_nalus():
+    data = avcc(b'\x09\xf0', b'\x65\x88\x84', b'\x41\x9a')
+    nalus = list(iter_nalus(data))
+    assert [NaluType.AUD, NaluType.Idr, NaluType.NonIdr] == [nalu.type for nalu in nalus]
+    assert [False, True, False] == [nalu.isIdr for nalu in nalus]
+    assert b'\x65\x88\x84' == nalus[1].data.tobytes()
+    assert 6 == nalus[1].offset
+    assert '[len:2,type：9][len:3,type：5][len:2,type：1]' == get_nalu_details(data)
+    assert contains_idr(data)
+    assert not contains_idr(avcc(b'\x41\x9a'))
+
+
+def test_avcc_to_annexb():
+    data = avcc(b'\x67\x42', b'\x65\x88\x84')
+    annexb = startCode + b'\x67\x42' + startCode + b'\x65\x88\x84'
+    assert annexb == to_annexb(data)
+    assert data == avcc(b'\x67\x42', b'\x65\x88\x84')
+    assert b'prefix' + annexb == to_annexb(data, b'prefix')
+    buf = bytearray(data)
+    assert buf is avcc_to_annexb(buf)
+    assert annexb == buf
+
+
+def test_feed_nalus():
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()
+    sbuf = CMSampleBuffer.from_bytesVideo(data[20:])
+    nalus = list(iter_nalus(sbuf.SampleData))
+    assert len(sbuf.SampleData) == sum(len(nalu) + 4 for nalu in nalus)
+    annexb = to_annexb(sbuf.SampleData)
+    assert [nalu.data.tobytes() for nalu in nalus] == bytes(annexb).split(startCode)[1:]
+
+
+def test_contains_idr_truncated():
+    # 长度超出 buffer 时不会越过末尾继续读取
+    assert not contains_idr(b'\x00\x00\x00\x10\x41\x00\x00\x00\x01\x65')
+    assert contains_idr(b'\x00\x00\x00\x01\x41\x00\x00\x00\x01\x65')
+    assert not contains_idr(b'\x00\x00\x00\x01')
@@ -0,0 +1,80 @@
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.coremedia.consumer import Consumer
+from ioscreen.coremedia.nalu import startCode
+from ioscreen.coremedia.replay import ReplayBuffer
+
+
+def idr_frame():
+    with open('./fixtures/asyn-feed', "rb") as f:
+        return CMSampleBuffer.from_bytesVideo(f.read()[20:])
+
+
+def p_frame():
+    with open('./fixtures/asyn-feed-nofdsc', "rb") as f:
+        return CMSampleBuffer.from_bytesVideo(f.read()[16:])
+
+
+def audio_frame():
+    with open('./fixtures/asyn-eat-nofdsc', "rb") as f:
+        return CMSampleBuffer.from_bytesAudio(f.read()[16:])
+
+
+class RecordingConsumer(Consumer):
+    def __init__(self):
+        self.buffers = []
+        self.stopped = False
+
+    def consume(self, data):
+        self.buffers.append(data)
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_replay_gop_eviction():
+    replay = ReplayBuffer(maxBytes=350000)
+    replay.consume(p_frame())  # 第一个 IDR 之前的数据被丢弃
+    replay.consume(audio_frame())
+    assert 0 == replay.size
+    for _ in range(3):
+        replay.consume(idr_frame())
+        replay.consume(p_frame())
+        replay.consume(audio_frame())
+    assert 1 == replay.evictedGops
+    assert 2 * (90750 + 56604 + 4096) == replay.size
+
+    # 淘汰后的第一个 IDR 本身不带 fdsc 时, 导出时补上 GOP 开始时的 FormatDescription
+    frame = idr_frame()
+    frame.HasFormatDescription = False
+    frame.FormatDescription = None
+    frame.FormatChanged = False
+    replay.maxBytes = 100000
+    replay.consume(frame)
+    replay.consume(audio_frame())
+    assert 3 == replay.evictedGops
+    assert 1 == len(replay._gops)
+    samples = replay.snapshot()
+    assert samples[0] is not replay._gops[0].samples[0]
+    assert samples[0].FormatChanged and samples[0].FormatDescription is not None
+    assert not replay._gops[0].samples[0].FormatChanged
+
+    consumer = RecordingConsumer()
+    replay.dump(consumer, wait=True)
+    assert consumer.stopped
+    assert len(samples) == len(consumer.buffers)
+    replay.consume(idr_frame())
+    assert len(samples) == len(consumer.buffers)
+
+
+def test_replay_dump_files(tmp_path):
+    replay = ReplayBuffer(maxSeconds=30)
+    frame = idr_frame()
+    sps = bytes(frame.FormatDescription.PPS)
+    replay.consume(frame)
+    replay.consume(p_frame())
+    h264, wav = str(tmp_path / 'replay.h264'), str(tmp_path / 'replay.wav')
+    replay.dump_files(h264, wav, wait=True)
+    with open(h264, 'rb') as f:
+        data = f.read()
+    assert data.startswith(startCode + sps)
+    assert 90750 + 56604 + len(sps) + 4 + len(frame.FormatDescription.SPS) + 4 == len(data)
@@ -0,0 +1,97 @@
+import socket
+import struct
+
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.coremedia.consumer import SocketUDP
+from ioscreen.coremedia.nalu import iter_nalus, classify_parameter_sets
+from ioscreen.coremedia.rtp import RtpPacketizer, RtpSender, StapA, FuA
+
+
+def depacketize(packets):
+    """ :return: (nalus, markers, sequenceNumbers) """
+    nalus, markers, sequenceNumbers = [], [], []
+    fragment = None
+    for packet in packets:
+        _, markerType, sequenceNumber, _, _ = struct.unpack_from('>BBHII', packet)
+        markers.append(markerType >> 7)
+        sequenceNumbers.append(sequenceNumber)
+        payload = packet[12:]
+        nalType = payload[0] & 0x1f
+        if nalType == StapA:
+            index = 1
+            while index < len(payload):
+                size = struct.unpack_from('>H', payload, index)[0]
+                nalus.append(payload[index + 2:index + 2 + size])
+                index += 2 + size
+        elif nalType == FuA:
+            if payload[1] & 0x80:
+                fragment = bytes((payload[0] & 0xE0 | payload[1] & 0x1f,))
+            fragment += payload[2:]
+            if payload[1] & 0x40:
+                nalus.append(fragment)
+        else:
+            nalus.append(payload)
+    return nalus, markers, sequenceNumbers
+
+
+def test_packetize():
+    packetizer = RtpPacketizer(mtu=100, ssrc=1)
+    nalus = [b'\x67' + bytes(10), b'\x68' + bytes(4), b'\x06' + bytes(5), b'\x65' + bytes(range(250)), b'\x41' * 80]
+    packets = packetizer.packetize(nalus, 3000)
+    assert all(len(packet) <= 100 for packet in packets)
+    assert StapA == packets[0][12] & 0x1f
+    assert 0x60 == packets[0][12] & 0x60
+    assert FuA == packets[1][12] & 0x1f
+    assert 0x80 == packets[1][13] & 0xC0
+    result, markers, sequenceNumbers = depacketize(packets)
+    assert nalus == result
+    assert [0] * (len(packets) - 1) + [1] == markers
+    assert [(sequenceNumbers[0] + i) & 0xFFFF for i in range(len(packets))] == sequenceNumbers
+    timestamps = {struct.unpack_from('>I', packet, 4)[0] for packet in packets}
+    assert {(3000 + packetizer.timestampOffset) & 0xFFFFFFFF} == timestamps
+
+
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(2)
+    return sock
+
+
+def test_rtp_sender():
+    for useSendmmsg in (True, False):
+        sock = receiver()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.connect(sock.getsockname())
+        rtpSender = RtpSender(sender, useSendmmsg)
+        packets = [bytes([i]) * (100 + i) for i in range(50)]
+        rtpSender.send(packets)
+        assert packets == [sock.recv(2048) for _ in packets]
+        assert 50 == rtpSender.packetsSent
+        if rtpSender.batched:
+            assert 1 == rtpSender.sendCalls
+        sender.close()
+        sock.close()
+
+
+def test_socket_udp_rtp(tmp_path):
+    with open('./fixtures/asyn-feed', "rb") as f:
+        sbuf = CMSampleBuffer.from_bytesVideo(f.read()[20:])
+    sock = receiver()
+    address = sock.getsockname()
+    sdpPath = str(tmp_path / 'stream.sdp')
+    consumer = SocketUDP(broadcast=address, rtp=True, mtu=1200, sdpPath=sdpPath)
+    consumer.consume(sbuf)
+    count = consumer.packetizer.packetCount
+    packets = [sock.recv(2048) for _ in range(count)]
+    consumer.stop()
+    sock.close()
+    nalus, markers, _ = depacketize(packets)
+    sps, pps = classify_parameter_sets(sbuf.FormatDescription)
+    assert [sps, pps] + [nalu.data.tobytes() for nalu in iter_nalus(sbuf.SampleData)] == nalus
+    assert 1 == markers[-1] and 1 == sum(markers)
+    with open(sdpPath) as f:
+        sdp = f.read()
+    assert f'm=video {address[1]} RTP/AVP 96' in sdp
+    assert 'profile-level-id=640033' in sdp
@@ -1,6 +1,9 @@
 import struct
 
-from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.asyn import AsynCmSampleBufPacket
+from ioscreen.coremedia.CMFormatDescription import FormatDescriptorCache
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer, CMSampleConst, SampleTimingTable, parse_stia, \
+    parse_samples_list
 from ioscreen.coremedia.CMTime import CMTimeConst
 
 
@@ -78,4 +81,86 @@ def test_CMSampleBufferAudioNoFdsc():
     print(sbufPacket)
 
 
+def test_CMSampleBufferZeroCopy():
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = bytearray(f.read())
+    sbufPacket = CMSampleBuffer.from_bytesVideo(memoryview(data)[20:])
+    assert isinstance(sbufPacket.SampleData, memoryview)
+    assert sbufPacket.SampleData.obj is data
+    sbufPacket.materialize()
+    assert isinstance(sbufPacket.SampleData, bytes)
+    assert 90750 == len(sbufPacket.SampleData)
 
+
+def test_CMSampleBufferLazyAtoms():
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()
+    sbufPacket = CMSampleBuffer.from_bytesVideo(data[20:])
+    assert sbufPacket._sattBytes is not None
+    assert sbufPacket._fdscBytes is not None
+    assert 4 == len(sbufPacket.Attachments)
+    assert sbufPacket._sattBytes is None
+    assert sbufPacket.FormatDescription is sbufPacket.FormatDescription
+
+
+def test_SampleTimingTable():
+    timings = struct.pack('<qiIq', 0, 0, 0, 0) + struct.pack('<qiIq', 3000000000, 1000000000, 1, 0) + \
+              struct.pack('<qiIq', 0, 0, 0, 0)
+    timings += struct.pack('<qiIq', 1, 48000, 1, 0) + struct.pack('<qiIq', 96000, 48000, 1, 0) + \
+               struct.pack('<qiIq', 0, 0, 0, 0)
+    sizes = struct.pack('<III', 4, 8, 12)
+    data = struct.pack('<II', 8 + len(timings), CMSampleConst.stia) + timings + \
+           struct.pack('<II', 8 + len(sizes), CMSampleConst.ssiz) + sizes
+
+    table = parse_stia(data)
+    assert 2 == len(table)
+    assert 3 == table[0].PresentationTimeStamp.seconds()
+    assert 1 == table[-1].Duration.CMTimeValue
+    assert [270000, 180000] == list(table.to_90khz())
+    assert [3.0, 2.0] == list(table.seconds())
+    assert [0, 1] == list(table.rescale(48000, SampleTimingTable.Duration))
+    assert [4, 8, 12] == list(parse_samples_list(data, 8 + len(timings)))
+
+
+def test_CMSampleBufferSlots():
+    with open('./fixtures/asyn-eat', "rb") as f:
+        data = f.read()
+    packet = AsynCmSampleBufPacket.from_bytes(data)
+    assert not hasattr(packet, '__dict__')
+    assert not hasattr(packet.CMSampleBuf, '__dict__')
+    assert not hasattr(packet.CMSampleBuf.SampleTimingInfoArray[0], '__dict__')
+
+
+def test_FormatDescriptorCache():
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()
+    formatCache = FormatDescriptorCache()
+    first = CMSampleBuffer.from_bytesVideo(data[20:], formatCache)
+    second = CMSampleBuffer.from_bytesVideo(data[20:], formatCache)
+    assert first.FormatChanged
+    assert not second.FormatChanged
+    assert first.FormatDescription is second.FormatDescription
+    assert 1 == formatCache.hits
+
+    sps = bytes(first.FormatDescription.PPS)
+    changed = bytearray(data)
+    index = changed.index(sps)
+    changed[index + len(sps) - 1] ^= 0xff
+    third = CMSampleBuffer.from_bytesVideo(bytes(changed[20:]), formatCache)
+    assert third.FormatChanged
+    assert third.FormatDescription.PPS != sps
+    assert not CMSampleBuffer.from_bytesVideo(bytes(changed[20:]), formatCache).FormatChanged
+
+
+def test_FormatDescriptorCacheLazy():
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()
+    formatCache = FormatDescriptorCache()
+    dropped = CMSampleBuffer.from_bytesVideo(data[20:], formatCache)
+    kept = CMSampleBuffer.from_bytesVideo(data[20:], formatCache).materialize()
+    assert dropped.HasFormatDescription
+    # 解析时不查缓存, 没有被访问的 sample 不影响 FormatChanged
+    assert 0 == formatCache.hits + formatCache.misses
+    assert kept.FormatChanged
+    assert 1 == formatCache.misses
+    assert kept.FormatDescription.VideoDimensionWidth
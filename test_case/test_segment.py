@@ -0,0 +1,50 @@
+import os
+import struct
+
+from ioscreen.coremedia.CMSampleBuffer import CMSampleBuffer
+from ioscreen.coremedia.nalu import startCode
+from ioscreen.coremedia.segment import SegmentedWriter
+
+
+def video_frame(index):
+    with open('./fixtures/asyn-feed', "rb") as f:
+        sbuf = CMSampleBuffer.from_bytesVideo(f.read()[20:])
+    sbuf.OutputPresentationTimestamp.CMTimeValue += index * 1000000000 // 60
+    return sbuf
+
+
+def audio_frame():
+    with open('./fixtures/asyn-eat', "rb") as f:
+        return CMSampleBuffer.from_bytesAudio(f.read()[16:])
+
+
+def record(directory, frames, **kwargs):
+    writer = SegmentedWriter(directory, maxDuration=0.02, **kwargs)
+    for i in range(frames):
+        writer.consume(video_frame(i))
+        writer.consume(audio_frame())
+    writer.stop()
+    return writer
+
+
+def test_segment_rotation(tmp_path):
+    writer = record(str(tmp_path), 4)
+    assert 2 == writer.nextIndex
+    assert ['ioscreen-00000.h264', 'ioscreen-00000.wav', 'ioscreen-00001.h264', 'ioscreen-00001.wav'] == \
+           sorted(os.listdir(str(tmp_path)))
+    sps = bytes(video_frame(0).FormatDescription.PPS)
+    for index in range(2):
+        with open(str(tmp_path / f'ioscreen-{index:05d}.h264'), 'rb') as f:
+            assert startCode + sps == f.read(4 + len(sps))
+        with open(str(tmp_path / f'ioscreen-{index:05d}.wav'), 'rb') as f:
+            data = f.read()
+        assert b'RIFF' == data[:4]
+        assert 2 * 4096 == struct.unpack_from('<I', data, 40)[0] == len(data) - 44
+
+
+def test_segment_disk_budget(tmp_path):
+    writer = record(str(tmp_path), 6, diskBudget=400000)
+    assert 3 == writer.nextIndex
+    assert 1 <= writer.deletedSegments
+    assert 'ioscreen-00000.h264' not in os.listdir(str(tmp_path))
+    assert 'ioscreen-00002.h264' in os.listdir(str(tmp_path))
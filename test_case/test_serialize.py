@@ -1,6 +1,14 @@
+import os
+import struct
+import subprocess
+import sys
+
+import pytest
+
 from ioscreen.asyn import create_hpa1_device, create_hpd1_device
+from ioscreen.coremedia.common import NSNumber
 from ioscreen.coremedia.serialize import SerializeStringKeyDict, new_dictionary_from_bytes, DictConst, \
-    new_string_dict_from_bytes
+    new_string_dict_from_bytes, serialize_value
 
 
 def test_BooleanSerialization():
@@ -58,4 +66,72 @@ def test_ComplexDict():
     print(mydict)
 
 
+def test_DisplaySizeDict():
+    serializedBytes = SerializeStringKeyDict(create_hpd1_device(1280, 720)).to_bytes()
+    mydict = new_string_dict_from_bytes(serializedBytes)
+    assert 1280.0 == mydict.get('DisplaySize').get('Width').value
+    assert 720.0 == mydict.get('DisplaySize').get('Height').value
+    assert mydict.get('Valeria')
+
+
+def test_SerializeTwice():
+    serializedDict = SerializeStringKeyDict(create_hpd1_device())
+    data = serializedDict.to_bytes()
+    assert data == serializedDict.to_bytes()
+    assert len(data) == serializedDict.size()
+    buf = bytearray(4 + len(data))
+    assert len(buf) == serializedDict.pack_into(buf, 4)
+    assert data == buf[4:]
+
+
+def test_DictKeyFilter():
+    with open('./fixtures/dict.bin', "rb") as f:
+        data = f.read()
+    mydict = new_string_dict_from_bytes(data, keys={'DisplaySize'})
+    assert ['DisplaySize'] == list(mydict)
+    assert 1200.0 == mydict['DisplaySize']['Height'].value
+
+    with open('./fixtures/intdict.bin', "rb") as f:
+        data = f.read()
+    full = new_dictionary_from_bytes(data, DictConst.DictionaryMagic)
+    key = list(full)[-1]
+    assert [key] == list(new_dictionary_from_bytes(data, DictConst.DictionaryMagic, keys={key}))
+
+
+def test_NestedDictRoundTrip():
+    data = SerializeStringKeyDict({'outer': {'inner': 'value'}, 'flag': False}).to_bytes()
+    assert {'outer': {'inner': 'value'}, 'flag': False} == new_string_dict_from_bytes(data)
+
 
+def test_UnsupportedValueSerialization():
+    for value in (1, 1.5, None, NSNumber(9, 1)):
+        with pytest.raises(TypeError):
+            SerializeStringKeyDict({'key': value}).to_bytes()
+        with pytest.raises(TypeError):
+            serialize_value(value)
+
+
+def dict_with_value(value):
+    key = struct.pack('<II', 9, DictConst.StringKey) + b'f'
+    pair = struct.pack('<II', 8 + len(key) + len(value), DictConst.KeyValuePairMagic) + key + value
+    return struct.pack('<II', 8 + len(pair), DictConst.DictionaryMagic) + pair
+
+
+def test_FormatDescriptorValueWithoutImport(tmp_path):
+    with open('./fixtures/asyn-feed', "rb") as f:
+        data = f.read()
+    index = data.index(b'csdf') - 4
+    fdsc = data[index:index + struct.unpack_from('<I', data, index)[0]]
+    path = tmp_path / 'dict.bin'
+    path.write_bytes(dict_with_value(fdsc))
+    # 新进程中只导入 serialize, fdsc 的解析在第一次遇到时注册
+    code = ('import sys; from ioscreen.coremedia import serialize; '
+            'print(type(serialize.new_string_dict_from_bytes(open(sys.argv[1], "rb").read())["f"]).__name__)')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath('.')))
+    output = subprocess.run([sys.executable, '-c', code, str(path)], env=env, check=True, stdout=subprocess.PIPE)
+    assert b'FormatDescriptor' == output.stdout.strip()
+
+
+def test_UnknownValueMagic():
+    with pytest.raises(Exception, match='unknown value magic'):
+        new_string_dict_from_bytes(dict_with_value(struct.pack('<II', 8, 0x78787878)))
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from ioscreen.stream import ByteStream
+
+
+def test_byte_stream_split_read():
+    stream = ByteStream()
+    stream.put(b'\x01\x02\x03')
+    stream.put(b'\x04\x05')
+    stream.put(b'\x06')
+    assert b'\x01\x02' == bytes(stream.get(2))
+    assert b'\x03\x04\x05\x06' == bytes(stream.get(4))
+    assert 0 == len(stream)
+
+
+def test_byte_stream_zero_copy():
+    chunk = bytearray(b'abcdefgh')
+    stream = ByteStream()
+    stream.put(chunk)
+    stream.put(bytearray(b'ijkl'))
+    # 同一块内直接引用原 buffer
+    view = stream.get(4)
+    assert isinstance(view, memoryview)
+    assert view.obj is chunk
+    # 跨块时拷贝到新的 buffer
+    view = stream.get(6)
+    assert b'efghij' == bytes(view)
+    assert view.obj is not chunk
+    chunk[4:] = b'XXXX'
+    assert b'efghij' == bytes(view)
+    assert b'kl' == bytes(stream.get(2))
+
+
+def test_byte_stream_timeout():
+    stream = ByteStream()
+    stream.put(b'abc')
+    start = time.monotonic()
+    assert stream.get(4, timeout=0.05) is None
+    assert time.monotonic() - start >= 0.05
+    # 超时不会消耗已有数据
+    assert 3 == len(stream)
+    stream.put(b'd')
+    assert b'abcd' == bytes(stream.get(4, timeout=0.05))
+
+
+def test_byte_stream_close_wakes_get():
+    stream = ByteStream()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(stream.get(4, timeout=None)))
+    thread.start()
+    time.sleep(0.05)
+    assert thread.is_alive()
+    stream.close()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert [None] == result
+
+
+def test_byte_stream_put_wakes_get():
+    stream = ByteStream()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(bytes(stream.get(4, timeout=2))))
+    thread.start()
+    time.sleep(0.02)
+    stream.put(b'ab')
+    stream.put(b'cd')
+    thread.join(2)
+    assert [b'abcd'] == result
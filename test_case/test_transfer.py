@@ -0,0 +1,59 @@
+import array
+import threading
+
+from ioscreen.transfer import BulkReader, UsbWriter, WritePriority
+
+
+class FakeDevice:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def read(self, endpoint, size, timeout):
+        if not self.chunks:
+            raise Exception('Operation timed out')
+        return array.array('B', self.chunks.pop(0)[:size])
+
+
+def test_bulk_reader_sync_fallback():
+    received = []
+    errors = []
+    done = threading.Event()
+
+    def onError(E):
+        errors.append(E)
+        done.set()
+
+    reader = BulkReader(FakeDevice([b'abc', b'defg']), 0x81, onData=lambda data: received.append(bytes(data)),
+                        onError=onError, queueDepth=2, transferSize=16).start()
+    assert done.wait(2)
+    reader.stop()
+    assert [b'abc', b'defg'] == received
+    assert 1 == len(errors)
+
+
+def test_usb_writer_priority_and_coalescing():
+    written = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def write(data):
+        if data == b'first':
+            started.set()
+            release.wait(2)
+        written.append(data)
+
+    writer = UsbWriter(write).start()
+    writer.put(b'first')
+    assert started.wait(2)
+    writer.put(b'hpd1')
+    writer.put(b'need', key='need')
+    writer.put(b'need', key='need')
+    writer.put(b'time', WritePriority.Urgent)
+    release.set()
+    assert writer.flush(2)
+    writer.stop()
+    assert [b'first', b'time', b'hpd1', b'need'] == written
+    stats = writer.stats()
+    assert 4 == stats['writes']
+    assert 1 == stats['coalesced']
+    assert not writer.put(b'late')